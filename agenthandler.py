@@ -1,120 +1,354 @@
 import pandas as pd
 import openai
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import json
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ratelimiter import get_rate_limiter
+from configstore import save_config
+from fileregistry import get_file_registry
+from tracing import span, propagate
 from typing import Literal
 
-class AgentHandler():
+def get_agent_fingerprint(instructions:str, model:str, tools:list, tool_resources:dict) -> str:
+
+	"""
+	Hash of the config that is pushed to the assistant in OpenAI.
+	Stored in assistants.json as 'fingerprint' after every push, so an unchanged config isn't pushed again.
+	"""
+
+	config = {
+		'instructions': instructions,
+		'model': model,
+		'tools': tools,
+		'tool_resources': tool_resources or {}
+	}
+
+	return hashlib.sha256(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+
+class _BaseAgentHandler():
+
+	# Everything that doesn't talk to OpenAI, shared by AgentHandler and AsyncAgentHandler
+	# The subclasses only do the API calls
 
-	# NOTE: assistants.json() will no longer have file_ids
-	# If we want to assign a file, we have to do it manually
 	def __init__(
 			self,
-			client:OpenAI, 
-			new:bool,
-			dic_file:dict,
+			client,
 			assistant_name:str,
-			instructions:str = None,
-			model:str = None,
-			tools:list = [],
-			tool_resources: dict = {},
-			files:list = [],
+			files:list=[],
 			dic_file_name:str='assistants.json',
 			dic_file_path:str='config/'
 			):
-		
+
 		self._client = client
 		self.assistant_name = assistant_name
 		self._dic_file_name = dic_file_name
 		self._dic_file_path = dic_file_path
 		self.files = files
-		
-		# If creating a new assistant/agent
-		if new:
-			if instructions is None or model is None:
-				raise ValueError('Assistant property is incomplete for creating a new assistant.')
-
-			self.assistant = client.beta.assistants.create(
-				name=assistant_name,
-				instructions=instructions,
-				model=model,
-				tools=tools,
-				tool_resources=tool_resources
-			)
+		self.assistant = None
+		self.assistant_id = None
 
-			print(f'New assistant has been created, name: {assistant_name}, id: {self.assistant.id}')
+		# The config the assistant should have, pushed to OpenAI by sync() when it differs from the last pushed one
+		self._config = {}
 
-			self.assistant_id = self.assistant.id
+	def _new_agent_kwargs(self, instructions:str, model:str, tools:list, tool_resources:dict) -> dict:
 
-			dic_file[assistant_name] = {}
-			dic_file[assistant_name]['id'] = self.assistant_id
-			dic_file[assistant_name]['instructions'] = instructions
-			dic_file[assistant_name]['model'] = model
-			dic_file[assistant_name]['tools'] = tools
-			dic_file[assistant_name]['tool_resources'] = tool_resources
+		if instructions is None or model is None:
+			raise ValueError('Assistant property is incomplete for creating a new assistant.')
 
-			self._dic_agent = dic_file
+		return {
+			'name': self.assistant_name,
+			'instructions': instructions,
+			'model': model,
+			'tools': tools,
+			'tool_resources': tool_resources
+		}
 
-			with open(f"{self._dic_file_path}{self._dic_file_name}", 'w') as json_file:
-				json.dump(self._dic_agent, json_file, indent='\t')
-				print(f"{self._dic_file_path}{self._dic_file_name} file has been updated")
+	def _record_new_agent(self, dic_file:dict, instructions:str, model:str, tools:list, tool_resources:dict):
 
-		# If using an existing assistant/agent
-		else:
-			self._dic_agent = dic_file
-			self.assistant_id = dic_file[assistant_name]['id']
-			self.assistant = client.beta.assistants.update(
-				assistant_id=dic_file[assistant_name]['id'], 
-				instructions=dic_file[assistant_name]['instructions'],
-				model=dic_file[assistant_name]['model'],
-				tools=dic_file[assistant_name]['tools'],
-				tool_resources={} 
-			)
+		print(f'New assistant has been created, name: {self.assistant_name}, id: {self.assistant.id}')
 
-			print(f'Assistant has been updated, name: {assistant_name}, id: {self.assistant.id}')
-  
-	def update_agent(self, instructions:str=None, model:str=None, tools:list=None, agent_files:list=None):
+		self.assistant_id = self.assistant.id
+
+		self._config = {
+			'instructions': instructions,
+			'model': model,
+			'tools': tools,
+			'tool_resources': tool_resources
+		}
+
+		dic_file[self.assistant_name] = {}
+		dic_file[self.assistant_name]['id'] = self.assistant_id
+		dic_file[self.assistant_name]['instructions'] = instructions
+		dic_file[self.assistant_name]['model'] = model
+		dic_file[self.assistant_name]['tools'] = tools
+		dic_file[self.assistant_name]['tool_resources'] = tool_resources
+		dic_file[self.assistant_name]['fingerprint'] = self.fingerprint
+
+		self._dic_agent = dic_file
+
+		self._save_dic_file()
+		self._record_agent_files()
+
+	def _load_existing_agent(self, dic_file:dict):
+
+		# Nothing is sent to OpenAI here, sync() pushes the config before the agent's first run if it changed
+		self._dic_agent = dic_file
+		self.assistant_id = dic_file[self.assistant_name]['id']
+
+		# NOTE: tool_resources (files) aren't taken from dic_file, they're given with update_agent(agent_files=...)
+		self._config = {
+			'instructions': dic_file[self.assistant_name]['instructions'],
+			'model': dic_file[self.assistant_name]['model'],
+			'tools': dic_file[self.assistant_name]['tools'],
+			'tool_resources': {}
+		}
+
+		# The files the assistant still has from the last push stay referenced until the next sync replaces them
+		if 'tool_resources' in dic_file[self.assistant_name]:
+			self._record_agent_files(tool_resources=dic_file[self.assistant_name]['tool_resources'])
+
+		print(f'Assistant has been loaded, name: {self.assistant_name}, id: {self.assistant_id}')
+
+	@property
+	def fingerprint(self) -> str:
+		return get_agent_fingerprint(**self._config)
+
+	@property
+	def needs_sync(self) -> bool:
+
+		# The fingerprint in dic_file is the one of the config last pushed to OpenAI
+		return self.fingerprint != self._dic_agent[self.assistant_name].get('fingerprint')
+
+	def _update_agent_config(self, instructions:str=None, model:str=None, tools:list=None, agent_files:list=None):
+
+		if instructions is not None:
+			self._config['instructions'] = instructions
+			self._dic_agent[self.assistant_name]['instructions'] = instructions
+
+		if model is not None:
+			self._config['model'] = model
+			self._dic_agent[self.assistant_name]['model'] = model
+
+		if tools is not None:
+			self._config['tools'] = tools
+			self._dic_agent[self.assistant_name]['tools'] = tools
 
-		if instructions is None:
-			instructions = self._dic_agent[self.assistant_name]['instructions']
-		else:
-			self.dic_agent['instructions'] = instructions
-   
-		if model is None:
-			model = self._dic_agent[self.assistant_name]['model']
-		else:
-			self.dic_agent['model'] = model
-   
-		if tools is None:
-			tools = self._dic_agent[self.assistant_name]['tools']
-		else:
-			self.dic_agent['tools'] = tools
-   
 		if agent_files is None:
-			tool_resources = {}
+			self._config['tool_resources'] = {}
 		else:
-			tool_resources = {
+			self._config['tool_resources'] = {
 				'code_interpreter': {
 					'file_ids': agent_files
 				}
 			}
 
 			self.files = agent_files
-		
-		self.assistant = self._client.beta.assistants.update(
-			assistant_id = self.assistant_id,
-			instructions = instructions,
-			model = model,
-			tools = tools,
-			tool_resources = tool_resources
-		)
+
+	def _sync_kwargs(self) -> dict:
+
+		return {
+			'assistant_id': self.assistant_id,
+			**self._config
+		}
+
+	def _record_sync(self, fingerprint:str):
 
 		print(f"assistant_id: {self.assistant_id} has been updated.")
-  
-		# dic_file[assistant_name] = self._dic_agent
-  
+
+		self._dic_agent[self.assistant_name]['fingerprint'] = fingerprint
+		self._dic_agent[self.assistant_name]['tool_resources'] = self._config['tool_resources']
+
 		print(f"{self.assistant_name} properties in main dictionary has been updated.")
 
-		with open(f"{self._dic_file_path}{self._dic_file_name}", 'w') as json_file:
-			json.dump(self._dic_agent, json_file, indent='\t')
-			print(f"{self._dic_file_path}{self._dic_file_name} file has been updated")
\ No newline at end of file
+		self._save_dic_file()
+		self._record_agent_files()
+
+	def _record_agent_files(self, tool_resources:dict=None):
+
+		# The files in the assistant's tool_resources as pushed to OpenAI
+		if tool_resources is None:
+			tool_resources = self._config.get('tool_resources')
+
+		file_ids = (tool_resources or {}).get('code_interpreter', {}).get('file_ids', [])
+
+		get_file_registry().set_refs(ref=f'assistant:{self.assistant_id}', file_ids=file_ids)
+
+	def _save_dic_file(self):
+
+		# Only this agent's entry is written, together with other changes made around the same time (see configstore.py)
+		save_config(dic_file=self._dic_agent, path=f"{self._dic_file_path}{self._dic_file_name}", keys=[self.assistant_name])
+
+class AgentHandler(_BaseAgentHandler):
+
+	# NOTE: assistants.json() will no longer have file_ids
+	# If we want to assign a file, we have to do it manually
+	def __init__(
+			self,
+			client:OpenAI,
+			new:bool,
+			dic_file:dict,
+			assistant_name:str,
+			instructions:str = None,
+			model:str = None,
+			tools:list = [],
+			tool_resources: dict = {},
+			files:list = [],
+			dic_file_name:str='assistants.json',
+			dic_file_path:str='config/'
+			):
+
+		super().__init__(
+			client=client,
+			assistant_name=assistant_name,
+			files=files,
+			dic_file_name=dic_file_name,
+			dic_file_path=dic_file_path
+		)
+
+		# Several threads can run the same agent at once
+		self._sync_lock = threading.Lock()
+
+		# If creating a new assistant/agent
+		if new:
+			self.assistant = get_rate_limiter().call(
+				client.beta.assistants.create,
+				**self._new_agent_kwargs(instructions=instructions, model=model, tools=tools, tool_resources=tool_resources)
+			)
+
+			self._record_new_agent(dic_file=dic_file, instructions=instructions, model=model, tools=tools, tool_resources=tool_resources)
+
+		# If using an existing assistant/agent
+		else:
+			self._load_existing_agent(dic_file=dic_file)
+
+	def sync(self, force:bool=False) -> bool:
+
+		"""
+		Pushes the agent's config to OpenAI if it changed since the last push (or always if force is True).
+		Called before every run, so it's rarely needed to call it directly.
+		Returns True if the assistant was updated.
+		"""
+
+		with self._sync_lock:
+
+			if not force and not self.needs_sync:
+				return False
+
+			fingerprint = self.fingerprint
+
+			with span('agent_sync', agent=self.assistant_name):
+				self.assistant = get_rate_limiter().call(self._client.beta.assistants.update, **self._sync_kwargs())
+
+			self._record_sync(fingerprint=fingerprint)
+
+		return True
+
+	def update_agent(self, instructions:str=None, model:str=None, tools:list=None, agent_files:list=None):
+
+		# Only the local config is changed, it's pushed to OpenAI by sync() before the agent's next run
+		self._update_agent_config(instructions=instructions, model=model, tools=tools, agent_files=agent_files)
+
+class AsyncAgentHandler(_BaseAgentHandler):
+
+	"""
+	Same as AgentHandler, but on the AsyncOpenAI client.
+	__init__ can't await, so create it with:
+	agent = await AsyncAgentHandler.create(client=get_async_client(), new=False, dic_file=dic_file, assistant_name=name)
+	"""
+
+	@classmethod
+	async def create(
+			cls,
+			client:AsyncOpenAI,
+			new:bool,
+			dic_file:dict,
+			assistant_name:str,
+			instructions:str = None,
+			model:str = None,
+			tools:list = [],
+			tool_resources: dict = {},
+			files:list = [],
+			dic_file_name:str='assistants.json',
+			dic_file_path:str='config/'
+			) -> 'AsyncAgentHandler':
+
+		self = cls(
+			client=client,
+			assistant_name=assistant_name,
+			files=files,
+			dic_file_name=dic_file_name,
+			dic_file_path=dic_file_path
+		)
+
+		self._sync_lock = asyncio.Lock()
+
+		if new:
+			self.assistant = await get_rate_limiter().acall(
+				client.beta.assistants.create,
+				**self._new_agent_kwargs(instructions=instructions, model=model, tools=tools, tool_resources=tool_resources)
+			)
+
+			self._record_new_agent(dic_file=dic_file, instructions=instructions, model=model, tools=tools, tool_resources=tool_resources)
+
+		else:
+			self._load_existing_agent(dic_file=dic_file)
+
+		return self
+
+	async def sync(self, force:bool=False) -> bool:
+
+		# See AgentHandler.sync()
+
+		async with self._sync_lock:
+
+			if not force and not self.needs_sync:
+				return False
+
+			fingerprint = self.fingerprint
+
+			with span('agent_sync', agent=self.assistant_name):
+				self.assistant = await get_rate_limiter().acall(self._client.beta.assistants.update, **self._sync_kwargs())
+
+			self._record_sync(fingerprint=fingerprint)
+
+		return True
+
+	async def update_agent(self, instructions:str=None, model:str=None, tools:list=None, agent_files:list=None):
+
+		self._update_agent_config(instructions=instructions, model=model, tools=tools, agent_files=agent_files)
+
+def sync_all(agents:list[AgentHandler], max_workers:int=8) -> int:
+
+	"""
+	Syncs many agents at once (i.e. every agent of a MultiNodeManager before its run).
+	Only the agents whose config changed make an API call and those calls run concurrently.
+	Their entries in assistants.json go into one write.
+	Returns the number of agents that were updated.
+	"""
+
+	agents = list(dict.fromkeys(agents))
+	agents_to_sync = [agent for agent in agents if agent.needs_sync]
+
+	if len(agents_to_sync) == 0:
+		return 0
+
+	with ThreadPoolExecutor(max_workers=min(max_workers, len(agents_to_sync))) as executor:
+		synced = list(executor.map(propagate(lambda agent: agent.sync()), agents_to_sync))
+
+	return sum(synced)
+
+async def sync_all_async(agents:list[AsyncAgentHandler]) -> int:
+
+	# Same as sync_all() for AsyncAgentHandler, the rate limiter bounds how many calls go out at once
+	agents = list(dict.fromkeys(agents))
+	agents_to_sync = [agent for agent in agents if agent.needs_sync]
+
+	if len(agents_to_sync) == 0:
+		return 0
+
+	synced = await asyncio.gather(*[agent.sync() for agent in agents_to_sync])
+
+	return sum(synced)
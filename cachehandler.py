@@ -0,0 +1,142 @@
+import os
+import time
+import pickle
+import sqlite3
+import hashlib
+import pandas as pd
+from contextlib import closing
+from urllib.parse import urlsplit, urlunsplit
+
+def normalize_url(url:str) -> str:
+
+	"""
+	Key of an article link, the same story is often linked with different tracking parameters.
+	Query string, fragment and trailing slash are removed and the host is lowercased.
+	"""
+
+	parts = urlsplit(url.strip())
+
+	return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'), '', ''))
+
+def get_text_hash(text:str) -> str:
+	return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class CacheHandler():
+
+	"""
+	Local cache of DataFrames in a SQLite database, keyed by dataset (i.e. 'history_5y', 'quarterly_cashflow') and ticker.
+	Parsed news articles are cached in the same database, keyed by their normalized url (see normalize_url()).
+	Every method opens its own connection, so the cache can be used from multiple threads.
+	"""
+
+	def __init__(self, db_path:str='cache/yfinance.db'):
+
+		self.db_path = db_path
+
+		os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+
+		with closing(self._connect()) as conn, conn:
+			conn.execute(
+				'CREATE TABLE IF NOT EXISTS frames ('
+				'dataset TEXT NOT NULL, '
+				'ticker TEXT NOT NULL, '
+				'fetched_at REAL NOT NULL, '
+				'data BLOB NOT NULL, '
+				'PRIMARY KEY (dataset, ticker))'
+			)
+			conn.execute(
+				'CREATE TABLE IF NOT EXISTS articles ('
+				'url_key TEXT PRIMARY KEY, '
+				'url TEXT NOT NULL, '
+				'text TEXT NOT NULL, '
+				'fetched_at REAL NOT NULL, '
+				'content_hash TEXT NOT NULL)'
+			)
+			# content_hash is only read with the article (stories are deduplicated in memory, see YFHandler._get_articles()),
+			# an index on it was never queried, it's dropped from caches that still have it
+			conn.execute('DROP INDEX IF EXISTS articles_content_hash')
+
+	def _connect(self) -> sqlite3.Connection:
+		return sqlite3.connect(self.db_path, timeout=30)
+
+	def get(self, dataset:str, ticker:str) -> tuple:
+
+		"""
+		Returns (DataFrame, fetched_at) of the cached data, (None, None) if it's not cached.
+		fetched_at is the unix time the data was stored.
+		"""
+
+		with closing(self._connect()) as conn:
+			row = conn.execute(
+				'SELECT data, fetched_at FROM frames WHERE dataset = ? AND ticker = ?',
+				(dataset, ticker)
+			).fetchone()
+
+		if row is None:
+			return None, None
+
+		return pickle.loads(row[0]), row[1]
+
+	def put(self, dataset:str, ticker:str, df:pd.DataFrame):
+
+		with closing(self._connect()) as conn, conn:
+			conn.execute(
+				'INSERT OR REPLACE INTO frames (dataset, ticker, fetched_at, data) VALUES (?, ?, ?, ?)',
+				(dataset, ticker, time.time(), pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL))
+			)
+
+	def get_articles(self, urls:list) -> dict:
+
+		"""
+		Returns the cached articles of urls {url: {'text': ..., 'fetched_at': ..., 'content_hash': ...}}.
+		Urls that aren't cached are left out.
+		"""
+
+		dic_url_keys = {url: normalize_url(url) for url in urls}
+		list_keys = list(set(dic_url_keys.values()))
+		dic_rows = {}
+
+		with closing(self._connect()) as conn:
+
+			# SQLite limits the number of parameters in one query
+			for i in range(0, len(list_keys), 500):
+				list_batch = list_keys[i:i+500]
+				rows = conn.execute(
+					f"SELECT url_key, text, fetched_at, content_hash FROM articles WHERE url_key IN ({','.join('?' * len(list_batch))})",
+					list_batch
+				).fetchall()
+
+				for url_key, text, fetched_at, content_hash in rows:
+					dic_rows[url_key] = {'text': text, 'fetched_at': fetched_at, 'content_hash': content_hash}
+
+		return {url: dic_rows[url_key] for url, url_key in dic_url_keys.items() if url_key in dic_rows}
+
+	def put_articles(self, dic_articles:dict):
+
+		"""Stores parsed articles {url: (text, content_hash)}, content_hash is get_text_hash(text)."""
+
+		now = time.time()
+
+		with closing(self._connect()) as conn, conn:
+			conn.executemany(
+				'INSERT OR REPLACE INTO articles (url_key, url, text, fetched_at, content_hash) VALUES (?, ?, ?, ?, ?)',
+				[(normalize_url(url), url, text, now, content_hash) for url, (text, content_hash) in dic_articles.items()]
+			)
+
+	def delete(self, dataset:str=None, ticker:str=None):
+
+		"""Deletes cached data of a dataset and/or ticker, everything if neither is given."""
+
+		query = 'DELETE FROM frames WHERE 1=1'
+		params = []
+
+		if dataset is not None:
+			query += ' AND dataset = ?'
+			params.append(dataset)
+
+		if ticker is not None:
+			query += ' AND ticker = ?'
+			params.append(ticker)
+
+		with closing(self._connect()) as conn, conn:
+			conn.execute(query, params)
@@ -0,0 +1,56 @@
+### Shared OpenAI clients ###
+
+import asyncio
+import threading
+import weakref
+from openai import OpenAI, AsyncOpenAI
+
+# The clients don't retry themselves (max_retries=0): 429s, 5xx, 408/409 and connection errors are retried by the shared rate limiter,
+# which pauses every caller on a 429 (see ratelimiter.py). With the SDK's own retries the limiter would rarely see a 429.
+_CLIENT_DEFAULTS = {'max_retries': 0}
+
+def get_client(**client_kwargs) -> OpenAI:
+
+	"""
+	Returns a new OpenAI client that leaves the retries to the rate limiter.
+	client_kwargs (i.e. api_key, timeout) are passed to OpenAI().
+	"""
+
+	return OpenAI(**{**_CLIENT_DEFAULTS, **client_kwargs})
+
+# An AsyncOpenAI client keeps one httpx connection pool, so everything on an event loop should share one client
+# The pool is tied to the event loop it was first used on, hence one client per loop
+_async_clients = weakref.WeakKeyDictionary()
+_async_clients_lock = threading.Lock()
+
+def get_async_client(**client_kwargs) -> AsyncOpenAI:
+
+	"""
+	Returns the AsyncOpenAI client of the running event loop, creating it on the first call.
+	client_kwargs (i.e. api_key, timeout) are only used when the client is created, max_retries is 0 unless given.
+	Has to be called from inside a coroutine.
+	"""
+
+	loop = asyncio.get_running_loop()
+
+	with _async_clients_lock:
+
+		client = _async_clients.get(loop)
+
+		if client is None:
+			client = AsyncOpenAI(**{**_CLIENT_DEFAULTS, **client_kwargs})
+			_async_clients[loop] = client
+
+	return client
+
+async def close_async_client():
+
+	"""
+	Closes the client of the running event loop (and its connections), if there is one.
+	"""
+
+	with _async_clients_lock:
+		client = _async_clients.pop(asyncio.get_running_loop(), None)
+
+	if client is not None:
+		await client.close()
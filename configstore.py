@@ -0,0 +1,245 @@
+import os
+import json
+import atexit
+import sqlite3
+import tempfile
+import threading
+from contextlib import closing, contextmanager
+from collections.abc import MutableMapping
+
+# fcntl is only on Unix, elsewhere the file lock only covers this process
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+class ConfigStore(MutableMapping):
+
+	"""
+	In-memory copy of a config file (i.e. assistants.json, openai_files.json) that writes its changes in batches.
+	Setting or deleting a key marks it dirty and schedules a write debounce seconds later,
+	so many changes in a short time make one write. Nested changes (store[key]['id'] = ...) are marked with touch(key).
+
+	Only the dirty keys are written: the file is read again under a file lock and the dirty keys are put into it,
+	so processes changing different keys don't overwrite each other.
+	JSON files are written to a temporary file which then replaces the file, so they're never left half written.
+	With backend='sqlite' every key is a row, for large agent and file registries.
+	"""
+
+	def __init__(self, path:str, backend:str='json', debounce:float=0.5):
+
+		if backend not in ('json', 'sqlite'):
+			raise ValueError(f'Unknown config store backend: {backend}')
+
+		self.path = path
+		self.backend = backend
+		self.debounce = debounce
+
+		self._lock = threading.RLock()
+		self._dirty_keys = set()
+		self._timer = None
+
+		if backend == 'sqlite':
+			with closing(sqlite3.connect(self.path)) as conn, conn:
+				conn.execute('CREATE TABLE IF NOT EXISTS config (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+		self._data = self._read()
+
+	def __getitem__(self, key):
+		return self._data[key]
+
+	def __setitem__(self, key, value):
+
+		with self._lock:
+			self._data[key] = value
+			self.touch(key)
+
+	def __delitem__(self, key):
+
+		with self._lock:
+			del self._data[key]
+			self.touch(key)
+
+	def __iter__(self):
+		return iter(self._data)
+
+	def __len__(self):
+		return len(self._data)
+
+	def to_dict(self) -> dict:
+		return dict(self._data)
+
+	def touch(self, key=None):
+
+		"""
+		Marks key (default: every key) as changed and schedules a write.
+		"""
+
+		with self._lock:
+
+			if key is None:
+				self._dirty_keys.update(self._data)
+			else:
+				self._dirty_keys.add(key)
+
+			# Changes coming in before the timer fires go into the same write
+			if self._timer is None:
+				self._timer = threading.Timer(self.debounce, self._flush_from_timer)
+				self._timer.daemon = True
+				self._timer.start()
+
+	def flush(self):
+
+		"""
+		Writes the dirty keys now.
+		"""
+
+		with self._lock:
+
+			if self._timer is not None:
+				self._timer.cancel()
+				self._timer = None
+
+			if len(self._dirty_keys) == 0:
+				return
+
+			dirty_keys = self._dirty_keys
+			self._dirty_keys = set()
+
+			try:
+				if self.backend == 'sqlite':
+					self._write_sqlite(dirty_keys=dirty_keys)
+				else:
+					self._write_json(dirty_keys=dirty_keys)
+			except Exception:
+				# Keep them for the next write
+				self._dirty_keys.update(dirty_keys)
+				raise
+
+		print(f"{self.path} file has been updated")
+
+	def _flush_from_timer(self):
+
+		# Nobody can catch an error in the timer's thread, the keys stay dirty for the next write (the next change, flush() or exit)
+		try:
+			self.flush()
+		except Exception as e:
+			print(f"{self.path} could not be written, retrying on the next write: {e!r}")
+
+	@contextmanager
+	def _file_lock(self):
+
+		# Separate lock file, because the config file itself is replaced on every write
+		with open(f'{self.path}.lock', 'a') as lock_file:
+
+			if fcntl is not None:
+				fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+			try:
+				yield
+			finally:
+				if fcntl is not None:
+					fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+	def _read(self) -> dict:
+
+		if self.backend == 'sqlite':
+			with closing(sqlite3.connect(self.path)) as conn:
+				return {key: json.loads(value) for key, value in conn.execute('SELECT key, value FROM config')}
+
+		if not os.path.exists(self.path):
+			return {}
+
+		with open(self.path, 'r') as json_file:
+			return json.load(json_file)
+
+	def _write_json(self, dirty_keys:set):
+
+		with self._file_lock():
+
+			# Another process may have written other keys since this store was loaded
+			dic_file = self._read()
+
+			for key in dirty_keys:
+				if key in self._data:
+					dic_file[key] = self._data[key]
+				else:
+					dic_file.pop(key, None)
+
+			file_dir = os.path.dirname(self.path) or '.'
+
+			with tempfile.NamedTemporaryFile('w', dir=file_dir, suffix='.tmp', delete=False) as json_file:
+				json.dump(dic_file, json_file, indent='\t')
+				temp_path = json_file.name
+
+			try:
+				os.replace(temp_path, self.path)
+			except OSError:
+				os.remove(temp_path)
+				raise
+
+	def _write_sqlite(self, dirty_keys:set):
+
+		rows_upsert = [(key, json.dumps(self._data[key])) for key in dirty_keys if key in self._data]
+		rows_delete = [(key,) for key in dirty_keys if key not in self._data]
+
+		# SQLite locks the database itself
+		with closing(sqlite3.connect(self.path, timeout=30)) as conn, conn:
+			conn.executemany('INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)', rows_upsert)
+			conn.executemany('DELETE FROM config WHERE key = ?', rows_delete)
+
+# One store per file, so every handler writing the same file shares the in-memory copy and the batched writes
+_config_stores = {}
+_config_stores_lock = threading.Lock()
+
+def get_config_store(path:str, backend:str=None, debounce:float=0.5) -> ConfigStore:
+
+	"""
+	Returns the ConfigStore of path, loading it on the first call.
+	The backend is sqlite for .db/.sqlite files, json otherwise.
+	"""
+
+	if backend is None:
+		backend = 'sqlite' if path.endswith(('.db', '.sqlite')) else 'json'
+
+	with _config_stores_lock:
+
+		key = os.path.abspath(path)
+
+		if key not in _config_stores:
+			_config_stores[key] = ConfigStore(path=path, backend=backend, debounce=debounce)
+
+		return _config_stores[key]
+
+def save_config(dic_file:dict, path:str, keys:list=None):
+
+	"""
+	Puts keys (default: every key) of dic_file into the store of path and schedules the write.
+	For callers that keep their config in a plain dict. If dic_file is the store itself, the keys are only marked.
+	Without keys the file is made the same as dic_file, so keys that were removed from dic_file are removed from the file.
+	"""
+
+	store = dic_file if isinstance(dic_file, ConfigStore) else get_config_store(path=path)
+
+	with store._lock:
+
+		if keys is None and store is not dic_file:
+			for key in [key for key in store if key not in dic_file]:
+				del store[key]
+
+		for key in (list(dic_file.keys()) if keys is None else keys):
+			if store is dic_file:
+				store.touch(key)
+			else:
+				store[key] = dic_file[key]
+
+def flush_all():
+
+	# Writes whatever is still waiting, i.e. before the process exits
+	with _config_stores_lock:
+		stores = list(_config_stores.values())
+
+	for store in stores:
+		store.flush()
+
+atexit.register(flush_all)
@@ -0,0 +1,160 @@
+import time
+import queue
+import threading
+from tracing import span, propagate
+
+# Put in a queue to tell the workers of a stage that there is no more item
+_STOP = object()
+
+class DataPipeline():
+
+	"""
+	Runs items through a chain of stages, i.e. fetch -> normalize -> serialize -> upload.
+	Every stage has its own worker thread(s) and stages are connected by bounded queues,
+	so while one item is being uploaded the next one can already be serialized or fetched.
+
+	stages has the following format:
+	[
+		(stage_name, function, n_workers),
+		(stage_name, function, n_workers)
+	]
+	The function of each stage takes the output of the previous stage (the first stage takes the item itself).
+	"""
+
+	def __init__(self, stages:list, queue_size:int=1):
+
+		if len(stages) == 0:
+			raise ValueError('The pipeline needs at least one stage')
+
+		self.stages = stages
+		self.queue_size = queue_size
+		self.metrics = {}
+		self.errors = {}
+		self.total_time = 0.0
+
+	def _new_metrics(self) -> dict:
+
+		return {
+			stage_name: {
+				'items': 0,
+				'busy_time': 0.0, # seconds spent running the stage's function (summed over workers)
+				'wait_time': 0.0, # seconds the workers spent waiting for an item
+				'max_queue_depth': 0, # largest number of items waiting in front of the stage
+				'avg_queue_depth': 0.0,
+				'_queue_samples': 0
+			} for stage_name, _, _ in self.stages
+		}
+
+	def _record_queue_depth(self, stage_name:str, depth:int):
+
+		stage_metrics = self.metrics[stage_name]
+
+		stage_metrics['max_queue_depth'] = max(stage_metrics['max_queue_depth'], depth)
+		stage_metrics['_queue_samples'] += 1
+		stage_metrics['avg_queue_depth'] += (depth - stage_metrics['avg_queue_depth']) / stage_metrics['_queue_samples']
+
+	def _run_stage(self, stage_index:int, queues:list, dic_workers_left:dict, lock:threading.Lock):
+
+		stage_name, function, _ = self.stages[stage_index]
+		queue_in = queues[stage_index]
+		queue_out = queues[stage_index+1]
+
+		while True:
+
+			wait_start = time.perf_counter()
+			task = queue_in.get()
+
+			with lock:
+				self.metrics[stage_name]['wait_time'] += time.perf_counter() - wait_start
+
+			if task is _STOP:
+				break
+
+			key, value = task
+
+			# Items that failed in an earlier stage are only passed along
+			if key not in self.errors:
+
+				busy_start = time.perf_counter()
+
+				try:
+					with span('pipeline_stage', stage=stage_name, key=key):
+						value = function(value)
+				except Exception as e:
+					print(f'Pipeline stage {stage_name} failed for {key}: {e}')
+					self.errors[key] = e
+
+				with lock:
+					self.metrics[stage_name]['busy_time'] += time.perf_counter() - busy_start
+					self.metrics[stage_name]['items'] += 1
+
+			queue_out.put((key, value))
+
+			if stage_index+1 < len(self.stages):
+				with lock:
+					self._record_queue_depth(stage_name=self.stages[stage_index+1][0], depth=queue_out.qsize())
+
+		# The last worker of the stage tells the next stage to stop
+		with lock:
+			dic_workers_left[stage_index] -= 1
+			last_worker = dic_workers_left[stage_index] == 0
+
+		if last_worker and stage_index+1 < len(self.stages):
+			for _ in range(self.stages[stage_index+1][2]):
+				queue_out.put(_STOP)
+
+	def run(self, items:dict) -> dict:
+
+		"""
+		items is {key: item}, returns {key: output of the last stage} for the items that didn't fail.
+		Items that failed are in self.errors {key: exception}, the other items still go through the pipeline.
+		Metrics of the run (per stage) are in self.metrics, the wall-clock time of the run in self.total_time.
+		"""
+
+		self.metrics = self._new_metrics()
+		self.errors = {}
+
+		# One queue in front of every stage, plus an unbounded one for the outputs
+		queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages] + [queue.Queue()]
+		dic_workers_left = {stage_index: n_workers for stage_index, (_, _, n_workers) in enumerate(self.stages)}
+		lock = threading.Lock()
+
+		workers = [
+			threading.Thread(target=propagate(self._run_stage), args=(stage_index, queues, dic_workers_left, lock), daemon=True)
+			for stage_index, (_, _, n_workers) in enumerate(self.stages) for _ in range(n_workers)
+		]
+
+		run_start = time.perf_counter()
+
+		for worker in workers:
+			worker.start()
+
+		first_stage_name = self.stages[0][0]
+
+		for key, item in items.items():
+			queues[0].put((key, item))
+
+			with lock:
+				self._record_queue_depth(stage_name=first_stage_name, depth=queues[0].qsize())
+
+		for _ in range(self.stages[0][2]):
+			queues[0].put(_STOP)
+
+		for worker in workers:
+			worker.join()
+
+		dic_outputs = {}
+
+		while not queues[-1].empty():
+			key, value = queues[-1].get()
+
+			if key not in self.errors:
+				dic_outputs[key] = value
+
+		for stage_metrics in self.metrics.values():
+			stage_metrics.pop('_queue_samples')
+
+		self.total_time = time.perf_counter() - run_start
+
+		# Keep the order of items
+		return {key: dic_outputs[key] for key in items if key in dic_outputs}
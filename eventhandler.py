@@ -1,9 +1,29 @@
 from typing_extensions import override
-from openai import AssistantEventHandler, OpenAI
+from openai import AssistantEventHandler, OpenAI, AsyncOpenAI
 from openai.types.beta.threads.message import Message
-from agenthandler import AgentHandler
+from agenthandler import AgentHandler, AsyncAgentHandler
+from messagestore import MessageStore
+from ratelimiter import get_rate_limiter
+from fileregistry import get_file_registry, THREAD_REF_TTL
+from tracing import span
+from steprunner import run_steps, arun_steps
+from usageledger import to_runs_dataframe, summarize_runs
+from itertools import groupby
 import time
 import pandas as pd
+
+# Stream events that end a run
+_RUN_TERMINAL_EVENTS = {
+	'thread.run.completed',
+	'thread.run.failed',
+	'thread.run.cancelled',
+	'thread.run.expired',
+	'thread.run.incomplete',
+	'thread.run.requires_action'
+}
+
+# Tokens a run is expected to use before the thread has had a run (see _BaseThreadManager._run_tokens)
+_DEFAULT_RUN_TOKENS = 2000
  
 # First, we create a EventHandler class to define
 # how we want to handle the events in the response stream.
@@ -30,43 +50,28 @@ class EventHandler(AssistantEventHandler):
 					if output.type == "logs":
 						print(f"\n{output.logs}", flush=True)
 
-class ThreadManager():
-	def __init__(
-			self, 
-			client:OpenAI, 
-			prompt:str,
-			# assistants:list[AgentHandler]=[], # maybe this is better with **kwargs?
-			attachments:list=[]):
-		
-		if prompt is None and attachments is not None:
-			raise ValueError('Attachment is provided without prompt')
+class _BaseThreadManager():
 
-		attachment_list = []
+	# Everything that doesn't talk to OpenAI, shared by ThreadManager and AsyncThreadManager
+	# The subclasses only do the API calls
 
-		# Format all file_ids provided in attachments
-		for file in attachments:
-			list_plc = [
-				{
-					'file_id': file,
-					'tools': [{'type': 'code_interpreter'}]
-				}
-			]
+	def __init__(self, client, priority:int=0):
 
-			# Add it to attachment_list
-			attachment_list += list_plc
+		self._client = client
+		self.thread = None
+		self.thread_id = None
+		self.last_message = None
 
-		message = [
-			{
-				'role': 'user',
-				'content': prompt,
-				'attachments': attachment_list
-			}
-		]
+		# Priority of this thread's calls in the rate limiter, lower goes first (see ratelimiter.py)
+		self.priority = priority
 
-		self.messages = []
-		self._client = client
-		self.thread = self._client.beta.threads.create(messages=message)
-		self.thread_id = self.thread.id
+		# Tokens the next run is expected to use, taken from the token bucket before the run starts
+		# A thread's runs grow with its messages, so the last run's usage is a good estimate
+		self._run_tokens = _DEFAULT_RUN_TOKENS
+
+		# Usage of every run on this thread (see df_runs), and the budget the runs are checked against (see usageledger.py)
+		self._run_records = []
+		self.budget = None
 
 		df_schema = {
 			'message_id': 'str',
@@ -79,51 +84,64 @@ class ThreadManager():
 			'_msg_loc': 'int',
 			'node_run_id': 'int'
 		}
-		self.df_messages = pd.DataFrame({col: pd.Series(dtype=dt) for col, dt in df_schema.items()})
-
-		# Get the first message stored
-		message = client.beta.threads.messages.list(thread_id=self.thread_id)
-		message_data = message.data[0]
+		self._message_store = MessageStore(schema=df_schema)
 
-		message_id = message_data.id
-		assistant_id = message_data.assistant_id
-		created_at = message_data.created_at
-		file_ids = message_data.attachments
-		role = message_data.role
-		run_id = message_data.run_id
+		# message_id of the last recorded message of the OpenAI thread
+		# Used as a cursor so that only new messages are fetched from the thread
+		# Messages merged from other threads (see merge_messages()) don't move the cursor
+		self._last_thread_message_id = None
 
-		for content in message_data.content:
-			
-			if content.type == 'text':
-				message_text = content.text.value
+	def _first_message(self, prompt:str, attachments:list) -> list:
 
-			elif content.type == 'image_file':
-				file_id = content.image_file.file_id
-				file = self._client.files.content(file_id)
-				# file.write_to_file(f'images/{file_id}.png')
-				message_text = f'Image generated: {file_id}'
-				print(f'Image generated: {file_id}')
-			
-			else:
-				message_text = 'Unidentified content type'
-		
+		if prompt is None and attachments is not None:
+			raise ValueError('Attachment is provided without prompt')
 
-		dic_message = {
-			'message_id': message_id,
-			'assistant_id': assistant_id, 
-			'created_at': created_at, 
-			'file_ids': file_ids, 
-			'role': role, 
-			'run_id': run_id,
-			'message_text': message_text,
-			'_msg_loc': 0
+		message = [
+			{
+				'role': 'user',
+				'content': prompt,
+				'attachments': self._format_attachments(attachments=attachments)
 			}
-		self.messages += [dic_message]
-		
-		df_append = pd.DataFrame([dic_message])
-		self.df_messages =  pd.concat([self.df_messages, df_append], ignore_index=True)
-		
-		self.last_message = message_text
+		]
+
+		return message
+
+	@property
+	def df_messages(self) -> pd.DataFrame:
+
+		# Built from the message store only when it's needed
+		return self._message_store.to_dataframe()
+
+	@property
+	def messages(self) -> list[dict]:
+		return self._message_store.records()
+
+	@property
+	def df_runs(self) -> pd.DataFrame:
+
+		# One row per run: tokens, latency (seconds), model and number of tool calls
+		return to_runs_dataframe(records=self._run_records)
+
+	def get_usage(self, by:list=['agent']) -> pd.DataFrame:
+		return summarize_runs(df_runs=self.df_runs, by=by)
+
+	def get_latest_messages(self) -> dict:
+
+		"""
+		Returns the latest message of each agent in this thread
+		{assistant_id: message, assistant_id: message}
+		"""
+
+		return self._message_store.latest_by_assistant()
+	
+	def get_latest_node_run_messages(self, node_run_id:int=None) -> dict:
+
+		"""
+		Returns the latest message of each agent in node_run_id (default: each agent's latest node_run_id)
+		{assistant_id: message, assistant_id: message}
+		"""
+
+		return self._message_store.latest_by_node_run(node_run_id=node_run_id)
 
 	# # Add assistant to link it to the thread
 	# def add_assistant(self, assistant:AgentHandler):
@@ -135,7 +153,41 @@ class ThreadManager():
 
 	# 	self.manager.link(thread=self, agent=assistant)
 
-	def _combine_messages(self, message: pd.Series, messages_combined: list, index: str):
+	def _format_attachments(self, attachments:list) -> list:
+
+		attachment_list = []
+
+		# Format all file_ids provided in attachments
+		for file in attachments:
+			list_plc = [
+				{
+					'file_id': file,
+					'tools': [{'type': 'code_interpreter'}]
+				}
+			]
+
+			# Add it to attachment_list
+			attachment_list += list_plc
+
+		return attachment_list
+
+	def _get_message_text(self, message:Message) -> str:
+
+		message_text = 'Unidentified content type'
+
+		for content in message.content:
+			
+			if content.type == 'text':
+				message_text = content.text.value
+
+			elif content.type == 'image_file':
+				file_id = content.image_file.file_id
+				message_text = f'Image generated: {file_id}'
+				print(f'Image generated: {file_id}')
+
+		return message_text
+
+	def _combine_messages(self, message: dict, messages_combined: list, node_run_id:int=None):
 		messages_combined_string = '\n'.join(messages_combined)
 
 		dic_message = {
@@ -146,195 +198,400 @@ class ThreadManager():
 			'role': message['role'], 
 			'run_id': message['run_id'],
 			'message_text': messages_combined_string,
-			'_msg_loc': message['_msg_loc']
+			'_msg_loc': message['_msg_loc'],
+			'node_run_id': node_run_id
 			}
 		
 		return dic_message
 	
-	def get_last_message(self, node_run_id:int=None) -> str:
-		
-		#### Note assistant_id can be None
+	def _record_messages(self, messages:list[Message], node_run_id:int=None) -> str:
 
-		print('get_last_message initiated')
+		"""
+		Records new messages of the OpenAI thread (oldest first) in df_messages.
+		Consecutive messages by the same entity are combined into one message,
+		which takes the ids and _msg_loc of the entity's last message.
+		Returns the text of the last recorded message, None if there is no message.
+		"""
 
-		messages = self._client.beta.threads.messages.list(thread_id=self.thread_id).data
-		# Reverse the list order because we want to use _msg_loc to filter
-		messages = messages[::-1]
-		# Filter for new messages only
-		max_loc = self.df_messages['_msg_loc'].max()+1
-		messages = messages[max_loc:]
-
-		if len(messages) > 0:
-			messages_combined = []
-			messages_append_placeholder = []
-			previous_index = max_loc
-			# Set assistant_id
-			asst_id = '' 
-
-			dic_new_messages = [
-				{
-					'message_id': message.id,
-					'assistant_id': message.assistant_id,
-					'created_at': message.created_at,
-					'file_ids': message.attachments,
-					'role': message.role,
-					'run_id': message.run_id,
-					'message_text': message.content[0].text.value,
-					'_msg_loc': index + max_loc,
-					'node_run_id': node_run_id
-				} for index, message in enumerate(messages)]
+		if len(messages) == 0:
+			return None
+
+		self._last_thread_message_id = messages[-1].id
+
+		max_loc = self._message_store.next_loc()
+
+		new_messages = [
+			{
+				'message_id': message.id,
+				'assistant_id': message.assistant_id,
+				'created_at': message.created_at,
+				'file_ids': message.attachments,
+				'role': message.role,
+				'run_id': message.run_id,
+				'message_text': self._get_message_text(message=message),
+				'_msg_loc': index + max_loc
+			} for index, message in enumerate(messages)]
+
+		messages_append_placeholder = []
+
+		# Collect the messages of one entity until another entity's message comes up
+		# Note user role will have None assistant_id
+		for _, group in groupby(new_messages, key=lambda message: message['assistant_id']):
 			
-			df_new_messages = pd.DataFrame(dic_new_messages)
-
-			# For now this records multiple messages from assistant separately
-			# Need to combine them together to make them one single string
-			for index, row in df_new_messages.iterrows():
-
-				row_assistant_id, row_message_text = row[['assistant_id', 'message_text']]
-
-				# if asst_id is blank that means it's the first loop
-				if asst_id == '':
-					print('asst_id = blank')
-					asst_id = row_assistant_id
-
-					# print(f'new_message: {message_text}')
-					messages_combined.append(row_message_text)
-
-				# Message is still by the same entity, keep collecting message
-				elif row_assistant_id == asst_id:
-					
-					print('message.assistant_id == asst_id, proceed normally to collect message')
-
-					# print(f'new_message: {message_text}')
-					messages_combined.append(row_message_text)
-
-				# Message is by another entity, add the combined message of the last entity
-				# and start a new round of messages
-				else: # message.assistant_id != asst_id
-					
-					print('message.assistant_id != asst_id, record previous message first')
-					# If there is no new message, return
-					if messages_combined == []:
-						print('No new message unrecorded.')
-					
-					# If there is at least one new message, then proceed normally
-					else:
-						
-						# Reverse the order so that first message comes first
-						# messages_combined = messages_combined[::-1]
-						# print(messages_combined)
-						# We use previous message because the current loop is the new message
-						dic_message = self._combine_messages(message=previous_message, messages_combined=messages_combined, index=previous_index)
-						# print(dic_message)
-						# Add message by the previous entity to the list first
-						messages_append_placeholder.append(dic_message)
-
-						self.messages += messages_append_placeholder
-
-						df_append = pd.DataFrame([dic_message])
-						self.df_messages =  pd.concat([self.df_messages, df_append], ignore_index=True)
-
-						# Reset messages_combined to empty list to prepare for the next entity's messages
-						messages_combined = []
-						# print(messages_combined)
-
-						# Update asst_id to the new entity (note user role will have None assistant_id)
-						asst_id = row_assistant_id
-
-						# print(f'new_message: {row_message_text}')
-						messages_combined.append(row_message_text)
-						# print(messages_combined)
-				
-				# Set message as previous_message for the next loop
-				previous_message = row
-				previous_index = index + max_loc
-
-			# messages_combined = messages_combined[::-1]
-			dic_message = self._combine_messages(message=previous_message, messages_combined=messages_combined, index=previous_index)
+			group = list(group)
+
+			dic_message = self._combine_messages(
+				message=group[-1],
+				messages_combined=[message['message_text'] for message in group],
+				node_run_id=node_run_id
+			)
 
 			messages_append_placeholder.append(dic_message)
-			self.messages += messages_append_placeholder
+		
+		self._message_store.extend(messages_append_placeholder)
 
-			df_append = pd.DataFrame([dic_message])
-			self.df_messages =  pd.concat([self.df_messages, df_append], ignore_index=True)
+		self.last_message = messages_append_placeholder[-1]['message_text']
 
-			self.last_message = dic_message['message_text']
+		return self.last_message
+	
+	def _list_kwargs(self) -> dict:
 
-			return dic_message['message_text']
-		else:
-			print('No new message')
+		# Only fetch messages after the last recorded one, oldest first
+		list_kwargs = {'order': 'asc', 'limit': 100}
 
-			return None
+		if self._last_thread_message_id is not None:
+			list_kwargs['after'] = self._last_thread_message_id
+
+		return list_kwargs
 	
-	def run_thread(self, assistant:AgentHandler, prompt:str=None, attachments:list=[], node_run_id:int=None, end_pause:int=5):
+	def merge_messages(self, thread:'_BaseThreadManager', node_run_id:int=None):
+
+		"""
+		Copies the messages by agents in another thread (i.e. a short-lived branch thread)
+		into df_messages of this thread, labelled with node_run_id.
+		The merged messages are placed after the existing messages (_msg_loc).
+		User messages, including the prompt that started the other thread, are not copied.
+		Note that the messages are only recorded here, they're not added to the thread in OpenAI.
+		"""
+
+		messages_merge = [message for message in thread.messages if message['role']=='assistant']
+
+		if len(messages_merge) == 0:
+			print(f'No message to merge from thread: {thread.thread_id}')
+			return
+
+		for message in messages_merge:
+			message['_msg_loc'] = self._message_store.next_loc()
+			message['node_run_id'] = node_run_id
+
+			self._message_store.append(message)
+
+		self.last_message = messages_merge[-1]['message_text']
+
+		# The runs of the other thread are part of this thread's usage as well
+		self._run_records.extend({**record, 'node_run_id': node_run_id} for record in thread._run_records)
+
+	def _handle_stream_event(self, event, completed_messages:list, dic_run:dict):
+
+		"""
+		Collects the message of a thread.message.completed event in completed_messages,
+		and counts the tool calls of thread.run.step.completed events in dic_run['tool_calls'].
+		Returns the run if the event ends the run, otherwise None.
+		"""
+
+		print(event, end='\r')
+
+		if event.event == 'thread.message.completed':
+			completed_messages.append(event.data)
+
+		elif event.event == 'thread.run.step.completed':
+			step_details = getattr(event.data, 'step_details', None)
+
+			if getattr(step_details, 'type', None) == 'tool_calls':
+				dic_run['tool_calls'] += len(step_details.tool_calls)
+
+		elif event.event in _RUN_TERMINAL_EVENTS:
+			return event.data
+
+		elif event.event == 'error':
+			raise ValueError(f'Error: stream error on thread {self.thread_id}: {event.data}')
+
+		return None
+
+	def _get_run_kwargs(self) -> dict:
+
+		# The budget can replace the assistant's model for this run, or stop the run (raises BudgetExceededError)
+		model = self.budget.get_model() if self.budget is not None else None
+
+		return {'model': model} if model is not None else {}
+
+	def _record_run(self, assistant, run, node_run_id:int, latency:float, tool_calls:int):
+
+		if run is None:
+			return
+
+		usage = self._get_run_usage(run=run)
+
+		self._run_records.append({
+			'run_id': run.id,
+			'assistant_id': assistant.assistant_id,
+			'agent': assistant.assistant_name,
+			'node_run_id': node_run_id,
+			'model': getattr(run, 'model', None),
+			'status': run.status,
+			'latency': latency,
+			'tool_calls': tool_calls,
+			'created_at': time.time(),
+			**usage
+		})
+
+		if self.budget is not None:
+			self.budget.record(tokens=usage['total_tokens'])
+
+	def _get_run_usage(self, run) -> dict:
+
+		usage = getattr(run, 'usage', None)
+
+		return {
+			'prompt_tokens': usage.prompt_tokens if usage is not None else 0,
+			'completion_tokens': usage.completion_tokens if usage is not None else 0,
+			'total_tokens': usage.total_tokens if usage is not None else 0
+		}
+
+	def _get_run_attributes(self, run_status:str, run, completed_messages:list) -> dict:
+
+		# What the stream span of a run records
+		return {
+			'run_id': run.id if run is not None else None,
+			'run_status': run_status,
+			'model': getattr(run, 'model', None),
+			'messages': len(completed_messages),
+			**self._get_run_usage(run=run)
+		}
+
+	def _record_run_usage(self, run):
+
+		# Settle the difference between the run's estimated and actual tokens with the rate limiter
+		usage = getattr(run, 'usage', None)
+
+		if usage is None:
+			return
+
+		get_rate_limiter().record_tokens(usage.total_tokens - self._run_tokens)
+
+		self._run_tokens = usage.total_tokens
+
+	def _check_run(self, run_status:str, run, attempt:int, max_retries:int) -> bool:
+
+		"""
+		Checks how a streamed run ended.
+		Returns True if the run completed, False if it failed with a rate limit and should be run again.
+		In that case the rate limiter is paused, so the retry (and every other call) waits.
+		Raises for anything else.
+		"""
+
+		self._record_run_usage(run=run)
+
+		if run_status == 'completed':
+			return True
+
+		elif run_status == 'failed' and run.last_error is not None and run.last_error.code == 'rate_limit_exceeded' and attempt < max_retries:
+			wait_time = get_rate_limiter().backoff(attempt=attempt)
+			print(f'\nRun failed with rate limit, retrying run in {wait_time:.1f} seconds')
+			return False
 		
+		elif run_status is None:
+			raise ValueError(f'Error: stream ended before the run finished (thread_id {self.thread_id})')
+
+		else:
+			run_id = run.id if run is not None else None
+			raise ValueError(f'Error: run has {run_status} (run_id: {run_id}, thread_id {self.thread_id})')
+
+	def _ref_attachments(self, attachments:list):
+
+		# The thread references its attached files until it's deleted or the MultiNodeManager run ends (see MultiNodeManager.run()),
+		# the ttl releases them if neither happens (i.e. the process crashed)
+		for file_id in attachments:
+			get_file_registry().add_ref(file_id=file_id, ref=f'thread:{self.thread_id}', ttl=THREAD_REF_TTL)
+
+	def release_attachments(self):
+
+		# The attached files can be collected once the thread doesn't need them, the next prompt attaches them again
+		get_file_registry().release(ref=f'thread:{self.thread_id}')
+
+	def _check_run_prompt(self, prompt:str, attachments:list):
+
 		if prompt is None and len(attachments) > 0:
 			raise ValueError('Attachment is provided without prompt')
+
+	# run_thread() is written once as steps (see steprunner.py), the subclasses only make the calls in _do_step().
+	# A step is (kind, target, kwargs):
+	# ('api', client method, kwargs): an OpenAI call through the rate limiter
+	# ('sync_agent', assistant, {}): assistant.sync()
+	# ('next_event', stream, {}): the next event of the stream, None at its end
+
+	def _stream_run_steps(self, assistant, node_run_id:int=None, run_kwargs:dict=None):
+
+		"""
+		Runs the thread with a stream and consumes it until the run ends.
+		The run is done when the stream gives a terminal thread.run.* event,
+		the messages are taken directly from the thread.message.completed events.
+		The run's usage is recorded in df_runs.
+		run_kwargs are the budget's run options (see _get_run_kwargs()), the budget is checked here if they're not given.
+		Returns the final run status, the run object and the completed messages.
+		"""
+
+		completed_messages = []
+		run = None
+		dic_run = {'tool_calls': 0}
+
+		# Push the agent's config to OpenAI first if it changed (no API call otherwise)
+		yield ('sync_agent', assistant, {})
+
+		with span('stream', agent=assistant.assistant_name, thread_id=self.thread_id) as stream_span:
+
+			if run_kwargs is None:
+				run_kwargs = self._get_run_kwargs()
+
+			run_start = time.perf_counter()
+
+			stream = yield ('api', self._client.beta.threads.runs.create, {
+				'thread_id': self.thread_id,
+				'assistant_id': assistant.assistant_id,
+				'stream': True,
+				'tokens': self._run_tokens,
+				**run_kwargs
+			})
+
+			while True:
+
+				event = yield ('next_event', stream, {})
+
+				if event is None:
+					break
+
+				run = self._handle_stream_event(event=event, completed_messages=completed_messages, dic_run=dic_run) or run
+
+			run_status = run.status if run is not None else None
+
+			self._record_run(assistant=assistant, run=run, node_run_id=node_run_id, latency=time.perf_counter() - run_start, tool_calls=dic_run['tool_calls'])
+
+			stream_span.set(**self._get_run_attributes(run_status=run_status, run=run, completed_messages=completed_messages))
+
+		return run_status, run, completed_messages
+
+	def _run_thread_steps(self, assistant, prompt:str=None, attachments:list=[], node_run_id:int=None, max_retries:int=3):
+
+		self._check_run_prompt(prompt=prompt, attachments=attachments)
+
+		with span('agent_turn', agent=assistant.assistant_name, node_run_id=node_run_id, thread_id=self.thread_id) as turn_span:
+
+			# The budget is checked before the prompt is posted, so a stopped turn doesn't leave a prompt without a reply on the thread
+			run_kwargs = self._get_run_kwargs()
 		
-		elif prompt is None:
-
-			stream = self._client.beta.threads.runs.create(
-				thread_id=self.thread_id,
-				assistant_id=assistant.assistant_id,
-				stream=True
-				# event_handler=EventHandler()
-			) 
-			# as stream:
-			# 	stream.until_done()
-
-			for event in stream:
-				print(event, end='\r')
-		
-		elif prompt is not None:
-			attachment_list = []
-
-			# Format all file_ids provided in attachments
-			for file in attachments:
-				list_plc = [
-					{
-						'file_id': file,
-						'tools': [{'type': 'code_interpreter'}]
-					}
-				]
-
-				# Add it to attachment_list
-				attachment_list += list_plc
-
-			message = [
-				{
-					'role': 'user',
-					'content': prompt,
-					'attachments': attachment_list
-				}
-			]
+			if prompt is not None:
+
+				self._ref_attachments(attachments=attachments)
 
-			stream = self._client.beta.threads.runs.create(
-				thread_id=self.thread_id,
-				assistant_id=assistant.assistant_id,
-				additional_messages=message,
-				stream=True
-			) 
-			# as stream:
-			# 	stream.until_done()
+				# The prompt is added as its own message first so that it can be recorded without listing the thread
+				with span('message_create', bytes=len(prompt.encode('utf-8')), attachments=len(attachments)):
+					user_message = yield ('api', self._client.beta.threads.messages.create, {
+						'thread_id': self.thread_id,
+						'role': 'user',
+						'content': prompt,
+						'attachments': self._format_attachments(attachments=attachments)
+					})
 
-			for event in stream:
-				print(event, end='\r')
+				self._record_messages(messages=[user_message], node_run_id=node_run_id)
 
-		# Buffer maybe we need to wait after thread run is done for data to update
-		time.sleep(1)
+			# 429s on creating the run are retried by the rate limiter, this only retries runs that failed with a rate limit
+			for attempt in range(max_retries+1):
 
-		self.get_last_message(node_run_id=node_run_id)
+				# A retry checks the budget again
+				run_status, run, completed_messages = yield from self._stream_run_steps(assistant=assistant, node_run_id=node_run_id, run_kwargs=run_kwargs if attempt == 0 else None)
 
-		# Sleep for 5 seconds in anticipation that there will be multiple consecutive runs
-		time.sleep(5)
+				# Record whatever the run has written, even if it did not complete
+				self._record_messages(messages=completed_messages, node_run_id=node_run_id)
+
+				turn_span.set(runs=attempt+1)
+
+				for key, value in self._get_run_usage(run=run).items():
+					turn_span.add(key, value)
+
+				if self._check_run(run_status=run_status, run=run, attempt=attempt, max_retries=max_retries):
+					break
 
 		return self.last_message
+
+class ThreadManager(_BaseThreadManager):
+	def __init__(
+			self, 
+			client:OpenAI, 
+			prompt:str,
+			# assistants:list[AgentHandler]=[], # maybe this is better with **kwargs?
+			attachments:list=[],
+			priority:int=0):
+		
+		message = self._first_message(prompt=prompt, attachments=attachments)
+
+		super().__init__(client=client, priority=priority)
+
+		# Every OpenAI call goes through the shared rate limiter
+		with span('thread_create') as create_span:
+			self.thread = get_rate_limiter().call(self._client.beta.threads.create, messages=message, priority=self.priority)
+			self.thread_id = self.thread.id
+			create_span.set(thread_id=self.thread_id)
+
+		self._ref_attachments(attachments=attachments)
+
+		# Get the first message stored
+		message = get_rate_limiter().call(client.beta.threads.messages.list, thread_id=self.thread_id, order='asc', limit=1, priority=self.priority)
+
+		self._record_messages(messages=message.data)
+	
+	def get_last_message(self, node_run_id:int=None) -> str:
+		
+		#### Note assistant_id can be None
+
+		print('get_last_message initiated')
+
+		# auto_paging_iter() follows the cursor past the first page, so long threads don't lose messages
+		with span('message_fetch', thread_id=self.thread_id, node_run_id=node_run_id) as fetch_span:
+			messages = list(get_rate_limiter().call(self._client.beta.threads.messages.list, thread_id=self.thread_id, **self._list_kwargs(), priority=self.priority).auto_paging_iter())
+			fetch_span.set(messages=len(messages))
+
+		last_message = self._record_messages(messages=messages, node_run_id=node_run_id)
+
+		if last_message is None:
+			print('No new message')
+
+		return last_message
+
+	def _do_step(self, step:tuple):
+
+		kind, target, kwargs = step
+
+		if kind == 'api':
+			return get_rate_limiter().call(target, priority=self.priority, **kwargs)
+
+		elif kind == 'sync_agent':
+			return target.sync()
+
+		elif kind == 'next_event':
+			return next(target, None)
+
+		raise ValueError(f'Unknown step: {kind}')
+
+	def run_thread(self, assistant:AgentHandler, prompt:str=None, attachments:list=[], node_run_id:int=None, max_retries:int=3):
+		return run_steps(self._run_thread_steps(assistant=assistant, prompt=prompt, attachments=attachments, node_run_id=node_run_id, max_retries=max_retries), self._do_step)
 	
 	def delete_thread(self):
 
-		self._client.beta.threads.delete(thread_id=self.thread_id)
+		get_rate_limiter().call(self._client.beta.threads.delete, thread_id=self.thread_id, priority=self.priority)
 		print(f"thread: {self.thread_id} has been deleted.")
 
+		self.release_attachments()
+
 	
 	def clear_and_delete(self):
 
@@ -344,12 +601,100 @@ class ThreadManager():
 
 		self.delete_thread()
 		
-		self.messages = None
-		self.df_messages = None
+		self._message_store.clear()
 
 		# Delete the instance by removing references to itself
 		del self
 
+class AsyncThreadManager(_BaseThreadManager):
+
+	"""
+	Same as ThreadManager, but on the AsyncOpenAI client, so that many threads can be run from one event loop.
+	__init__ can't await, so create it with:
+	thread = await AsyncThreadManager.create(client=get_async_client(), prompt=prompt)
+	"""
+
+	def __init__(self, client:AsyncOpenAI, priority:int=0):
+		super().__init__(client=client, priority=priority)
+
+	@classmethod
+	async def create(cls, client:AsyncOpenAI, prompt:str, attachments:list=[], priority:int=0) -> 'AsyncThreadManager':
+
+		self = cls(client=client, priority=priority)
+
+		message = self._first_message(prompt=prompt, attachments=attachments)
+
+		with span('thread_create') as create_span:
+			self.thread = await get_rate_limiter().acall(self._client.beta.threads.create, messages=message, priority=self.priority)
+			self.thread_id = self.thread.id
+			create_span.set(thread_id=self.thread_id)
+
+		self._ref_attachments(attachments=attachments)
+
+		# Get the first message stored
+		message = await get_rate_limiter().acall(self._list_first_page, thread_id=self.thread_id, order='asc', limit=1, priority=self.priority)
+
+		self._record_messages(messages=message.data)
+
+		return self
+
+	async def _list_first_page(self, **kwargs):
+
+		# messages.list() gives a paginator, awaiting it makes the request for the first page
+		return await self._client.beta.threads.messages.list(**kwargs)
+	
+	async def get_last_message(self, node_run_id:int=None) -> str:
+
+		print('get_last_message initiated')
+
+		# Iterating the async page follows the cursor past the first page
+		with span('message_fetch', thread_id=self.thread_id, node_run_id=node_run_id) as fetch_span:
+			page = await get_rate_limiter().acall(self._list_first_page, thread_id=self.thread_id, **self._list_kwargs(), priority=self.priority)
+			messages = [message async for message in page]
+			fetch_span.set(messages=len(messages))
+
+		last_message = self._record_messages(messages=messages, node_run_id=node_run_id)
+
+		if last_message is None:
+			print('No new message')
+
+		return last_message
+
+	async def _do_step(self, step:tuple):
+
+		# See ThreadManager._do_step()
+		kind, target, kwargs = step
+
+		if kind == 'api':
+			return await get_rate_limiter().acall(target, priority=self.priority, **kwargs)
+
+		elif kind == 'sync_agent':
+			return await target.sync()
+
+		elif kind == 'next_event':
+			try:
+				return await target.__anext__()
+			except StopAsyncIteration:
+				return None
+
+		raise ValueError(f'Unknown step: {kind}')
+
+	async def run_thread(self, assistant:AsyncAgentHandler, prompt:str=None, attachments:list=[], node_run_id:int=None, max_retries:int=3):
+		return await arun_steps(self._run_thread_steps(assistant=assistant, prompt=prompt, attachments=attachments, node_run_id=node_run_id, max_retries=max_retries), self._do_step)
+	
+	async def delete_thread(self):
+
+		await get_rate_limiter().acall(self._client.beta.threads.delete, thread_id=self.thread_id, priority=self.priority)
+		print(f"thread: {self.thread_id} has been deleted.")
+
+		self.release_attachments()
+
+	async def clear_and_delete(self):
+
+		await self.delete_thread()
+		
+		self._message_store.clear()
+
 
 ## Manually checking run status of a thread
 ## Primivite, not needed
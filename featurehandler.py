@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+
+# Number of trading days in each return window
+RETURN_WINDOWS = {
+	'return_1m': 21,
+	'return_3m': 63,
+	'return_6m': 126,
+	'return_1y': 252
+}
+
+TRADING_DAYS_PER_YEAR = 252
+
+def _get_column(df:pd.DataFrame, col:str) -> pd.Series:
+
+	# Statements don't always have every line item, missing ones are NaN
+	if col in df.columns:
+		return pd.to_numeric(df[col], errors='coerce').astype('float64')
+
+	return pd.Series(np.nan, index=df.index, dtype='float64')
+
+def _safe_divide(numerator:pd.Series, denominator:pd.Series) -> pd.Series:
+	return numerator / denominator.replace(0, np.nan)
+
+def _latest_per_ticker(df:pd.DataFrame) -> pd.DataFrame:
+
+	# df has to be sorted by Ticker and Date
+	return df.groupby('Ticker', observed=True).tail(1).set_index('Ticker')
+
+class FeatureHandler():
+
+	"""
+	Computes a compact table of metrics per ticker (returns, moving averages, volatility, ATR, drawdown,
+	margins, growth rates and valuation ratios) from the frames of YFHandler.
+	The table is uploaded next to the raw data, so the agents don't have to compute them on every run.
+	"""
+
+	def __init__(self, stock_info:dict=None, periods_per_year:int=4):
+
+		"""
+		stock_info is YFHandler.stock_info, its fields are added to the table and used for valuation ratios.
+		periods_per_year is the number of periods per year in the statements (4 for quarterly, 1 for yearly).
+		"""
+
+		self.stock_info = stock_info if stock_info is not None else {}
+		self.periods_per_year = periods_per_year
+
+	def compute_price_features(self, df_stocks:pd.DataFrame) -> pd.DataFrame:
+
+		"""Returns the latest price metrics of each ticker, one row per ticker."""
+
+		df = df_stocks.sort_values(['Ticker', 'Date']).reset_index(drop=True)
+		grouped = df.groupby('Ticker', observed=True)
+
+		close = _get_column(df, 'Close')
+		high = _get_column(df, 'High')
+		low = _get_column(df, 'Low')
+		prev_close = grouped['Close'].shift(1).astype('float64')
+
+		df_features = pd.DataFrame({'Ticker': df['Ticker'], 'Date': df['Date'], 'close': close})
+
+		for col, window in RETURN_WINDOWS.items():
+			df_features[col] = _safe_divide(close, grouped['Close'].shift(window).astype('float64')) - 1
+
+		df_features['return_daily'] = _safe_divide(close, prev_close) - 1
+
+		df_features['ma_50'] = grouped['Close'].rolling(50).mean().reset_index(level=0, drop=True)
+		df_features['ma_200'] = grouped['Close'].rolling(200).mean().reset_index(level=0, drop=True)
+		df_features['close_to_ma_200'] = _safe_divide(close, df_features['ma_200']) - 1
+
+		# Annualized volatility of daily returns over the last 3 months
+		df_features['volatility_3m'] = (
+			df_features.groupby('Ticker', observed=True)['return_daily'].rolling(63).std().reset_index(level=0, drop=True)
+			* np.sqrt(TRADING_DAYS_PER_YEAR)
+		)
+
+		# Average true range over 14 days
+		true_range = pd.concat([high - low, (high - prev_close).abs(), (low - prev_close).abs()], axis=1).max(axis=1)
+		df_features['atr_14'] = true_range.groupby(df['Ticker'], observed=True).rolling(14).mean().reset_index(level=0, drop=True)
+
+		# Drawdown from the highest close so far
+		df_features['drawdown'] = _safe_divide(close, grouped['Close'].cummax().astype('float64')) - 1
+		max_drawdown = df_features.groupby('Ticker', observed=True)['drawdown'].min().rename('max_drawdown')
+
+		df_latest = _latest_per_ticker(df_features).drop(columns=['return_daily'])
+
+		return df_latest.join(max_drawdown).rename(columns={'Date': 'price_date'})
+
+	def compute_statement_features(self, df_income:pd.DataFrame=None, df_balance_sheet:pd.DataFrame=None, df_cashflow:pd.DataFrame=None) -> pd.DataFrame:
+
+		"""Returns the latest margins, growth rates and ratios from the statements of each ticker, one row per ticker."""
+
+		list_features = []
+		n = self.periods_per_year
+
+		if df_income is not None and not df_income.empty:
+
+			df = df_income.sort_values(['Ticker', 'Date']).reset_index(drop=True)
+
+			revenue = _get_column(df, 'Total Revenue')
+			revenue_grouped = revenue.groupby(df['Ticker'], observed=True)
+
+			df_features = pd.DataFrame({'Ticker': df['Ticker'], 'statement_date': df['Date']})
+			df_features['gross_margin'] = _safe_divide(_get_column(df, 'Gross Profit'), revenue)
+			df_features['operating_margin'] = _safe_divide(_get_column(df, 'Operating Income'), revenue)
+			df_features['net_margin'] = _safe_divide(_get_column(df, 'Net Income'), revenue)
+			df_features['revenue_growth_qoq'] = revenue_grouped.pct_change(periods=1, fill_method=None)
+			df_features['revenue_growth_yoy'] = revenue_grouped.pct_change(periods=n, fill_method=None)
+			df_features['net_income_growth_yoy'] = _get_column(df, 'Net Income').groupby(df['Ticker'], observed=True).pct_change(periods=n, fill_method=None)
+
+			# Trailing twelve months (sum of the last n periods)
+			df_features['revenue_ttm'] = revenue_grouped.rolling(n).sum().reset_index(level=0, drop=True)
+			df_features['eps_ttm'] = _get_column(df, 'Diluted EPS').groupby(df['Ticker'], observed=True).rolling(n).sum().reset_index(level=0, drop=True)
+
+			list_features.append(_latest_per_ticker(df_features))
+
+		if df_balance_sheet is not None and not df_balance_sheet.empty:
+
+			df = df_balance_sheet.sort_values(['Ticker', 'Date']).reset_index(drop=True)
+
+			df_features = pd.DataFrame({'Ticker': df['Ticker']})
+			df_features['debt_to_equity'] = _safe_divide(_get_column(df, 'Total Debt'), _get_column(df, 'Stockholders Equity'))
+			df_features['current_ratio'] = _safe_divide(_get_column(df, 'Current Assets'), _get_column(df, 'Current Liabilities'))
+			df_features['book_value'] = _get_column(df, 'Stockholders Equity')
+			df_features['shares'] = _get_column(df, 'Ordinary Shares Number')
+
+			list_features.append(_latest_per_ticker(df_features))
+
+		if df_cashflow is not None and not df_cashflow.empty:
+
+			df = df_cashflow.sort_values(['Ticker', 'Date']).reset_index(drop=True)
+
+			df_features = pd.DataFrame({'Ticker': df['Ticker']})
+			df_features['free_cash_flow_ttm'] = _get_column(df, 'Free Cash Flow').groupby(df['Ticker'], observed=True).rolling(n).sum().reset_index(level=0, drop=True)
+
+			list_features.append(_latest_per_ticker(df_features))
+
+		if len(list_features) == 0:
+			return pd.DataFrame()
+
+		return pd.concat(list_features, axis=1)
+
+	def build_metrics_table(self, df_stocks:pd.DataFrame, df_income:pd.DataFrame=None, df_balance_sheet:pd.DataFrame=None, df_cashflow:pd.DataFrame=None) -> pd.DataFrame:
+
+		"""Returns one row per ticker with the price and statement metrics, stock_info fields and valuation ratios."""
+
+		df_metrics = self.compute_price_features(df_stocks=df_stocks)
+
+		df_statement_features = self.compute_statement_features(df_income=df_income, df_balance_sheet=df_balance_sheet, df_cashflow=df_cashflow)
+
+		if not df_statement_features.empty:
+			df_metrics = df_metrics.join(df_statement_features, how='left')
+
+		df_info = pd.DataFrame.from_dict({stock: dict(self.stock_info.get(stock, {})) for stock in df_metrics.index}, orient='index')
+		df_metrics = df_metrics.join(df_info, how='left')
+
+		# Market cap from stock_info, otherwise from the latest close and share count
+		market_cap = _get_column(df_metrics, 'marketCap')
+		market_cap = market_cap.fillna(df_metrics['close'] * _get_column(df_metrics, 'shares'))
+
+		df_metrics['market_cap'] = market_cap
+		df_metrics['pe_ratio'] = _safe_divide(df_metrics['close'], _get_column(df_metrics, 'eps_ttm'))
+		df_metrics['ps_ratio'] = _safe_divide(market_cap, _get_column(df_metrics, 'revenue_ttm'))
+		df_metrics['pb_ratio'] = _safe_divide(market_cap, _get_column(df_metrics, 'book_value'))
+		df_metrics['fcf_yield'] = _safe_divide(_get_column(df_metrics, 'free_cash_flow_ttm'), market_cap)
+
+		return df_metrics.drop(columns=['marketCap'], errors='ignore').reset_index().rename(columns={'index': 'Ticker'})
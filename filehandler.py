@@ -1,57 +1,362 @@
+import io
+import os
+import gzip
+import asyncio
 import pandas as pd
 import openai
-from openai import OpenAI
-import json
+from typing import Union
+from openai import OpenAI, AsyncOpenAI
+import hashlib
+from ratelimiter import get_rate_limiter
+from configstore import save_config, get_config_store
+from fileregistry import get_file_registry
+from tracing import span
+
+# Number of rows written at a time, so large frames aren't converted to text all at once
+WRITE_CHUNK_SIZE = 100000
+
+# Number of rows written to estimate the size of the whole file (see FileHandler._estimate_file_size())
+SIZE_SAMPLE_ROWS = 10000
+
+def _write_csv(df: pd.DataFrame, file_path: str):
+
+    with open(file_path, 'w', newline='') as f:
+        df.to_csv(f, index=False, chunksize=WRITE_CHUNK_SIZE)
+
+def _write_csv_gz(df: pd.DataFrame, file_path: str):
+
+    # mtime=0 and no file name in the gzip header, so the same data always gives the same bytes (and hash)
+    with open(file_path, 'wb') as raw_file, \
+            gzip.GzipFile(filename='', fileobj=raw_file, mode='wb', mtime=0) as gzip_file, \
+            io.TextIOWrapper(gzip_file, newline='') as f:
+        df.to_csv(f, index=False, chunksize=WRITE_CHUNK_SIZE)
+
+def _write_parquet(df: pd.DataFrame, file_path: str):
+
+    # Requires pyarrow (or fastparquet) to be installed
+    df.to_parquet(file_path, index=False)
+
+# The file format is picked from the extension of the file name
+# {extension: function(df, file_path)}
+FILE_WRITERS = {
+    '.csv': _write_csv,
+    '.csv.gz': _write_csv_gz,
+    '.parquet': _write_parquet
+}
+
+def register_file_writer(extension: str, writer):
+
+    """Adds a file format, writer is a function(df, file_path) that writes df to file_path."""
+
+    FILE_WRITERS[extension] = writer
+
+def split_file_extension(file_name: str) -> tuple:
+
+    """Splits a file name into (stem, extension), i.e. 'df_stocks.csv.gz' -> ('df_stocks', '.csv.gz')"""
+
+    # Longest extension first so that '.csv.gz' isn't taken as '.gz'
+    for extension in sorted(FILE_WRITERS, key=len, reverse=True):
+        if file_name.endswith(extension):
+            return file_name[:-len(extension)], extension
+
+    raise ValueError(f"No file writer for {file_name}, supported extensions: {list(FILE_WRITERS)}")
+
+def get_file_hash(file_path: str) -> str:
+
+    # sha256 of the file content, read in chunks so large files aren't loaded at once
+    file_hash = hashlib.sha256()
+
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+def save_file_manifest(dic_file: dict, manifest_path: str):
+
+    """
+    Saves dic_file (i.e. openai_files.json) through its config store.
+    The write is atomic (see configstore.py) and done before this returns, so a failed write raises here.
+    The files in the manifest are referenced in the file registry, the ones replaced since the last save lose their reference.
+    """
+
+    save_config(dic_file=dic_file, path=manifest_path)
+
+    # The manifest is the commit point of an upload, it isn't left to the debounced write
+    get_config_store(path=manifest_path).flush()
+
+    file_registry = get_file_registry()
+
+    for file_name, file_entry in dic_file.items():
+        file_id = file_entry['id'] if isinstance(file_entry, dict) else file_entry
+        file_registry.set_refs(ref=f"manifest:{file_name}", file_ids=[file_id])
+
+    # Entries removed from the manifest (i.e. a file that is now split by ticker) don't reference their file anymore
+    for ref in file_registry.get_refs(prefix='manifest:'):
+        if ref[len('manifest:'):] not in dic_file:
+            file_registry.release(ref=ref)
 
 class FileHandler:
-    def __init__(self, df: pd.DataFrame, dic_file: dict, dic_file_name: str, file_name: str, client: OpenAI, file_path:str='openai_upload_files/'):
+    def __init__(
+            self, 
+            df: pd.DataFrame, 
+            dic_file: dict, 
+            dic_file_name: str, 
+            file_name: str, 
+            client: Union[OpenAI, AsyncOpenAI], 
+            file_path:str='openai_upload_files/',
+            max_file_size:int=None,
+            partition_col:str='Ticker'
+            ):
+
+        """
+        The file format comes from the extension of file_name (.csv, .csv.gz or .parquet, see FILE_WRITERS).
+        If max_file_size (bytes) is given and the file is larger, the data is written as one file per value of
+        partition_col instead (i.e. df_stocks_MSFT.csv, df_stocks_AAPL.csv), each uploaded as its own file.
+        With an AsyncOpenAI client, the files are uploaded with aupdate_openai_file().
+        """
         
         self._client = client
         self._dic_file = dic_file
         self.df = df
         self.file_name = file_name
         self.file_path = file_path
+        self._dic_file_name = dic_file_name
 
-        try:
-            # That means the file already exists
-            dic_file['df_balance_sheet.csv']
+        # Whether the last update_openai_file() uploaded any file
+        self.uploaded = False
 
-            self.file_id = dic_file[file_name]
+        # Whether it changed dic_file (a file uploaded or a stale entry dropped), so the manifest has to be saved
+        self.manifest_changed = False
 
-        except KeyError:
-            print("Note: File doesn't exist yet")     
-            self.file_id = ''
-       
-        self._dic_file_name = dic_file_name
+        self._partition_col = partition_col
 
-        # Make sure the csv is always updated
-        df.to_csv(f"{file_path}{file_name}", index=False)
+        # The file is written once here, update_openai_file() uploads what's written
+        self._parts = [self._read_file_entry(file_name=name) for name in self._write_files(max_file_size=max_file_size, partition_col=partition_col)]
+
+    def _estimate_file_size(self, writer) -> int:
+
+        # Writes evenly spaced rows (up to SIZE_SAMPLE_ROWS) and scales their size up to the whole frame
+        if len(self.df) <= SIZE_SAMPLE_ROWS:
+            df_sample = self.df
+        else:
+            df_sample = self.df.iloc[::len(self.df) // SIZE_SAMPLE_ROWS]
+
+        sample_path = f"{self.file_path}.sample_{self.file_name}"
 
-    # Delete the file from openai and 
-    def update_openai_file(self):
-        
-        # Try deleting file from openai
         try:
-            self._client.files.delete(self.file_id)
-            print(f"file name: {self.file_name}, file id: {self.file_id} has been deleted")
-        # If file already doesn't exist
-        except:
-            print(f"file name: {self.file_name}, file id: {self.file_id} doesn't exist or is already deleted")
+            writer(df_sample, sample_path)
+            sample_size = os.path.getsize(sample_path)
+        finally:
+            if os.path.exists(sample_path):
+                os.remove(sample_path)
+
+        return int(sample_size * len(self.df) / max(len(df_sample), 1))
+
+    def _write_files(self, max_file_size: int, partition_col: str) -> list:
+
+        stem, extension = split_file_extension(self.file_name)
+        writer = FILE_WRITERS[extension]
+
+        if max_file_size is None or partition_col not in self.df.columns:
+            writer(self.df, f"{self.file_path}{self.file_name}")
+            return [self.file_name]
+
+        # The size is estimated from a sample, so the data is only written once, either whole or split
+        file_size = self._estimate_file_size(writer=writer)
+
+        if file_size <= max_file_size:
+            writer(self.df, f"{self.file_path}{self.file_name}")
+            return [self.file_name]
+
+        print(f"file name: {self.file_name} is about {file_size} bytes, splitting it by {partition_col}")
+
+        # The whole file of an earlier run isn't needed anymore
+        if os.path.exists(f"{self.file_path}{self.file_name}"):
+            os.remove(f"{self.file_path}{self.file_name}")
+
+        list_file_names = []
+
+        for value, df_part in self.df.groupby(partition_col, observed=True, sort=False):
+
+            part_name = f"{stem}_{value}{extension}"
+            writer(df_part, f"{self.file_path}{part_name}")
+
+            list_file_names.append(part_name)
+
+        return list_file_names
+
+    def _read_file_entry(self, file_name: str) -> dict:
+
+        # dic_file entries are {'id': file_id, 'sha256': hash of the uploaded content}
+        # Older entries are only the file_id
+        file_entry = self._dic_file.get(file_name)
+
+        if file_entry is None:
+            print(f"Note: File {file_name} doesn't exist yet")     
+            file_id, uploaded_hash = '', None
+
+        elif isinstance(file_entry, dict):
+            file_id, uploaded_hash = file_entry['id'], file_entry.get('sha256')
+
+        else:
+            file_id, uploaded_hash = file_entry, None
+
+        return {
+            'file_name': file_name,
+            'file_id': file_id,
+            'file_hash': get_file_hash(f"{self.file_path}{file_name}"),
+            'uploaded_hash': uploaded_hash
+        }
+
+    @property
+    def file_names(self) -> list:
+        return [part['file_name'] for part in self._parts]
+
+    @property
+    def file_ids(self) -> list:
+        return [part['file_id'] for part in self._parts]
+
+    @property
+    def file_id(self) -> str:
+
+        # Only for data in one file, a split file has to be given to an agent with file_ids
+        if len(self._parts) > 1:
+            raise ValueError(f"{self.file_name} is split into {len(self._parts)} files, use file_ids")
+
+        return self._parts[0]['file_id']
+
+    @property
+    def file_hash(self) -> str:
+        return self._parts[0]['file_hash']
+
+    def _is_unchanged(self, part: dict, force: bool) -> bool:
+
+        if not force and part['file_id'] != '' and part['file_hash'] == part['uploaded_hash']:
+            print(f"file name: {part['file_name']}, file id: {part['file_id']} is unchanged, upload skipped")
+            return True
+
+        return False
+
+    def _upload_span(self, part: dict):
+        return span('file_upload', file_name=part['file_name'], bytes=os.path.getsize(f"{self.file_path}{part['file_name']}"))
+
+    def _record_upload(self, part: dict, file_id: str):
+
+        part['file_id'] = file_id
+        part['uploaded_hash'] = part['file_hash']
+
+        # Referenced once the manifest is saved, until then it's only tracked (and collected if the manifest is never saved)
+        get_file_registry().register(file_id=part['file_id'])
+
+        print(f"file name: {part['file_name']} is uploaded, new file id: {part['file_id']}")
+
+        self._dic_file[part['file_name']] = {
+            'id': part['file_id'],
+            'sha256': part['file_hash']
+        }
+
+        if part['file_name'] != self.file_name:
+            self._dic_file[part['file_name']]['part_of'] = self.file_name
+
+    def _upload_part(self, part: dict, force: bool) -> bool:
+
+        if self._is_unchanged(part=part, force=force):
+            return False
+
+        # The old file isn't deleted here, it's deleted by the file registry's sweep once nothing references it
+        with self._upload_span(part=part), open(f"{self.file_path}{part['file_name']}", 'rb') as f:
+            openai_file = get_rate_limiter().call(
+                self._client.files.create,
+                file=f,
+                purpose='assistants'
+            )
+
+        self._record_upload(part=part, file_id=openai_file.id)
+
+        return True
+
+    async def _aupload_part(self, part: dict, force: bool) -> bool:
+
+        # Same as _upload_part(), on an AsyncOpenAI client
+        if self._is_unchanged(part=part, force=force):
+            return False
+
+        with self._upload_span(part=part), open(f"{self.file_path}{part['file_name']}", 'rb') as f:
+            openai_file = await get_rate_limiter().acall(
+                self._client.files.create,
+                file=f,
+                purpose='assistants'
+            )
+
+        self._record_upload(part=part, file_id=openai_file.id)
+
+        return True
+
+    def _drop_stale_entries(self) -> bool:
+
+        # Entries of this data that aren't written anymore, i.e. the whole file after the data is split by ticker,
+        # or the partitions after it fits in one file again. Their files lose the manifest reference when it's saved.
+        # A partition entry records the file it's part of, older ones are matched by the partition values in the data,
+        # so another file with the same prefix (i.e. df_stocks_info.csv next to df_stocks.csv) is never taken as a partition.
+        stem, extension = split_file_extension(self.file_name)
+
+        if self._partition_col in self.df.columns:
+            set_partition_names = {f"{stem}_{value}{extension}" for value in self.df[self._partition_col].unique()}
+        else:
+            set_partition_names = set()
+
+        dropped = False
+
+        for file_name, file_entry in list(self._dic_file.items()):
+
+            part_of = file_entry.get('part_of') if isinstance(file_entry, dict) else None
+            is_own_entry = file_name == self.file_name or part_of == self.file_name or file_name in set_partition_names
+
+            if is_own_entry and file_name not in self.file_names:
+                print(f"file name: {file_name} is replaced by {self.file_names}, removed from the manifest")
+                del self._dic_file[file_name]
+                dropped = True
+
+        return dropped
+
+    # Delete the file from openai and upload the new one
+    def update_openai_file(self, force: bool=False, save_manifest: bool=True) -> bool:
+
+        """
+        Uploads the file(s) whose content changed since the last upload (or all of them if force is True).
+        The file_id stays the same if nothing changed.
+        If save_manifest is False, only dic_file is updated, the manifest file has to be saved by the caller
+        (if manifest_changed is True).
+        Returns True if any file was uploaded, False if all uploads were skipped.
+        """
+
+        self.uploaded = False
+
+        for part in self._parts:
+            self.uploaded = self._upload_part(part=part, force=force) or self.uploaded
+
+        return self._finish_update(save_manifest=save_manifest)
+
+    async def aupdate_openai_file(self, force: bool=False, save_manifest: bool=True) -> bool:
+
+        """
+        Same as update_openai_file(), for a FileHandler created with an AsyncOpenAI client.
+        The parts of a split file are uploaded at the same time.
+        """
+
+        results = await asyncio.gather(*[self._aupload_part(part=part, force=force) for part in self._parts])
+        self.uploaded = any(results)
 
-        openai_file = self._client.files.create(
-            file=open(f"{self.file_path}{self.file_name}", 'rb'),
-            purpose='assistants'
-        )
+        return self._finish_update(save_manifest=save_manifest)
 
-        self._dic_file[self.file_name] = openai_file.id
-        self.file_id = openai_file.id
+    def _finish_update(self, save_manifest: bool) -> bool:
 
-        print(f"file name: {self.file_name} is uploaded, new file id: {self.file_id}")
+        dropped = self._drop_stale_entries()
+        self.manifest_changed = self.uploaded or dropped
 
-        self.df.to_csv(f"{self.file_path}{self.file_name}", index=False)
+        # Dropped entries are saved too, otherwise their files stay referenced by the manifest
+        if save_manifest and self.manifest_changed:
+            save_file_manifest(dic_file=self._dic_file, manifest_path=f"{self.file_path}{self._dic_file_name}")
 
-        self._dic_file[self.file_name] = self.file_id
-    
-        with open(f"{self.file_path}{self._dic_file_name}", 'w') as json_file:
-            json.dump(self._dic_file, json_file, indent='\t')
-            print(f"{self.file_path}{self._dic_file_name} file has been updated")
\ No newline at end of file
+        return self.uploaded
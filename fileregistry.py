@@ -0,0 +1,287 @@
+import os
+import time
+import threading
+import openai
+from concurrent.futures import ThreadPoolExecutor
+from ratelimiter import get_rate_limiter
+from configstore import get_config_store
+from tracing import span, propagate
+
+# Seconds a thread keeps its attached files referenced if it isn't released,
+# so the refs of threads that are never deleted (or of a process that crashed) run out
+THREAD_REF_TTL = 24 * 3600
+
+class FileRegistry():
+
+	"""
+	Keeps track of which uploaded OpenAI files are still referenced, so the old ones can be deleted later in bulk
+	instead of deleting them inline on every upload.
+
+	A reference is a string naming what uses the file:
+	'manifest:<file_name>' (the file_id in openai_files.json), 'assistant:<assistant_id>' (the assistant's tool_resources)
+	and 'thread:<thread_id>' (attachments in the thread's messages).
+	A file without references is deleted by sweep() once it has been unreferenced for grace_period seconds,
+	which leaves time for a run that already has the file_id.
+	A reference can be given a ttl, it's removed by sweep() once it runs out (thread refs use THREAD_REF_TTL).
+
+	The registry is saved in a config store (config/file_registry.json), so it's shared across runs.
+	The files in the manifest (manifest_path) are registered when the registry is loaded,
+	so files uploaded before the registry existed are released (and deleted) once the manifest replaces them.
+	"""
+
+	def __init__(self, path:str='config/file_registry.json', manifest_path:str='openai_upload_files/openai_files.json'):
+
+		# {file_id: {'refs': [ref, ref], 'unreferenced_at': time the last reference was removed, None if referenced,
+		# 'expires_at': {ref: time the ref runs out}}}
+		self._store = get_config_store(path=path)
+		self._lock = threading.RLock()
+		self._sweep_thread = None
+		self._manifest_path = manifest_path
+
+		if manifest_path is not None and os.path.exists(manifest_path):
+			self._register_manifest(manifest_path=manifest_path)
+
+	def _register_manifest(self, manifest_path:str):
+
+		# Only the files the registry doesn't know yet, the known ones already have their manifest ref (or had it removed)
+		for file_name, file_entry in get_config_store(path=manifest_path).items():
+
+			file_id = file_entry['id'] if isinstance(file_entry, dict) else file_entry
+
+			if file_id and file_id not in self._store:
+				self.add_ref(file_id=file_id, ref=f'manifest:{file_name}')
+
+	def _get_manifest_file_names(self) -> set:
+
+		# Names of the files this project uploads: the manifest entries and the whole files their partitions are part of
+		if self._manifest_path is None or not os.path.exists(self._manifest_path):
+			return set()
+
+		dic_manifest = get_config_store(path=self._manifest_path)
+		set_part_of = {file_entry.get('part_of') for file_entry in dic_manifest.values() if isinstance(file_entry, dict)}
+
+		return (set(dic_manifest) | set_part_of) - {None}
+
+	def _get_entry(self, file_id:str) -> dict:
+
+		if file_id not in self._store:
+			self._store[file_id] = {'refs': [], 'unreferenced_at': time.time()}
+
+		return self._store[file_id]
+
+	def register(self, file_id:str):
+
+		"""
+		Tracks a newly uploaded file, it's collected if nothing references it within the grace period.
+		"""
+
+		with self._lock:
+			self._get_entry(file_id=file_id)
+
+	def add_ref(self, file_id:str, ref:str, ttl:float=None):
+
+		"""
+		If ttl (seconds) is given, the ref is removed by sweep() after ttl, adding it again renews it.
+		"""
+
+		with self._lock:
+
+			entry = self._get_entry(file_id=file_id)
+
+			if ref not in entry['refs']:
+				entry['refs'].append(ref)
+				entry['unreferenced_at'] = None
+
+			if ttl is not None:
+				entry.setdefault('expires_at', {})[ref] = time.time() + ttl
+
+			self._store.touch(file_id)
+
+	def remove_ref(self, file_id:str, ref:str):
+
+		with self._lock:
+
+			if file_id not in self._store or ref not in self._store[file_id]['refs']:
+				return
+
+			entry = self._store[file_id]
+			entry['refs'].remove(ref)
+			entry.get('expires_at', {}).pop(ref, None)
+
+			if len(entry['refs']) == 0:
+				entry['unreferenced_at'] = time.time()
+
+			self._store.touch(file_id)
+
+	def set_refs(self, ref:str, file_ids:list):
+
+		"""
+		Makes ref reference exactly file_ids, i.e. the files of an assistant after its tool_resources changed.
+		Files that ref referenced before and aren't in file_ids lose the reference.
+		"""
+
+		file_ids = [file_id for file_id in file_ids if file_id]
+
+		with self._lock:
+
+			for file_id in self.get_files(ref=ref):
+				if file_id not in file_ids:
+					self.remove_ref(file_id=file_id, ref=ref)
+
+			for file_id in file_ids:
+				self.add_ref(file_id=file_id, ref=ref)
+
+	def release(self, ref:str):
+
+		# Removes ref from every file, i.e. when a thread is deleted
+		self.set_refs(ref=ref, file_ids=[])
+
+	def get_files(self, ref:str) -> list:
+
+		with self._lock:
+			return [file_id for file_id, entry in self._store.items() if ref in entry['refs']]
+
+	def expire_refs(self) -> int:
+
+		"""
+		Removes the refs whose ttl ran out. Thread refs without a ttl (saved before refs had one)
+		are given THREAD_REF_TTL from now. Returns the number of refs removed.
+		"""
+
+		now = time.time()
+		list_expired = []
+
+		with self._lock:
+
+			for file_id, entry in self._store.items():
+
+				dic_expires = entry.setdefault('expires_at', {})
+
+				for ref in entry['refs']:
+
+					if ref.startswith('thread:') and ref not in dic_expires:
+						dic_expires[ref] = now + THREAD_REF_TTL
+						self._store.touch(file_id)
+
+					elif ref in dic_expires and dic_expires[ref] <= now:
+						list_expired.append((file_id, ref))
+
+			for file_id, ref in list_expired:
+				self.remove_ref(file_id=file_id, ref=ref)
+
+		return len(list_expired)
+
+	def get_refs(self, prefix:str='') -> list:
+
+		# Every ref starting with prefix, i.e. get_refs(prefix='manifest:')
+		with self._lock:
+			return list(dict.fromkeys(ref for entry in self._store.values() for ref in entry['refs'] if ref.startswith(prefix)))
+
+	def get_unreferenced(self, grace_period:float=3600) -> list:
+
+		with self._lock:
+			return [
+				file_id for file_id, entry in self._store.items()
+				if len(entry['refs']) == 0 and entry['unreferenced_at'] <= time.time() - grace_period
+			]
+
+	def _delete_file(self, client, file_id:str, untracked:bool=False) -> bool:
+
+		with self._lock:
+
+			# It may have been referenced again since the sweep started
+			# Untracked files aren't in the registry, unless they have been registered since
+			if file_id in self._store:
+				if len(self._store[file_id]['refs']) > 0:
+					return False
+
+			elif not untracked:
+				return False
+
+		try:
+			get_rate_limiter().call(client.files.delete, file_id)
+		except openai.NotFoundError:
+			print(f"file id: {file_id} doesn't exist or is already deleted")
+
+		with self._lock:
+			if file_id in self._store and len(self._store[file_id]['refs']) == 0:
+				del self._store[file_id]
+
+		return True
+
+	def sweep(self, client, grace_period:float=3600, include_untracked:bool=False, max_workers:int=8) -> list:
+
+		"""
+		Deletes the files that have had no reference for grace_period seconds, max_workers at a time.
+		If include_untracked is True, files in the account that the registry doesn't know about
+		(i.e. uploaded by a run that crashed before they were registered) and older than grace_period are deleted too.
+		Only the untracked files named like a file of the manifest are deleted, the account can have files of other projects.
+		Returns the deleted file_ids.
+		"""
+
+		self.expire_refs()
+
+		list_file_ids = self.get_unreferenced(grace_period=grace_period)
+		list_untracked = []
+
+		if include_untracked:
+
+			created_before = time.time() - grace_period
+			set_file_names = self._get_manifest_file_names()
+
+			with self._lock:
+				list_untracked = [
+					file.id for file in get_rate_limiter().call(client.files.list, purpose='assistants').auto_paging_iter()
+					if file.id not in self._store and file.created_at <= created_before and getattr(file, 'filename', None) in set_file_names
+				]
+
+		set_untracked = set(list_untracked)
+		list_file_ids += list_untracked
+
+		if len(list_file_ids) == 0:
+			return []
+
+		print(f'Deleting {len(list_file_ids)} unreferenced file(s)')
+
+		def delete_file(file_id:str) -> bool:
+			return self._delete_file(client=client, file_id=file_id, untracked=file_id in set_untracked)
+
+		with span('file_sweep', files=len(list_file_ids)), ThreadPoolExecutor(max_workers=min(max_workers, len(list_file_ids))) as executor:
+			deleted = list(executor.map(propagate(delete_file), list_file_ids))
+
+		list_deleted = [file_id for file_id, is_deleted in zip(list_file_ids, deleted) if is_deleted]
+
+		print(f'{len(list_deleted)} unreferenced file(s) have been deleted')
+
+		return list_deleted
+
+	def sweep_in_background(self, client, **kwargs) -> threading.Thread:
+
+		"""
+		Runs sweep() on a background thread, so the caller doesn't wait for the deletes.
+		Does nothing if a sweep is still running. kwargs are passed to sweep().
+		"""
+
+		with self._lock:
+
+			if self._sweep_thread is not None and self._sweep_thread.is_alive():
+				return self._sweep_thread
+
+			self._sweep_thread = threading.Thread(target=self.sweep, kwargs={'client': client, **kwargs}, daemon=True)
+			self._sweep_thread.start()
+
+		return self._sweep_thread
+
+# The registry every handler uses
+_file_registry = None
+_file_registry_lock = threading.Lock()
+
+def get_file_registry() -> FileRegistry:
+
+	global _file_registry
+
+	with _file_registry_lock:
+		if _file_registry is None:
+			_file_registry = FileRegistry()
+
+	return _file_registry
@@ -0,0 +1,126 @@
+import pandas as pd
+
+class MessageStore():
+
+	"""
+	Append-only log of the messages recorded by a ThreadManager.
+	Messages are kept as one list per column, so recording a message doesn't copy the existing ones.
+	The DataFrame is only built when it's asked for (to_dataframe()) and it's cached until a new message comes in.
+	The latest message of each assistant (overall and per node_run_id) is indexed as messages come in,
+	so looking them up doesn't go through all messages.
+	"""
+
+	def __init__(self, schema:dict):
+
+		"""
+		schema has the following format:
+		{
+			column: dtype,
+			column: dtype
+		}
+		"""
+
+		self._schema = schema
+		self._columns = {col: [] for col in schema}
+		self._df = None
+
+		# {assistant_id: index}
+		self._latest_by_assistant = {}
+		# {assistant_id: {node_run_id: index}}
+		self._latest_by_node_run = {}
+
+	def __len__(self) -> int:
+		return len(self._columns['message_id'])
+
+	def append(self, record:dict):
+
+		# Columns missing in the record are stored as None
+		for col, values in self._columns.items():
+			values.append(record.get(col))
+
+		index = len(self) - 1
+		assistant_id = record.get('assistant_id')
+		node_run_id = record.get('node_run_id')
+
+		# Messages by the user have no assistant_id, they're not indexed
+		if assistant_id is not None:
+			self._latest_by_assistant[assistant_id] = index
+
+			if node_run_id is not None:
+				self._latest_by_node_run.setdefault(assistant_id, {})[node_run_id] = index
+
+		# The cached DataFrame is outdated now
+		self._df = None
+
+	def extend(self, records:list[dict]):
+
+		for record in records:
+			self.append(record)
+
+	def get(self, index:int) -> dict:
+
+		"""Returns the message at the given position as a dictionary."""
+
+		return {col: values[index] for col, values in self._columns.items()}
+
+	def records(self) -> list[dict]:
+
+		"""Returns all messages as a list of dictionaries, oldest first."""
+
+		return [self.get(index) for index in range(len(self))]
+
+	def latest_by_assistant(self) -> dict:
+
+		"""
+		Returns the latest message of each assistant
+		{assistant_id: message, assistant_id: message}
+		"""
+
+		return {assistant_id: self.get(index) for assistant_id, index in self._latest_by_assistant.items()}
+
+	def latest_by_node_run(self, node_run_id:int=None) -> dict:
+
+		"""
+		Returns the latest message of each assistant in node_run_id.
+		If node_run_id is None, the latest node_run_id of each assistant is used.
+		{assistant_id: message, assistant_id: message}
+		"""
+
+		dic_messages = {}
+
+		for assistant_id, dic_node_runs in self._latest_by_node_run.items():
+
+			if node_run_id is None:
+				dic_messages[assistant_id] = self.get(dic_node_runs[max(dic_node_runs)])
+
+			elif node_run_id in dic_node_runs:
+				dic_messages[assistant_id] = self.get(dic_node_runs[node_run_id])
+
+		return dic_messages
+
+	def next_loc(self) -> int:
+
+		"""Returns the _msg_loc for the next message. _msg_loc only ever increases."""
+
+		if len(self) == 0:
+			return 0
+
+		return self._columns['_msg_loc'][-1] + 1
+
+	def to_dataframe(self) -> pd.DataFrame:
+
+		if self._df is None:
+
+			if len(self) == 0:
+				self._df = pd.DataFrame({col: pd.Series(dtype=dt) for col, dt in self._schema.items()})
+			else:
+				self._df = pd.DataFrame(self._columns, columns=list(self._schema))
+
+		return self._df
+
+	def clear(self):
+
+		self._columns = {col: [] for col in self._schema}
+		self._df = None
+		self._latest_by_assistant = {}
+		self._latest_by_node_run = {}
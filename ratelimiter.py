@@ -0,0 +1,386 @@
+import time
+import heapq
+import random
+import asyncio
+import threading
+import itertools
+import openai
+from tracing import get_tracer, span
+
+# Seconds between checks of an async caller that isn't first in the queue,
+# and the longest sleep of the first one before it checks again (i.e. for a pause added by a 429)
+_ASYNC_POLL = 0.01
+_ASYNC_MAX_SLEEP = 0.5
+
+# Status codes retried besides 429 and 5xx: request timeout and conflict (i.e. a run already active on the thread)
+_RETRY_STATUS_CODES = {408, 409}
+
+def get_retry_after(response) -> float:
+
+	# Seconds the server asked us to wait (Retry-After header), None if not given
+	try:
+		return float(response.headers.get('retry-after'))
+	except (AttributeError, TypeError, ValueError):
+		return None
+
+class RateLimiter():
+
+	"""
+	Token bucket limiter shared by every OpenAI call in the process.
+	There is one bucket for requests per minute and one for tokens per minute, both refill continuously.
+	Callers wait in a priority queue, a lower priority number goes first (i.e. the main node at depth 1 before its child nodes).
+	Callers with the same priority go in the order they came in.
+
+	A 429 pauses the whole limiter (Retry-After, or a jittered exponential backoff) since every caller shares the account limits.
+	5xx, 408 and 409 errors, dropped connections and timeouts are retried with the same backoff, but only the failed call waits.
+	These are the errors the OpenAI SDK would retry itself, its retries are turned off (see clienthandler.py).
+	"""
+
+	def __init__(
+			self,
+			requests_per_minute:int=500,
+			tokens_per_minute:int=200000,
+			max_retries:int=5,
+			base_wait:float=1,
+			max_wait:float=60
+			):
+
+		if requests_per_minute <= 0 or tokens_per_minute <= 0:
+			raise ValueError('requests_per_minute and tokens_per_minute have to be positive')
+
+		self.requests_per_minute = requests_per_minute
+		self.tokens_per_minute = tokens_per_minute
+		self.max_retries = max_retries
+		self.base_wait = base_wait
+		self.max_wait = max_wait
+
+		# Buckets start full
+		self._requests = float(requests_per_minute)
+		self._tokens = float(tokens_per_minute)
+		self._last_refill = time.monotonic()
+		self._paused_until = 0
+
+		self._condition = threading.Condition()
+		self._queue = []
+		self._counter = itertools.count()
+
+		self._metrics = {
+			'requests': 0,
+			'retries': 0,
+			'rate_limited': 0,
+			'server_errors': 0,
+			'connection_errors': 0,
+			'max_queue_depth': 0
+		}
+
+		# {priority: {'count': n, 'total_wait': seconds, 'max_wait': seconds}}
+		self._queue_waits = {}
+
+	def _refill(self):
+
+		now = time.monotonic()
+		elapsed = now - self._last_refill
+		self._last_refill = now
+
+		self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+		self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+	def _get_wait(self, tokens:int) -> float:
+
+		# Seconds until both buckets have enough and the limiter isn't paused
+		wait_requests = (1 - self._requests) * 60 / self.requests_per_minute
+		wait_tokens = (tokens - self._tokens) * 60 / self.tokens_per_minute
+		wait_pause = self._paused_until - time.monotonic()
+
+		return max(wait_requests, wait_tokens, wait_pause, 0)
+
+	def _enqueue(self, priority:int) -> tuple:
+
+		# Has to be called with self._condition held
+		entry = (priority, next(self._counter))
+		heapq.heappush(self._queue, entry)
+
+		self._metrics['max_queue_depth'] = max(self._metrics['max_queue_depth'], len(self._queue))
+
+		return entry
+
+	def _try_take(self, entry:tuple, tokens:int) -> float:
+
+		"""
+		Has to be called with self._condition held.
+		Takes the request from the buckets if entry is first in the queue and the buckets have enough.
+		Returns 0 if it was taken, the seconds to wait if entry is first, None if it isn't first.
+		"""
+
+		self._refill()
+
+		# Only the first in the queue can take from the buckets, the rest wait until they're first
+		if self._queue[0] != entry:
+			return None
+
+		wait = self._get_wait(tokens=tokens)
+
+		if wait == 0:
+			heapq.heappop(self._queue)
+			self._requests -= 1
+			self._tokens -= tokens
+			self._condition.notify_all()
+
+		return wait
+
+	def _dequeue(self, entry:tuple):
+
+		# Has to be called with self._condition held
+		# If the wait was interrupted, take the entry out so it doesn't block the queue
+		if entry in self._queue:
+			self._queue.remove(entry)
+			heapq.heapify(self._queue)
+
+		self._condition.notify_all()
+
+	def _record_acquire(self, priority:int, wait_time:float):
+
+		with self._condition:
+
+			self._metrics['requests'] += 1
+
+			dic_wait = self._queue_waits.setdefault(priority, {'count': 0, 'total_wait': 0, 'max_wait': 0})
+			dic_wait['count'] += 1
+			dic_wait['total_wait'] += wait_time
+			dic_wait['max_wait'] = max(dic_wait['max_wait'], wait_time)
+
+	def acquire(self, tokens:int=0, priority:int=0) -> float:
+
+		"""
+		Blocks until the request (and its estimated tokens) fits in the buckets and every caller ahead of it is served.
+		Returns the seconds spent waiting.
+		"""
+
+		start = time.monotonic()
+
+		# A request larger than the bucket would never fit
+		tokens = min(tokens, self.tokens_per_minute)
+
+		with self._condition:
+
+			entry = self._enqueue(priority=priority)
+
+			try:
+				while True:
+
+					wait = self._try_take(entry=entry, tokens=tokens)
+
+					if wait == 0:
+						break
+
+					self._condition.wait(timeout=wait)
+
+			finally:
+				self._dequeue(entry=entry)
+
+		wait_time = time.monotonic() - start
+
+		self._record_acquire(priority=priority, wait_time=wait_time)
+
+		return wait_time
+
+	async def async_acquire(self, tokens:int=0, priority:int=0) -> float:
+
+		"""
+		Same as acquire(), but waits with asyncio.sleep() so the event loop (and every other coroutine) keeps going.
+		The lock is only held to check the buckets, never while waiting.
+		Callers that aren't first check again every _ASYNC_POLL seconds, since a thread can't wake up a coroutine.
+		"""
+
+		start = time.monotonic()
+
+		tokens = min(tokens, self.tokens_per_minute)
+
+		with self._condition:
+			entry = self._enqueue(priority=priority)
+
+		try:
+			while True:
+
+				with self._condition:
+					wait = self._try_take(entry=entry, tokens=tokens)
+
+				if wait == 0:
+					break
+
+				# The first caller checks again when the buckets should have enough (or a pause may have been added)
+				await asyncio.sleep(_ASYNC_POLL if wait is None else min(wait, _ASYNC_MAX_SLEEP))
+
+		finally:
+			with self._condition:
+				self._dequeue(entry=entry)
+
+		wait_time = time.monotonic() - start
+
+		self._record_acquire(priority=priority, wait_time=wait_time)
+
+		return wait_time
+
+	def record_tokens(self, tokens:int):
+
+		"""
+		Takes tokens from the token bucket after the fact, i.e. the difference between a run's actual usage and its estimate.
+		A negative number gives tokens back.
+		"""
+
+		with self._condition:
+			self._refill()
+			self._tokens = min(self.tokens_per_minute, self._tokens - tokens)
+			self._condition.notify_all()
+
+	def backoff(self, attempt:int, retry_after:float=None, pause:bool=True) -> float:
+
+		"""
+		Returns the seconds to wait before retry number attempt (from 0): Retry-After if the server gave it,
+		otherwise a random wait up to base_wait * 2**attempt (capped at max_wait).
+		If pause is True, every caller of the limiter waits as well.
+		"""
+
+		if retry_after is None:
+			retry_after = random.uniform(0, min(self.max_wait, self.base_wait * 2**attempt))
+
+		with self._condition:
+			self._metrics['retries'] += 1
+
+			if pause:
+				self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+				self._condition.notify_all()
+
+		return retry_after
+
+	def _handle_error(self, error:Exception, attempt:int) -> float:
+
+		# Returns the seconds the caller itself has to wait before the retry (0 when the whole limiter is paused)
+		# Raises the error again if it can't be retried
+		if attempt >= self.max_retries:
+			raise error
+
+		if isinstance(error, openai.RateLimitError):
+			with self._condition:
+				self._metrics['rate_limited'] += 1
+
+			wait_time = self.backoff(attempt=attempt, retry_after=get_retry_after(error.response))
+			print(f'Rate limited, every OpenAI call waits {wait_time:.1f} seconds')
+			return 0
+
+		# Dropped connections and timeouts have no status code
+		if isinstance(error, openai.APIConnectionError):
+			metric, description = 'connection_errors', f'OpenAI connection error ({type(error).__name__})'
+		else:
+			metric, description = 'server_errors', f'OpenAI server error ({error.status_code})'
+
+		with self._condition:
+			self._metrics[metric] += 1
+
+		wait_time = self.backoff(attempt=attempt, pause=False)
+		print(f'{description}, retrying in {wait_time:.1f} seconds')
+
+		return wait_time
+
+	def _check_retryable(self, error:Exception):
+
+		# Raises the errors that aren't worth a retry (i.e. 400, 401, 404)
+		if isinstance(error, (openai.APIConnectionError, openai.RateLimitError)):
+			return
+
+		if isinstance(error, openai.APIStatusError) and (error.status_code in _RETRY_STATUS_CODES or error.status_code >= 500):
+			return
+
+		raise error
+
+	def _record_wait(self, wait_time:float, priority:int, tokens:int):
+
+		# Waits under a millisecond are just the lock, not worth a span
+		if wait_time >= 0.001:
+			get_tracer().record('rate_limit_wait', duration=wait_time, priority=priority, tokens=tokens)
+
+	def call(self, func, *args, priority:int=0, tokens:int=0, **kwargs):
+
+		"""
+		Calls func(*args, **kwargs) once the limiter lets it through, retrying on 429, 5xx, 408, 409 and connection errors.
+		"""
+
+		for attempt in range(self.max_retries+1):
+
+			self._record_wait(wait_time=self.acquire(tokens=tokens, priority=priority), priority=priority, tokens=tokens)
+
+			try:
+				return func(*args, **kwargs)
+			except (openai.APIStatusError, openai.APIConnectionError) as e:
+				self._check_retryable(error=e)
+				wait_time = self._handle_error(error=e, attempt=attempt)
+
+				with span('sleep', reason='retry', attempt=attempt):
+					time.sleep(wait_time)
+
+	async def acall(self, func, *args, priority:int=0, tokens:int=0, **kwargs):
+
+		"""
+		Same as call(), for coroutine functions (AsyncOpenAI).
+		The wait for the limiter is async_acquire(), so it doesn't take up a thread.
+		"""
+
+		for attempt in range(self.max_retries+1):
+
+			self._record_wait(wait_time=await self.async_acquire(tokens=tokens, priority=priority), priority=priority, tokens=tokens)
+
+			try:
+				return await func(*args, **kwargs)
+			except (openai.APIStatusError, openai.APIConnectionError) as e:
+				self._check_retryable(error=e)
+				wait_time = self._handle_error(error=e, attempt=attempt)
+
+				with span('sleep', reason='retry', attempt=attempt):
+					await asyncio.sleep(wait_time)
+
+	@property
+	def metrics(self) -> dict:
+
+		"""
+		Counts of requests, retries, 429s and 5xx errors, the longest queue,
+		and the queue wait time per priority ({priority: {'count', 'total_wait', 'avg_wait', 'max_wait'}})
+		"""
+
+		with self._condition:
+
+			dic_metrics = self._metrics.copy()
+			dic_metrics['queue_depth'] = len(self._queue)
+			dic_metrics['queue_wait'] = {
+				priority: {**dic_wait, 'avg_wait': dic_wait['total_wait'] / dic_wait['count']}
+				for priority, dic_wait in sorted(self._queue_waits.items())
+			}
+
+		return dic_metrics
+
+# The limiter every handler uses
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+def get_rate_limiter() -> RateLimiter:
+
+	global _rate_limiter
+
+	with _rate_limiter_lock:
+		if _rate_limiter is None:
+			_rate_limiter = RateLimiter()
+
+	return _rate_limiter
+
+def configure_rate_limiter(**kwargs) -> RateLimiter:
+
+	"""
+	Replaces the shared limiter, i.e. configure_rate_limiter(requests_per_minute=5000, tokens_per_minute=800000)
+	to match the account's limits. Should be called before any OpenAI call is made.
+	"""
+
+	global _rate_limiter
+
+	with _rate_limiter_lock:
+		_rate_limiter = RateLimiter(**kwargs)
+
+	return _rate_limiter
@@ -0,0 +1,42 @@
+# Runs logic that is shared by a sync class and its async counterpart (i.e. ThreadManager and AsyncThreadManager).
+# The logic is written once as a generator of steps: it yields what it needs done (an OpenAI call, a thread run, ...)
+# and gets the result back. Only the function that does the steps differs, a plain call or an await.
+
+def run_steps(steps, do_step):
+
+	"""
+	Runs the generator steps, do_step(step) does every yielded step and its result is sent back.
+	An error in a step is raised inside the generator, so its spans and try/except see it.
+	Returns what the generator returns.
+	"""
+
+	result, error = None, None
+
+	while True:
+
+		try:
+			step = steps.send(result) if error is None else steps.throw(error)
+		except StopIteration as stop:
+			return stop.value
+
+		try:
+			result, error = do_step(step), None
+		except BaseException as e:
+			result, error = None, e
+
+async def arun_steps(steps, do_step):
+
+	# Same as run_steps(), do_step is a coroutine function
+	result, error = None, None
+
+	while True:
+
+		try:
+			step = steps.send(result) if error is None else steps.throw(error)
+		except StopIteration as stop:
+			return stop.value
+
+		try:
+			result, error = await do_step(step), None
+		except BaseException as e:
+			result, error = None, e
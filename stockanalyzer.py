@@ -3,9 +3,14 @@ import openai
 from typing import Literal
 from openai import OpenAI
 from yfinancehandler import YFHandler
-from filehandler import FileHandler
+from filehandler import FileHandler, save_file_manifest
+from configstore import save_config
+from fileregistry import get_file_registry
 from agenthandler import AgentHandler
+from clienthandler import get_client
 from eventhandler import ThreadManager
+from datapipeline import DataPipeline
+from featurehandler import FeatureHandler
 
 # There has to be a better way of doing this
 with open('config/dataframe_schemas.json', 'r') as f:
@@ -15,64 +20,167 @@ def stock_data_setup(
 	client: OpenAI, 
 	ticker: list,
 	config:dict, 
-	dic_files:dict=None
+	dic_files:dict=None,
+	file_format:str='.csv',
+	max_file_size:int=None,
+	upload_workers:int=4,
+	queue_size:int=1,
+	metrics:dict=None
 	):
 
+	"""
+	The data goes through a pipeline: fetch -> normalize -> serialize -> upload,
+	so i.e. cashflow can be fetched while prices are serialized and income statements are uploaded.
+	Up to upload_workers files are uploaded at the same time, queue_size is the number of items that can wait between stages.
+	If metrics (a dictionary) is given, it's filled with the time and queue depth of each stage.
+
+	If config has 'features' (i.e. 'features': {}), a table of precomputed metrics per ticker
+	(returns, moving averages, volatility, margins, growth, valuation ratios) is uploaded as well, it needs 'price'.
+
+	file_format is the extension of the uploaded files ('.csv', '.csv.gz' or '.parquet').
+	If max_file_size (bytes) is given, larger data is uploaded as one file per ticker.
+	"""
+
+	FILE_PATH = 'openai_upload_files/'
 	OPENAI_DIC_FILE_NAME = 'openai_files.json'
-	dic_data_collection = {}
 	yf_handler = YFHandler(stock_list=ticker, schemas=schemas)
 
 	# Mapping of data types to file names and handler methods
 	data_mapping = {
 		'price': {
-			'file_name': 'df_stocks.csv',
-			'method': 'import_stocks'
+			'file_name': f'df_stocks{file_format}',
+			'method': 'fetch_stocks',
+			'schema': 'stocks'
 		},
 		'cashflow': {
-			'file_name': 'df_cashflow.csv',
-			'method': 'import_cashflow'
+			'file_name': f'df_cashflow{file_format}',
+			'method': 'fetch_cashflow',
+			'schema': 'cashflow'
 		},
 		'income_statement': {
-			'file_name': 'df_income_stmt.csv',
-			'method': 'import_income_stmt'
+			'file_name': f'df_income_stmt{file_format}',
+			'method': 'fetch_income_stmt',
+			'schema': 'income_stmt'
 		},
 		'balance_sheet': {
-			'file_name': 'df_balance_sheet.csv',
-			'method': 'import_balance_sheet'
+			'file_name': f'df_balance_sheet{file_format}',
+			'method': 'fetch_balance_sheet',
+			'schema': 'balance_sheet'
 		}
 	}
 
-	# Loop each data requested (i.e. stock price, cashflow, income statement)
-	for data_requested, data_config in config.items():
+	# Each stage takes the output of the previous one
+	# fetch: data requested -> (data requested, frames of each ticker)
+	def fetch(data_requested:str) -> tuple:
+		
+		# Get the right method from YFHandler
+		fetch_method = getattr(yf_handler, data_mapping[data_requested]['method'])
+
+		return data_requested, fetch_method(period=config[data_requested]['period'])
+
+	# normalize: -> (data requested, one frame in the schema)
+	def normalize(fetch_output:tuple) -> tuple:
+
+		data_requested, frames = fetch_output
+
+		return data_requested, yf_handler.normalize(frames=frames, schema_name=data_mapping[data_requested]['schema'])
+
+	# serialize: -> FileHandler, which writes the file
+	def serialize(normalize_output:tuple) -> FileHandler:
+
+		data_requested, df_data = normalize_output
+
+		return FileHandler(
+			df=df_data,
+			dic_file=dic_files,
+			file_name=data_mapping[data_requested]['file_name'],
+			dic_file_name=OPENAI_DIC_FILE_NAME,
+			client=client,
+			max_file_size=max_file_size
+		)
+
+	# upload: -> FileHandler, the manifest is saved once at the end
+	def upload(file_handler:FileHandler) -> FileHandler:
+
+		file_handler.update_openai_file(save_manifest=False)
+
+		return file_handler
+
+	pipeline = DataPipeline(
+		stages=[
+			('fetch', fetch, 1),
+			('normalize', normalize, 1),
+			('serialize', serialize, 1),
+			('upload', upload, upload_workers)
+		],
+		queue_size=queue_size
+	)
 
-		# If it exists in data_mapping (i.e. it's a valid data from yfinance)
-		if data_requested in data_mapping.keys():
-			
-			# Get the right method from YFHandler
-			import_method = getattr(yf_handler, data_mapping[data_requested]['method'])
+	# Only the data that exists in data_mapping (i.e. it's a valid data from yfinance)
+	items = {data_requested: data_requested for data_requested in config if data_requested in data_mapping}
+
+	dic_data_collection = pipeline.run(items=items)
+
+	print(f'Data setup done in {pipeline.total_time:.1f} seconds')
+
+	for stage_name, stage_metrics in pipeline.metrics.items():
+		print(f"{stage_name}: {stage_metrics['items']} items, busy {stage_metrics['busy_time']:.1f}s, waiting {stage_metrics['wait_time']:.1f}s, max queue depth {stage_metrics['max_queue_depth']}")
+
+	if metrics is not None:
+		metrics.update(pipeline.metrics)
+		metrics['total_time'] = pipeline.total_time
+
+	# If any data failed, the manifest file is not saved, so it still has the previous file ids
+	if pipeline.errors:
+		print(f'{len(pipeline.errors)} data setup(s) failed, {FILE_PATH}{OPENAI_DIC_FILE_NAME} is not updated')
+		raise next(iter(pipeline.errors.values()))
+
+	if 'features' in config and 'price' in dic_data_collection:
+
+		# Statements have 4 periods a year if they're quarterly
+		statement_period = config.get('income_statement', config.get('cashflow', {})).get('period', 'quarter')
+
+		feature_handler = FeatureHandler(
+			stock_info=yf_handler.stock_info,
+			periods_per_year=4 if statement_period == 'quarter' else 1
+		)
+
+		dic_statements = {
+			data_requested: dic_data_collection[data_requested].df if data_requested in dic_data_collection else None
+			for data_requested in ['income_statement', 'balance_sheet', 'cashflow']
+		}
+
+		df_features = feature_handler.build_metrics_table(
+			df_stocks=dic_data_collection['price'].df,
+			df_income=dic_statements['income_statement'],
+			df_balance_sheet=dic_statements['balance_sheet'],
+			df_cashflow=dic_statements['cashflow']
+		)
+
+		file_handler = FileHandler(
+			df=df_features,
+			dic_file=dic_files,
+			file_name=f'df_features{file_format}',
+			dic_file_name=OPENAI_DIC_FILE_NAME,
+			client=client
+		)
 
-			# Execute the method to get the data
-			df_data = import_method(period=data_config['period'])
+		file_handler.update_openai_file(save_manifest=False)
 
-			# Create a FileHandler object
-			file_handler = FileHandler(
-				df=df_data,
-				dic_file=dic_files,
-				file_name=data_mapping[data_requested]['file_name'],
-				dic_file_name=OPENAI_DIC_FILE_NAME,
-				client=client
-			)
+		dic_data_collection['features'] = file_handler
 
-			file_handler.update_openai_file()
+	# Nothing changed, no need to rewrite the manifest
+	if any(file_handler.manifest_changed for file_handler in dic_data_collection.values()):
+		save_file_manifest(dic_file=dic_files, manifest_path=f'{FILE_PATH}{OPENAI_DIC_FILE_NAME}')
 
-			# Store the file handler in the collection
-			dic_data_collection[data_requested] = file_handler
+		# The files replaced by this upload are deleted in the background once nothing references them
+		get_file_registry().sweep_in_background(client=client)
 
 	return dic_data_collection
 
 def analyze_stock(ticker: list, dic_files: dict, dic_assistants: dict):
 	
-	client = OpenAI()
+	client = get_client()
 
 	file_stocks = stock_data_setup(client=client, ticker=ticker, type='price', dic_files=dic_files)
 	file_cashflow = stock_data_setup(client=client, ticker=ticker, type='cash', dic_files=dic_files)
@@ -80,12 +188,10 @@ def analyze_stock(ticker: list, dic_files: dict, dic_assistants: dict):
 
 	# Have to manually update the tool_resources because the file_id can change
 	dic_assistants['fin_analyst']['tool_resources'] = {
-		'code_interpreter': {'file_ids': [dic_files['df_stocks.csv']]}
+		'code_interpreter': {'file_ids': file_stocks.file_ids}
 	}
 
-	with open('config/assistants.json', 'w') as json_file:
-		json.dump(dic_assistants, json_file)
-		print(f'assistants.json file has been updated')
+	save_config(dic_file=dic_assistants, path='config/assistants.json', keys=['fin_analyst'])
 
 	fin_analyst = AgentHandler(
 		client = client, 
@@ -124,7 +230,7 @@ def analyze_stock(ticker: list, dic_files: dict, dic_assistants: dict):
 	thread.run_thread(
 		assistant=fin_analyst,
 		prompt=prompt_start,
-		attachments=[file_stocks.file_id, file_cashflow.file_id, file_income_stmt.file_id]
+		attachments=[*file_stocks.file_ids, *file_cashflow.file_ids, *file_income_stmt.file_ids]
 	)
 
 	next_prompt = thread.last_message
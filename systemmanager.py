@@ -2,9 +2,14 @@
 
 import pandas as pd
 from typing import Union, Tuple
-from openai import OpenAI
-from agenthandler import AgentHandler
-from eventhandler import ThreadManager
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+from openai import OpenAI, AsyncOpenAI
+from agenthandler import AgentHandler, AsyncAgentHandler, sync_all
+from eventhandler import ThreadManager, AsyncThreadManager
+from tracing import span, propagate
+from steprunner import run_steps, arun_steps
+from usageledger import RunBudget, to_runs_dataframe, summarize_runs
 # import logging as log
 
 # Check to see if assistant is already assigned to this thread
@@ -43,7 +48,10 @@ class AgentThreadManager():
 			thread in self._agent_to_threads.get(agent, set())
 		)
 
-class SystemNode:
+class _BaseSystemNode:
+
+	# Everything that doesn't talk to OpenAI, shared by SystemNode and AsyncSystemNode
+	# The subclasses only do the thread runs
 
 	# As a start each Node will have 2 or 3 agents (models)
 	# 1 agent will always be the reviewer
@@ -52,27 +60,84 @@ class SystemNode:
 	# TODO: We don't need to worry giving data mid run. All data should be set first and assigned to the agents/assistants
 	# TODO: User input (stock ticker) -> runs stock_data_setup -> run the multi node system
 
+	_prompt_start = 'Ignore this sentence, this is only to begin the thread.'
+
 	def __init__(
 			self, 
-			client:OpenAI, 
+			client, 
 			name:str, 
-			main_agent:AgentHandler, 
-			sub_agents:list[AgentHandler],
-			agent_thread_manager:AgentThreadManager
+			main_agent, 
+			sub_agents:list,
+			agent_thread_manager:AgentThreadManager,
+			parallel_sub_agents:bool=False,
+			max_concurrency:int=4
 			):
+
+		"""
+		If parallel_sub_agents is True, each sub agent is given the main agent's instruction
+		on its own short-lived branch thread, at most max_concurrency sub agents at a time.
+		Their outputs are merged back into this node's thread.df_messages.
+		"""
+
+		if max_concurrency < 1:
+			raise ValueError('max_concurrency has to be at least 1')
+
+		self._client = client
 		self.name = name
 		self.agent_thread_manager = agent_thread_manager
 		self.main_agent = main_agent
 		self.sub_agents = sub_agents
 		self.last_run_messages = {} # This is also message_output, # TODO: naming inconsistency
+		self.parallel_sub_agents = parallel_sub_agents
+		self.max_concurrency = max_concurrency
+		self.thread = None
+
+		# Priority of the node's OpenAI calls in the rate limiter, lower goes first
+		# MultiNodeManager sets it to the node's depth in the hierarchy, so the main node is served first
+		self._priority = 0
+
+		# Shared with the node's threads (including branch threads), see usageledger.RunBudget
+		self._budget = None
 
 		# This will label messages in thread.df_messages in node_run_id column
 		# run_id labels messages per ThreadManager.run_thread()
 		# node_run_id labels messages per self.input_prompt()
 		self._node_run_counter = 0 
 
-		prompt_start = 'Ignore this sentence, this is only to begin the thread.'
-		self.thread = ThreadManager(client=client, prompt=prompt_start)
+	@property
+	def priority(self) -> int:
+		return self._priority
+
+	@priority.setter
+	def priority(self, priority:int):
+
+		self._priority = priority
+
+		if self.thread is not None:
+			self.thread.priority = priority
+
+	@property
+	def budget(self) -> RunBudget:
+		return self._budget
+
+	@budget.setter
+	def budget(self, budget:RunBudget):
+
+		self._budget = budget
+
+		if self.thread is not None:
+			self.thread.budget = budget
+
+	@property
+	def df_runs(self) -> pd.DataFrame:
+
+		# Runs of every agent of the node, the runs on branch threads are merged into self.thread
+		return self.thread.df_runs
+
+	def get_usage(self, by:list=['agent']) -> pd.DataFrame:
+		return self.thread.get_usage(by=by)
+
+	def _link_agents(self):
 
 		# Link main agent to thread
 		self.agent_thread_manager.link(thread=self.thread, agent=self.main_agent)
@@ -81,9 +146,6 @@ class SystemNode:
 		for sub_agent in self.sub_agents:
 
 			self.agent_thread_manager.link(thread=self.thread, agent=sub_agent)
-		
-	def delete_thread(self):
-		self.thread.delete_thread()
 
 	def _check_for_instruction(self, message:str, keyword:str) -> bool:
 
@@ -94,32 +156,87 @@ class SystemNode:
 		
 	def _get_latest_message_from_agents(self, main_agent:bool=True) -> pd.DataFrame:
 
-		# Get the last location (index) of each assistant_id
-		df_max_loc = self.thread.df_messages.groupby('assistant_id').agg({'_msg_loc': 'max'}).reset_index()
-
-		# Inner join with df_messages to get the latest message
-		df_last_messages = pd.merge(df_max_loc, self.thread.df_messages[['assistant_id', '_msg_loc', 'message_text']], how='inner', on=['assistant_id', '_msg_loc'])
+		# Get the latest message of each assistant_id, the thread keeps an index of them
+		dic_last_messages = self.thread.get_latest_messages()
 
 		# If main_agent is False, means we want to exclude the main agent's last messages.
 		if not main_agent:
 
 			# Filter out main_agent
-			df_last_messages = df_last_messages.loc[df_last_messages['assistant_id']!=self.main_agent.assistant_id,:]
+			dic_last_messages.pop(self.main_agent.assistant_id, None)
+
+		df_last_messages = pd.DataFrame(list(dic_last_messages.values()), columns=['assistant_id', '_msg_loc', 'message_text'])
 
 		return df_last_messages
 	
 	# We may not need this
 	def _get_latest_node_run_message_from_agents(self) -> pd.DataFrame:
 
-		# Get the last location (index) of each assistant_id
-		df_max_loc = self.thread.df_messages.groupby('assistant_id').agg({'node_run_id': 'max'}).reset_index()
+		# Get the latest message of each assistant_id in its latest node_run_id
+		dic_last_messages = self.thread.get_latest_node_run_messages()
 
-		# Inner join with df_messages to get the latest message
-		df_last_messages = pd.merge(df_max_loc, self.thread.df_messages[['assistant_id', 'node_run_id', 'message_text']], how='inner', on=['assistant_id', 'node_run_id'])
+		df_last_messages = pd.DataFrame(list(dic_last_messages.values()), columns=['assistant_id', 'node_run_id', 'message_text'])
 
 		return df_last_messages
 		
-	def _give_instruction_to_sub_agents(self) -> dict:
+	def _split_sub_agents_messages(self, message_output:dict, keyword:str) -> dict:
+
+		message_to_concatenate = message_output.copy()
+
+		# Filter out message by main agent
+		message_to_concatenate.pop(self.main_agent)
+
+		#
+		sub_agents_with_instructions = [key for key, value in message_to_concatenate.items() if keyword in value.lower()]
+
+		# Create a new dictionary with only the specified keys
+		message_output_instructions = {agent: message_to_concatenate[agent] for agent in sub_agents_with_instructions if agent in message_to_concatenate}
+
+		# Delete the sub agents that have instructions from message_to_concatenate
+		for agent in sub_agents_with_instructions:
+			message_to_concatenate.pop(agent, None)
+
+		# So essentially there will be 2 separate message_output dictionaries
+		# 1 will not have instructions, meaning they're legitimate outputs from the sub agents
+		# Which can be returned to the main agent
+		# The other are messages from the sub agents which have instructions
+		# which should be forwarded to appropriate child nodes
+		dic_output = {
+			'message_no_instructions': message_to_concatenate,
+			'message_with_instructions': message_output_instructions
+		}
+
+		return dic_output
+
+	def _get_report_prompt(self, sub_agents:list=None) -> str:
+
+		df_last_messages = self._get_latest_message_from_agents(main_agent=False)
+
+		# If sub_agents is provided, filter only for sub_agents specified
+		if sub_agents:
+
+			list_assistant_id = [agent.assistant_id for agent in sub_agents]
+
+			df_last_messages = df_last_messages.loc[df_last_messages['assistant_id'].isin(list_assistant_id),:]
+
+		return '\n'.join(df_last_messages['message_text'])
+
+	def _end_node_run(self, message_output:dict):
+
+		print('Input prompt: done')
+
+		# each time input_prompt() is called, increase _node_run_counter by 1 permanently
+		self._node_run_counter += 1
+
+		self.last_run_messages = message_output # TODO: naming inconsistency
+
+	# The node runs are written once as steps (see steprunner.py), the subclasses only do the steps in _do_step().
+	# A step is (kind, target, kwargs):
+	# ('call', method, kwargs): method(**kwargs), awaited by AsyncSystemNode (i.e. thread.run_thread)
+	# ('parallel', list of steps, {}): runs the steps at the same time, at most max_concurrency at once,
+	# and gives back their results in the same order (the error instead of the result if one failed)
+
+	def _give_instruction_to_sub_agents_steps(self):
 
 		# This is under the assumption that all sub agents will receive the same instruction from the main agent
 
@@ -127,112 +244,148 @@ class SystemNode:
 
 		prompt = self.thread.last_message
 
+		if self.parallel_sub_agents and len(self.sub_agents) > 1:
+			return (yield from self._give_instruction_to_sub_agents_parallel_steps(prompt=prompt))
+
 		# Loop through list of sub agents
 		for agent in self.sub_agents:
 			
 
 			print(f'Giving instructions to {agent.assistant_name}')
 			
-			self.thread.run_thread(
-				assistant=agent,
-				prompt=prompt,
-				node_run_id=self._node_run_counter,
-				attachments=agent.files
-			)
+			yield ('call', self.thread.run_thread, {
+				'assistant': agent,
+				'prompt': prompt,
+				'node_run_id': self._node_run_counter,
+				'attachments': agent.files
+			})
 
 			message_output[agent] = self.thread.last_message
 		
 		print('Giving instructions to sub agents done')
 
 		return message_output
-	
-	def input_prompt(self, prompt:str) -> dict:
+
+	def _run_sub_agent_on_branch_steps(self, agent, prompt:str):
+
+		# The branch thread starts with the main agent's instruction as its first message
+		branch_thread = yield ('call', self._new_thread, {'prompt': prompt, 'attachments': agent.files})
+		branch_thread.budget = self.budget
+
+		self.agent_thread_manager.link(thread=branch_thread, agent=agent)
+
+		try:
+			yield ('call', branch_thread.run_thread, {
+				'assistant': agent,
+				'node_run_id': self._node_run_counter
+			})
+		except Exception:
+			yield from self._delete_branch_thread_steps(agent=agent, branch_thread=branch_thread)
+			raise
+
+		return branch_thread
+
+	def _delete_branch_thread_steps(self, agent, branch_thread):
+
+		self.agent_thread_manager.unlink(thread=branch_thread, agent=agent)
+		yield ('call', branch_thread.clear_and_delete, {})
+
+	def _give_instruction_to_sub_agents_parallel_steps(self, prompt:str):
 
 		"""
-		The format of the output, message_output is
-		{
-			agent: "last_message",
-			agent: "last_message",
-			agent: "last_message"
-		}
+		Same as _give_instruction_to_sub_agents_steps(), but every sub agent runs at the same time on its own branch thread.
+		The outputs are merged into self.thread in the order of self.sub_agents, then the branch threads are deleted.
 		"""
 
 		message_output = {}
 
-		print(f'Input prompt: running thread with main agent: {self.main_agent.assistant_name}')
+		print(f'Giving instructions to {len(self.sub_agents)} sub agents in parallel')
 
-		self.thread.run_thread(
-			assistant=self.main_agent,
-			prompt=prompt,
-			node_run_id=self._node_run_counter,
-			attachments=self.main_agent.files
-		)
+		# Every sub agent is waited for, so that no branch thread is left behind if one of them fails
+		results = yield ('parallel', [self._run_sub_agent_on_branch_steps(agent=agent, prompt=prompt) for agent in self.sub_agents], {})
 
-		message_output[self.main_agent] = self.thread.last_message
+		dic_branch_threads = {agent: result for agent, result in zip(self.sub_agents, results) if not isinstance(result, BaseException)}
+		errors = [result for result in results if isinstance(result, BaseException)]
 
-		print(f'Input prompt: running thread done')
-		print('Input prompt: checking for instructions')
+		if errors:
+			for agent, result in zip(self.sub_agents, results):
+				if isinstance(result, BaseException):
+					print(f'{agent.assistant_name} failed on its branch thread: {result}')
 
-		if self._check_for_instruction(message=self.thread.last_message, keyword='Start work:'):
-			
-			print('Input prompt: instructions found, giving instruction to sub agents')
-			
-			# Give instructions to sub agents
-			# Returns their output from the instructions given
-			message_output_sub_agents = self._give_instruction_to_sub_agents()
+			for agent, branch_thread in dic_branch_threads.items():
+				yield from self._delete_branch_thread_steps(agent=agent, branch_thread=branch_thread)
 
-			# Combine message_output and message_output_sub_agents
-			# message_output now has outputs from all agents which were given a prompt
-			message_output.update(message_output_sub_agents)
-		
-		else:
-			print('Input prompt: no instructions found')
+			raise errors[0]
 
-		print('Input prompt: done')
+		for agent in self.sub_agents:
 
-		# each time input_prompt() is called, increase _node_run_counter by 1 permanently
-		self._node_run_counter += 1
+			branch_thread = dic_branch_threads[agent]
 
-		self.last_run_messages = message_output # TODO: naming inconsistency
+			self.thread.merge_messages(thread=branch_thread, node_run_id=self._node_run_counter)
+
+			message_output[agent] = branch_thread.last_message
+
+			yield from self._delete_branch_thread_steps(agent=agent, branch_thread=branch_thread)
+
+		print('Giving instructions to sub agents done')
 
 		return message_output
-	
-	def _split_sub_agents_messages(self, message_output:dict, keyword:str) -> dict:
 
-		message_to_concatenate = message_output.copy()
+	def _input_prompt_steps(self, prompt:str):
 
-		# Filter out message by main agent
-		message_to_concatenate.pop(self.main_agent)
+		"""
+		The format of the output, message_output is
+		{
+			agent: "last_message",
+			agent: "last_message",
+			agent: "last_message"
+		}
+		"""
 
-		#
-		sub_agents_with_instructions = [key for key, value in message_to_concatenate.items() if keyword in value.lower()]
+		message_output = {}
 
-		# Create a new dictionary with only the specified keys
-		message_output_instructions = {agent: message_to_concatenate[agent] for agent in sub_agents_with_instructions if agent in message_to_concatenate}
+		with span('node_run', node=self.name, node_run_id=self._node_run_counter):
 
-		# Delete the sub agents that have instructions from message_to_concatenate
-		for agent in sub_agents_with_instructions:
-			message_to_concatenate.pop(agent, None)
+			print(f'Input prompt: running thread with main agent: {self.main_agent.assistant_name}')
 
-		# So essentially there will be 2 separate message_output dictionaries
-		# 1 will not have instructions, meaning they're legitimate outputs from the sub agents
-		# Which can be returned to the main agent
-		# The other are messages from the sub agents which have instructions
-		# which should be forwarded to appropriate child nodes
-		dic_output = {
-			'message_no_instructions': message_to_concatenate,
-			'message_with_instructions': message_output_instructions
-		}
+			yield ('call', self.thread.run_thread, {
+				'assistant': self.main_agent,
+				'prompt': prompt,
+				'node_run_id': self._node_run_counter,
+				'attachments': self.main_agent.files
+			})
 
-		return dic_output
+			message_output[self.main_agent] = self.thread.last_message
 
-	def run_node(self, prompt:str) -> dict:
+			print('Input prompt: running thread done')
+			print('Input prompt: checking for instructions')
+
+			if self._check_for_instruction(message=self.thread.last_message, keyword='Start work:'):
+			
+				print('Input prompt: instructions found, giving instruction to sub agents')
+			
+				# Give instructions to sub agents
+				# Returns their output from the instructions given
+				message_output_sub_agents = yield from self._give_instruction_to_sub_agents_steps()
+
+				# Combine message_output and message_output_sub_agents
+				# message_output now has outputs from all agents which were given a prompt
+				message_output.update(message_output_sub_agents)
+		
+			else:
+				print('Input prompt: no instructions found')
+
+			self._end_node_run(message_output=message_output)
+
+		return message_output
+
+	def _run_node_steps(self, prompt:str):
 
 		# Input prompt to main agent
 		# Then check for instructions, if instructions exists, forward it to sub agents
 		# Get message outputs from the run
 		# note that agents who don't get input won't be part of the message_output
-		message_output = self.input_prompt(prompt=prompt)
+		message_output = yield from self._input_prompt_steps(prompt=prompt)
 
 		# Get messages for instructions and for feedback (to main agent)
 		dic_sub_agent_split_messages = self._split_sub_agents_messages(
@@ -241,10 +394,10 @@ class SystemNode:
 			)
 		
 		return dic_sub_agent_split_messages
-	
+
 	# Doing this with **kwargs, but not sure if that's the best way to do it
 	# sub_agents:list=None
-	def _report_to_main_agent(self, sub_agents:list=None, node_run_id:int=None) -> str:
+	def _report_to_main_agent_steps(self, sub_agents:list=None, node_run_id:int=None):
 
 		"""
 		Note that this should be run when all sub agents have their final output,
@@ -257,24 +410,88 @@ class SystemNode:
 		agent_financial_analyst = True
 		"""
 
-		df_last_messages = self._get_latest_message_from_agents(main_agent=False)
+		with span('node_report', node=self.name):
 
-		# If sub_agents is provided, filter only for sub_agents specified
-		if sub_agents:
+			messages_to_report = self._get_report_prompt(sub_agents=sub_agents)
 
-			list_assistant_id = [agent.assistant_id for agent in sub_agents]
+			message_from_main_agent = yield ('call', self.thread.run_thread, {
+				'assistant': self.main_agent,
+				'prompt': messages_to_report,
+				'node_run_id': node_run_id
+			})
 
-			df_last_messages.loc[df_last_messages['assistant_id'].isin(list_assistant_id),:]
+		return message_from_main_agent
+
+class SystemNode(_BaseSystemNode):
 
-		messages_to_report = '\n'.join(df_last_messages['message_text'])
+	def __init__(
+			self, 
+			client:OpenAI, 
+			name:str, 
+			main_agent:AgentHandler, 
+			sub_agents:list[AgentHandler],
+			agent_thread_manager:AgentThreadManager,
+			parallel_sub_agents:bool=False,
+			max_concurrency:int=4
+			):
 
-		message_from_main_agent = self.thread.run_thread(
-			assistant=self.main_agent,
-			prompt=messages_to_report,
-			node_run_id=node_run_id
+		super().__init__(
+			client=client,
+			name=name,
+			main_agent=main_agent,
+			sub_agents=sub_agents,
+			agent_thread_manager=agent_thread_manager,
+			parallel_sub_agents=parallel_sub_agents,
+			max_concurrency=max_concurrency
 		)
 
-		return message_from_main_agent
+		self.thread = ThreadManager(client=client, prompt=self._prompt_start, priority=self.priority)
+
+		self._link_agents()
+		
+	def delete_thread(self):
+		self.thread.delete_thread()
+
+	def _new_thread(self, prompt:str, attachments:list) -> ThreadManager:
+		return ThreadManager(client=self._client, prompt=prompt, attachments=attachments, priority=self.priority)
+
+	def _run_parallel(self, list_steps:list) -> list:
+
+		results = []
+
+		with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(list_steps))) as executor:
+
+			# propagate() so the agent turns on the branch threads are part of this node run's trace
+			futures = [executor.submit(propagate(run_steps), steps, self._do_step) for steps in list_steps]
+
+			for future in futures:
+				try:
+					results.append(future.result())
+				except Exception as e:
+					results.append(e)
+
+		return results
+
+	def _do_step(self, step:tuple):
+
+		kind, target, kwargs = step
+
+		if kind == 'call':
+			return target(**kwargs)
+
+		elif kind == 'parallel':
+			return self._run_parallel(list_steps=target)
+
+		raise ValueError(f'Unknown step: {kind}')
+
+	def input_prompt(self, prompt:str) -> dict:
+		return run_steps(self._input_prompt_steps(prompt=prompt), self._do_step)
+	
+	def run_node(self, prompt:str) -> dict:
+		return run_steps(self._run_node_steps(prompt=prompt), self._do_step)
+	
+	def _report_to_main_agent(self, sub_agents:list=None, node_run_id:int=None) -> str:
+		return run_steps(self._report_to_main_agent_steps(sub_agents=sub_agents, node_run_id=node_run_id), self._do_step)
 	
 	def clear_and_delete(self):
 
@@ -282,6 +499,86 @@ class SystemNode:
 
 		del self
 
+class AsyncSystemNode(_BaseSystemNode):
+
+	"""
+	Same as SystemNode, but on the AsyncOpenAI client, so that many nodes can run from one event loop.
+	With parallel_sub_agents, the branch threads run as tasks on the event loop instead of worker threads.
+	__init__ can't await, so create it with:
+	node = await AsyncSystemNode.create(client=get_async_client(), name=name, main_agent=main_agent, ...)
+	"""
+
+	@classmethod
+	async def create(
+			cls,
+			client:AsyncOpenAI, 
+			name:str, 
+			main_agent:AsyncAgentHandler, 
+			sub_agents:list[AsyncAgentHandler],
+			agent_thread_manager:AgentThreadManager,
+			parallel_sub_agents:bool=False,
+			max_concurrency:int=4
+			) -> 'AsyncSystemNode':
+
+		self = cls(
+			client=client,
+			name=name,
+			main_agent=main_agent,
+			sub_agents=sub_agents,
+			agent_thread_manager=agent_thread_manager,
+			parallel_sub_agents=parallel_sub_agents,
+			max_concurrency=max_concurrency
+		)
+
+		self.thread = await AsyncThreadManager.create(client=client, prompt=self._prompt_start, priority=self.priority)
+
+		self._link_agents()
+
+		return self
+
+	async def delete_thread(self):
+		await self.thread.delete_thread()
+
+	async def _new_thread(self, prompt:str, attachments:list) -> AsyncThreadManager:
+		return await AsyncThreadManager.create(client=self._client, prompt=prompt, attachments=attachments, priority=self.priority)
+
+	async def _run_parallel(self, list_steps:list) -> list:
+
+		# The branch threads run as tasks on the event loop instead of worker threads
+		semaphore = asyncio.Semaphore(self.max_concurrency)
+
+		async def run(steps):
+			async with semaphore:
+				return await arun_steps(steps, self._do_step)
+
+		return await asyncio.gather(*[run(steps) for steps in list_steps], return_exceptions=True)
+
+	async def _do_step(self, step:tuple):
+
+		# See SystemNode._do_step()
+		kind, target, kwargs = step
+
+		if kind == 'call':
+			return await target(**kwargs)
+
+		elif kind == 'parallel':
+			return await self._run_parallel(list_steps=target)
+
+		raise ValueError(f'Unknown step: {kind}')
+
+	async def input_prompt(self, prompt:str) -> dict:
+		return await arun_steps(self._input_prompt_steps(prompt=prompt), self._do_step)
+
+	async def run_node(self, prompt:str) -> dict:
+		return await arun_steps(self._run_node_steps(prompt=prompt), self._do_step)
+
+	async def _report_to_main_agent(self, sub_agents:list=None, node_run_id:int=None) -> str:
+		return await arun_steps(self._report_to_main_agent_steps(sub_agents=sub_agents, node_run_id=node_run_id), self._do_step)
+
+	async def clear_and_delete(self):
+
+		await self.thread.clear_and_delete()
+
 class MultiNodeManager():
 
 	# TODO: We likely need a separate class or a way to keep track of messages to transfer between nodes
@@ -290,9 +587,18 @@ class MultiNodeManager():
 
 	# Exclude self._nodes_unique for now, don't think we need it since we have self._check_hierarchy()
 
-	def __init__(self, schema:dict={}, schema_depth:int=20):
+	def __init__(self, schema:dict={}, schema_depth:int=20, max_concurrency:int=4, budget:RunBudget=None):
 
 		"""
+		max_concurrency is the maximum number of sibling nodes (nodes in the same hierarchy)
+		that are run at the same time. Set it to 1 to run the nodes one after another.
+
+		budget (usageledger.RunBudget) is the token/time ceiling of each run(),
+		it stops or downgrades the agent runs once it's used up.
+
+		The nodes have to be SystemNode objects, nodes are run in worker threads.
+		AsyncSystemNode objects are run on an event loop instead (i.e. with asyncio.gather()).
+
 		The schema has to be in this format:
 		schema = {
 			node1: set([node2, node3]),
@@ -311,11 +617,24 @@ class MultiNodeManager():
 		}
 		"""
 
+		if max_concurrency < 1:
+			raise ValueError('max_concurrency has to be at least 1')
+
+		self.max_concurrency = max_concurrency
+		self.budget = budget
+
+		# Usage of every agent run of every run(), see df_runs
+		self._run_records = []
+		self._run_counter = 0
+
 		if schema != {}:
+
+			self._check_sync_nodes(nodes=list(schema) + [node for child_nodes in schema.values() for node in child_nodes])
 			
 			self.hierarchy = self._check_hierarchy(schema=schema, depth=schema_depth)
 			self.schema = schema.copy()
 			self._main_node = self._find_main_node(schema=self.schema)
+			self._set_node_priorities()
 
 			# need to add self._nodes_unique here
 			# 		
@@ -371,6 +690,14 @@ class MultiNodeManager():
 		self.hierarchy = self._check_hierarchy(schema=schema, depth=schema_depth)
 		self.schema = schema.copy()
 		self._main_node = self._find_main_node(schema=self.schema)
+		self._set_node_priorities()
+
+	def _set_node_priorities(self):
+
+		# The node's depth is its priority in the rate limiter, so the main node's calls go ahead of the leaf nodes'
+		for depth, nodes in self.hierarchy.items():
+			for node in nodes:
+				node.priority = depth
 
 	# Not sure if this is necessary since there's already validation in add_node()
 	def _check_hierarchy(self, schema:dict, depth:int=20):
@@ -424,8 +751,20 @@ class MultiNodeManager():
 		else:
 			return hierarchy
 
+	def _check_sync_nodes(self, nodes:list):
+
+		# The nodes are run with plain calls in worker threads (see _run_nodes_concurrently()),
+		# an AsyncSystemNode has to be awaited on an event loop, so it can't be run by this class
+		for node in nodes:
+			if isinstance(node, AsyncSystemNode):
+				raise TypeError(f"{node.name} is an AsyncSystemNode, MultiNodeManager only runs SystemNode objects. Await run_node() of async nodes instead.")
+
 	def add_node(self, node:SystemNode, depth:int=20, **kwargs):
 
+		# Only SystemNode objects, see _check_sync_nodes()
+		child_nodes = kwargs.get('child_node', [])
+		self._check_sync_nodes(nodes=[node, kwargs.get('parent_node')] + (child_nodes if isinstance(child_nodes, list) else [child_nodes]))
+
 		# Use a copy of schema as a staging
 		# So that if there's an error it will not update the schema attribute
 		schema_stg = self.schema.copy()
@@ -465,6 +804,7 @@ class MultiNodeManager():
 
 		# Set the main node
 		self._main_node = self._find_main_node(schema=self.schema)
+		self._set_node_priorities()
 	
 	def _check_for_instruction(self, message:str, keyword:str):
 
@@ -473,6 +813,31 @@ class MultiNodeManager():
 		else:
 			return False
 	
+	def _run_nodes_concurrently(self, dic_node_prompts:dict) -> dict:
+
+		"""
+		Runs run_node() on every node in dic_node_prompts, at most self.max_concurrency at a time.
+
+		dic_node_prompts has the following format:
+		{node: prompt, node: prompt}
+
+		Returns the outputs in the same order as dic_node_prompts:
+		{node: dic_sub_agent_split_messages, node: dic_sub_agent_split_messages}
+		"""
+
+		# Nothing to gain from a worker pool
+		if len(dic_node_prompts) <= 1 or self.max_concurrency == 1:
+			return {node: node.run_node(prompt=prompt) for node, prompt in dic_node_prompts.items()}
+
+		print(f'Running {len(dic_node_prompts)} nodes concurrently')
+
+		with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(dic_node_prompts))) as executor:
+			
+			dic_futures = {node: executor.submit(propagate(node.run_node), prompt=prompt) for node, prompt in dic_node_prompts.items()}
+
+			# result() re-raises any exception raised inside the node run
+			return {node: future.result() for node, future in dic_futures.items()}
+
 	# run downward as in we give an input from the top (main node)
 	# and then it gives instructions downstream (downward)
 	def _run_nodes_downward(self, prompt:str):
@@ -515,6 +880,10 @@ class MultiNodeManager():
 				# Get the list of nodes in the previous hierarchy
 				list_last_nodes = self.hierarchy[depth-1]
 
+				# Child nodes that are ready to run in this hierarchy and the prompt they will receive
+				# {child_node: prompt, child_node: prompt}
+				dic_ready_nodes = {}
+
 				# Loop through each last node
 				for last_node in list_last_nodes:
 
@@ -546,10 +915,10 @@ class MultiNodeManager():
 								# Check if the sub agent from the last node is a main agent in one of the child nodes
 								if agent == child_node.main_agent:
 									
-									prompt = last_node.last_run_messages[last_node.main_agent]
-									dic_sub_agent_split_messages = child_node.run_node(prompt=prompt)
+									dic_ready_nodes[child_node] = last_node.last_run_messages[last_node.main_agent]
 
-									dic_nodes_message_outputs[child_node] = dic_sub_agent_split_messages
+				# Sibling nodes each have their own thread, so all ready nodes in this hierarchy can run at the same time
+				dic_nodes_message_outputs.update(self._run_nodes_concurrently(dic_node_prompts=dic_ready_nodes))
 		
 		# Structure of dic_nodes_message_outputs
 		# {
@@ -605,10 +974,65 @@ class MultiNodeManager():
 		# i.e. the main node
 		return node_message_output
 	
+	@property
+	def df_runs(self) -> pd.DataFrame:
+
+		# One row per agent run, labelled with the run() it was part of (run) and its node
+		return to_runs_dataframe(records=self._run_records, extra_columns={'run': 'int', 'node': 'str'})
+
+	def get_usage(self, run:int=None, by:list=['node', 'agent']) -> pd.DataFrame:
+
+		"""
+		Tokens, latency, tool calls and models per node and agent of a run() (default: the last one).
+		"""
+
+		if run is None:
+			run = self._run_counter - 1
+
+		df_runs = self.df_runs
+
+		return summarize_runs(df_runs=df_runs[df_runs['run'] == run], by=by)
+
+	def _record_runs(self, dic_runs_start:dict):
+
+		# The node's thread has the runs of the node's agents, including the ones on branch threads
+		for node, runs_start in dic_runs_start.items():
+			self._run_records.extend(
+				{'run': self._run_counter, 'node': node.name, **record} for record in node.thread._run_records[runs_start:]
+			)
+
+		self._run_counter += 1
+
 	def run(self, prompt:str):
 
-		dic_nodes_messages_output = self._run_nodes_downward(prompt=prompt)
+		# The budget is shared by every node's threads and counts from the start of the run
+		if self.budget is not None:
+			self.budget.start()
+
+		for node in self.schema:
+			node.budget = self.budget
+
+		dic_runs_start = {node: len(node.thread._run_records) for node in self.schema}
+
+		try:
+			# Root span of the run, every span below is part of its trace (see tracing.py)
+			with span('multi_node_run', nodes=len(self.schema)):
+
+				# Push the config of every agent that changed in one go (usually none), instead of one at a time on their first run
+				sync_all(agents=[agent for node in self.schema for agent in [node.main_agent, *node.sub_agents]])
+
+				with span('run_downward'):
+					dic_nodes_messages_output = self._run_nodes_downward(prompt=prompt)
+
+				with span('run_upward'):
+					node_message_output = self._run_nodes_upward(nodes_messages=dic_nodes_messages_output)
+
+		# The usage is recorded even if the budget stopped the run
+		finally:
+			self._record_runs(dic_runs_start=dic_runs_start)
 
-		node_message_output = self._run_nodes_upward(nodes_messages=dic_nodes_messages_output)
+			# The node threads stay, but the files attached during the run don't have to (see fileregistry.py)
+			for node in self.schema:
+				node.thread.release_attachments()
 
 		return node_message_output
\ No newline at end of file
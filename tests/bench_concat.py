@@ -0,0 +1,111 @@
+"""
+Time and peak memory of putting the price history of many tickers (default 500 tickers x 10y of daily bars) into one frame:
+pd.concat onto the schema frame for every ticker (how import_stocks used to do it) and YFHandler.normalize.
+yfinance isn't called, every ticker gets the same synthetic history.
+python tests/bench_concat.py [tickers]
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yfinancehandler import YFHandler
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# About 10 years of trading days
+N_DAYS = 2520
+
+def new_history(n_days:int=N_DAYS) -> pd.DataFrame:
+
+	# The columns of Ticker.history()
+	rng = np.random.default_rng(0)
+	close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n_days)))
+
+	return pd.DataFrame(
+		{
+			'Open': close * 0.99,
+			'High': close * 1.01,
+			'Low': close * 0.98,
+			'Close': close,
+			'Volume': rng.integers(1e5, 1e7, n_days),
+			'Dividends': 0.0,
+			'Stock Splits': 0.0
+		},
+		index=pd.DatetimeIndex(pd.bdate_range('2015-01-01', periods=n_days, tz='America/New_York'), name='Date')
+	)
+
+def new_handler(stock_list:list, schemas:dict, float_dtype:str='float64') -> YFHandler:
+
+	yf_handler = YFHandler(stock_list=stock_list, schemas=schemas, float_dtype=float_dtype, use_cache=False)
+
+	df_history = new_history()
+	yf_handler._fetch_ticker_with_retry = lambda stock, attribute, **kwargs: df_history.copy()
+
+	return yf_handler
+
+def concat_per_ticker(yf_handler:YFHandler) -> pd.DataFrame:
+
+	df = pd.DataFrame(columns=dict(yf_handler.schemas['stocks']))
+
+	for stock, data in yf_handler._fetch_all('history', period='10y').items():
+
+		df_plc = data.reset_index()
+		df_plc['Ticker'] = stock
+
+		df = pd.concat([df, df_plc], ignore_index=True)
+
+	return df
+
+def normalize_once(yf_handler:YFHandler) -> pd.DataFrame:
+	return yf_handler.normalize(frames=yf_handler.fetch_stocks(period='10y'), schema_name='stocks')
+
+def measure(func, yf_handler:YFHandler) -> dict:
+
+	tracemalloc.start()
+	start = time.perf_counter()
+
+	df = func(yf_handler)
+
+	elapsed = time.perf_counter() - start
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	return {'seconds': elapsed, 'peak_mb': peak / 1e6, 'frame_mb': df.memory_usage(deep=True).sum() / 1e6, 'rows': len(df)}
+
+def main(n_tickers:int=500):
+
+	with open(os.path.join(REPO_DIR, 'config', 'dataframe_schemas.json'), 'r') as f:
+		schemas = json.load(f)
+
+	stock_list = [f'T{i:03d}' for i in range(n_tickers)]
+
+	cwd = os.getcwd()
+
+	# The handler's cache files go in a temporary directory
+	with tempfile.TemporaryDirectory() as temp_dir:
+
+		os.chdir(temp_dir)
+
+		dic_results = {
+			'pd.concat per ticker (before)': measure(concat_per_ticker, new_handler(stock_list=stock_list, schemas=schemas)),
+			'normalize, float64 (after)': measure(normalize_once, new_handler(stock_list=stock_list, schemas=schemas)),
+			'normalize, float32 (after)': measure(normalize_once, new_handler(stock_list=stock_list, schemas=schemas, float_dtype='float32'))
+		}
+
+		os.chdir(cwd)
+
+	for label, result in dic_results.items():
+		print(f"{label}: {result['seconds']:.2f}s, {result['peak_mb']:.0f} MB peak, {result['frame_mb']:.0f} MB frame ({result['rows']} rows)")
+
+	return dic_results
+
+if __name__ == '__main__':
+	main(n_tickers=int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,102 @@
+"""
+Time and memory of recording the messages of a long thread (default 10k messages), one message at a time:
+a DataFrame grown with pd.concat plus a list copy (how df_messages used to be kept) and the MessageStore.
+python tests/bench_messagestore.py [messages]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from messagestore import MessageStore
+
+SCHEMA = {
+	'message_id': 'str',
+	'assistant_id': 'str',
+	'created_at': 'int',
+	'file_ids': 'str',
+	'role': 'str',
+	'run_id': 'str',
+	'message_text': 'str',
+	'_msg_loc': 'int',
+	'node_run_id': 'int'
+}
+
+def new_records(n_messages:int) -> list[dict]:
+
+	# A user prompt and an answer of one of 4 agents, with a few hundred characters of text each
+	return [
+		{
+			'message_id': f'msg_{i}',
+			'assistant_id': None if i % 2 == 0 else f'asst_{i % 8 // 2}',
+			'created_at': 1700000000 + i,
+			'file_ids': [],
+			'role': 'user' if i % 2 == 0 else 'assistant',
+			'run_id': None if i % 2 == 0 else f'run_{i}',
+			'message_text': f'message {i} ' + 'revenue grew in the last quarter ' * 12,
+			'_msg_loc': i,
+			'node_run_id': i // 20
+		} for i in range(n_messages)
+	]
+
+def record_concat(records:list[dict]) -> tuple:
+
+	df_messages = pd.DataFrame({col: pd.Series(dtype=dt) for col, dt in SCHEMA.items()})
+	messages = []
+
+	for record in records:
+		messages.append(record)
+		df_messages = pd.concat([df_messages, pd.DataFrame([record])], ignore_index=True)
+
+	return df_messages, messages
+
+def record_store(records:list[dict], to_dataframe:bool=True) -> MessageStore:
+
+	message_store = MessageStore(schema=SCHEMA)
+
+	for record in records:
+		message_store.append(record)
+
+	# The DataFrame is only built when it's asked for, i.e. once by a SystemNode helper
+	if to_dataframe:
+		message_store.to_dataframe()
+
+	return message_store
+
+def measure(func, records:list[dict]) -> dict:
+
+	tracemalloc.start()
+	start = time.perf_counter()
+
+	result = func(records)
+
+	elapsed = time.perf_counter() - start
+	current, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	del result
+
+	return {'seconds': elapsed, 'retained_mb': current / 1e6, 'peak_mb': peak / 1e6}
+
+def main(n_messages:int=10000):
+
+	# The records exist before either approach runs, so only the memory of keeping them is counted
+	records = new_records(n_messages=n_messages)
+
+	dic_results = {
+		'pd.concat + list (before)': measure(record_concat, records),
+		'MessageStore + DataFrame asked once (after)': measure(record_store, records),
+		'MessageStore, no DataFrame asked (after)': measure(lambda records: record_store(records, to_dataframe=False), records)
+	}
+
+	for label, result in dic_results.items():
+		print(f"{label}: {result['seconds']:.2f}s, {result['retained_mb']:.1f} MB retained, {result['peak_mb']:.1f} MB peak ({n_messages} messages)")
+
+	return dic_results
+
+if __name__ == '__main__':
+	main(n_messages=int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
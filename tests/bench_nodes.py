@@ -0,0 +1,104 @@
+"""
+Time of a MultiNodeManager run on the fake OpenAI client:
+nodes one after another, sibling nodes concurrently, and sibling nodes plus parallel sub agents.
+python tests/bench_nodes.py [run_delay]
+"""
+
+import io
+import os
+import sys
+import time
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakeopenai import FakeOpenAI
+from agenthandler import AgentHandler
+from ratelimiter import configure_rate_limiter
+from configstore import flush_all
+from systemmanager import SystemNode, MultiNodeManager, AgentThreadManager
+
+# Main agents give instructions to their sub agents, the sub agents answer
+REPLIES = {
+	'asst_ceo': lambda text: 'Start work: analyze MSFT' if 'Client' in text else 'final report',
+	'asst_cfo': lambda text: 'Start work: financials' if text.startswith('Start work') else 'cfo summary',
+	'asst_cto': lambda text: 'Start work: technology' if text.startswith('Start work') else 'cto summary',
+	'asst_coo': lambda text: 'Start work: operations' if text.startswith('Start work') else 'coo summary'
+}
+
+def new_agent(client, dic_agents:dict, name:str) -> AgentHandler:
+
+	dic_agents[name] = {'id': f'asst_{name}', 'instructions': name, 'model': 'gpt-4o', 'tools': []}
+
+	agent = AgentHandler(client=client, new=False, dic_file=dic_agents, assistant_name=name)
+	agent.sync()
+
+	return agent
+
+def build(client, max_concurrency:int, parallel_sub_agents:bool) -> MultiNodeManager:
+
+	dic_agents = {}
+	agents = {name: new_agent(client=client, dic_agents=dic_agents, name=name) for name in ['ceo', 'cfo', 'cto', 'coo', 'a1', 'a2', 'a3', 'a4', 'a5', 'a6']}
+	agent_thread_manager = AgentThreadManager()
+
+	def node(name:str, main_agent:str, sub_agents:list) -> SystemNode:
+		return SystemNode(
+			client=client,
+			name=name,
+			main_agent=agents[main_agent],
+			sub_agents=[agents[agent] for agent in sub_agents],
+			agent_thread_manager=agent_thread_manager,
+			parallel_sub_agents=parallel_sub_agents
+		)
+
+	main_node = node('main_node', 'ceo', ['cfo', 'cto', 'coo'])
+	cfo_node = node('cfo_node', 'cfo', ['a1', 'a2'])
+	cto_node = node('cto_node', 'cto', ['a3', 'a4'])
+	coo_node = node('coo_node', 'coo', ['a5', 'a6'])
+
+	schema = {main_node: {cfo_node, cto_node, coo_node}, cfo_node: set(), cto_node: set(), coo_node: set()}
+
+	return MultiNodeManager(schema=schema, schema_depth=2, max_concurrency=max_concurrency)
+
+def main(run_delay:float=0.2):
+
+	# Only the fake client's delays should count, not the limiter
+	configure_rate_limiter(requests_per_minute=100000, tokens_per_minute=100000000)
+
+	dic_times = {}
+
+	cwd = os.getcwd()
+
+	# The agents and the file registry write their config files in config/
+	with tempfile.TemporaryDirectory() as temp_dir:
+
+		os.chdir(temp_dir)
+		os.makedirs('config')
+
+		for label, max_concurrency, parallel_sub_agents in [
+			('serial', 1, False),
+			('concurrent nodes', 4, False),
+			('concurrent nodes + parallel sub agents', 4, True)
+		]:
+
+			client = FakeOpenAI(run_delay=run_delay, call_delay=0.01, replies=REPLIES)
+
+			with contextlib.redirect_stdout(io.StringIO()):
+				nodes_manager = build(client=client, max_concurrency=max_concurrency, parallel_sub_agents=parallel_sub_agents)
+
+				start = time.perf_counter()
+				nodes_manager.run(prompt='This is a message from Client: MSFT')
+				dic_times[label] = time.perf_counter() - start
+
+			print(f"{label}: {dic_times[label]:.2f}s ({client.calls['runs.create']} runs)")
+
+		with contextlib.redirect_stdout(io.StringIO()):
+			flush_all()
+
+		os.chdir(cwd)
+
+	return dic_times
+
+if __name__ == '__main__':
+	main(run_delay=float(sys.argv[1]) if len(sys.argv) > 1 else 0.2)
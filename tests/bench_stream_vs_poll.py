@@ -0,0 +1,96 @@
+"""
+Time of one agent turn on the fake OpenAI client:
+the stream followed by the fixed sleeps run_thread used to have (1s after the stream, end_pause after the turn),
+polling the run with check_run_status, and the stream with completion taken from its events (ThreadManager.run_thread).
+python tests/bench_stream_vs_poll.py [turns] [run_delay]
+"""
+
+import io
+import os
+import sys
+import time
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakeopenai import FakeOpenAI
+from agenthandler import AgentHandler
+from ratelimiter import configure_rate_limiter
+from configstore import flush_all
+from eventhandler import ThreadManager, check_run_status
+
+def sleep_turn(client, thread_id:str, assistant_id:str, prompt:str, end_pause:float=5):
+
+	# What run_thread did before: consume the stream, wait, list the messages, wait for the next run
+	client.beta.threads.messages.create(thread_id=thread_id, role='user', content=prompt)
+
+	for event in client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id, stream=True):
+		pass
+
+	time.sleep(1)
+	client.beta.threads.messages.list(thread_id=thread_id, order='desc')
+	time.sleep(end_pause)
+
+def poll_turn(client, thread_id:str, assistant_id:str, prompt:str, wait_time:float=1):
+
+	client.beta.threads.messages.create(thread_id=thread_id, role='user', content=prompt)
+
+	run = client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id)
+	check_run_status(client=client, thread_id=thread_id, run_id=run.id, n_tries=100, wait_time=wait_time)
+
+	client.beta.threads.messages.list(thread_id=thread_id, order='desc')
+
+def time_turns(turn, turns:int) -> float:
+
+	# Average seconds per turn
+	start = time.perf_counter()
+
+	for i in range(turns):
+		turn(i)
+
+	return (time.perf_counter() - start) / turns
+
+def main(turns:int=3, run_delay:float=0.5):
+
+	configure_rate_limiter(requests_per_minute=100000, tokens_per_minute=100000000)
+
+	dic_times = {}
+
+	cwd = os.getcwd()
+
+	with tempfile.TemporaryDirectory() as temp_dir:
+
+		os.chdir(temp_dir)
+		os.makedirs('config')
+
+		client = FakeOpenAI(run_delay=run_delay, call_delay=0.01)
+
+		with contextlib.redirect_stdout(io.StringIO()):
+
+			dic_agents = {'analyst': {'id': 'asst_analyst', 'instructions': 'analyst', 'model': 'gpt-4o', 'tools': []}}
+			agent = AgentHandler(client=client, new=False, dic_file=dic_agents, assistant_name='analyst')
+
+			thread_id = client.beta.threads.create(messages=[{'role': 'user', 'content': 'MSFT'}]).id
+
+			dic_times['stream + fixed sleeps (before)'] = time_turns(lambda i: sleep_turn(client=client, thread_id=thread_id, assistant_id=agent.assistant_id, prompt=f'question {i}'), turns=turns)
+			dic_times['polling every 1s'] = time_turns(lambda i: poll_turn(client=client, thread_id=thread_id, assistant_id=agent.assistant_id, prompt=f'question {i}'), turns=turns)
+
+			thread = ThreadManager(client=client, prompt='MSFT')
+
+			dic_times['stream events (after)'] = time_turns(lambda i: thread.run_thread(assistant=agent, prompt=f'question {i}'), turns=turns)
+
+			flush_all()
+
+		os.chdir(cwd)
+
+	for label, turn_time in dic_times.items():
+		print(f"{label}: {turn_time:.2f}s per turn (run takes {run_delay}s)")
+
+	return dic_times
+
+if __name__ == '__main__':
+	main(
+		turns=int(sys.argv[1]) if len(sys.argv) > 1 else 3,
+		run_delay=float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+	)
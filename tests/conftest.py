@@ -0,0 +1,26 @@
+import os
+import sys
+import pytest
+
+# The modules are at the top of the repo, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import configstore
+import fileregistry
+
+@pytest.fixture
+def tmp_cwd(tmp_path, monkeypatch):
+
+	"""
+	Runs the test in tmp_path (with a config/ directory), the config stores are written there
+	and forgotten before the working directory is changed back.
+	"""
+
+	monkeypatch.chdir(tmp_path)
+	(tmp_path / 'config').mkdir()
+
+	yield tmp_path
+
+	configstore.flush_all()
+	configstore._config_stores.clear()
+	fileregistry._file_registry = None
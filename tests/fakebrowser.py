@@ -0,0 +1,136 @@
+import os
+import re
+import threading
+import urllib.error
+import urllib.request
+from urllib.parse import urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from bs4 import BeautifulSoup
+from selenium.common.exceptions import NoSuchElementException
+from selenium.webdriver.remote.command import Command
+import yfinancehandler
+
+# Serves the pages in tests/fixtures/news on localhost, so the news code is tested over real HTTP without the network.
+# quote/{TICKER}/news.html is the news page of a ticker (an infinite scrolling list of stream items),
+# articles/*.html are articles. {base_url} in a page is replaced by the url of the server.
+# FakeDriver stands in for headless Chrome: it loads the same pages and answers the JavaScript yfinancehandler runs.
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'news')
+
+# Pages put <script type="text/html"> in the document with JavaScript, which FakeDriver does when it loads them
+_RENDERED_SCRIPT = re.compile(r'<script type="text/html">(.*?)</script>', re.S)
+
+class NewsServer():
+
+	def __init__(self):
+
+		# Paths of every request, in the order they came in
+		self.requests = []
+		self._lock = threading.Lock()
+
+		news_server = self
+
+		class Handler(BaseHTTPRequestHandler):
+
+			def do_GET(self):
+
+				path = urlsplit(self.path).path
+
+				with news_server._lock:
+					news_server.requests.append(path)
+
+				file_path = os.path.join(FIXTURE_DIR, path.lstrip('/'))
+
+				if not os.path.isfile(file_path):
+					self.send_error(404)
+					return
+
+				with open(file_path, 'r', encoding='utf-8') as f:
+					body = f.read().replace('{base_url}', news_server.base_url).encode('utf-8')
+
+				self.send_response(200)
+				self.send_header('Content-Type', 'text/html; charset=utf-8')
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, format, *args):
+				pass
+
+		self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+		self.base_url = f'http://127.0.0.1:{self._server.server_port}'
+
+		self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+		self._thread.start()
+
+	def count(self, path:str) -> int:
+		return self.requests.count(path)
+
+	def close(self):
+		self._server.shutdown()
+		self._server.server_close()
+
+class FakeDriver():
+
+	"""
+	Shows page_size stream items of a news page when it's loaded and page_size more on every scroll,
+	until the page has no more items. Articles are rendered (see _RENDERED_SCRIPT).
+	"""
+
+	def __init__(self, page_size:int=3):
+
+		self.page_size = page_size
+		self.urls = []
+		self.scrolls = 0
+		self.closed = False
+
+		self.page_source = ''
+		self._stream_items = []
+		self._n_visible = 0
+
+	def get(self, url:str):
+
+		self.urls.append(url)
+
+		try:
+			with urllib.request.urlopen(url) as response:
+				html = response.read().decode('utf-8')
+		except urllib.error.HTTPError as e:
+			html = e.read().decode('utf-8')
+
+		self.page_source = _RENDERED_SCRIPT.sub(r'\1', html)
+
+		soup = BeautifulSoup(self.page_source, 'html.parser')
+		self._stream_items = [str(item) for item in soup.select(yfinancehandler.STREAM_ITEM_SELECTOR)]
+		self._n_visible = min(self.page_size, len(self._stream_items))
+
+	def execute(self, driver_command:str, params:dict=None):
+
+		# ActionChains.perform() sends the scroll as W3C actions
+		if driver_command == Command.W3C_ACTIONS:
+			self.scrolls += 1
+			self._n_visible = min(self._n_visible + self.page_size, len(self._stream_items))
+
+		return {'value': None}
+
+	def execute_script(self, script:str, *args):
+
+		if script == yfinancehandler._COUNT_STREAM_ITEMS_JS:
+			return self._n_visible
+
+		if script == yfinancehandler._NEW_STREAM_ITEMS_JS:
+			return self._stream_items[args[1]:self._n_visible]
+
+		raise NotImplementedError(script)
+
+	def find_element(self, by:str, value:str):
+
+		element = BeautifulSoup(self.page_source, 'html.parser').select_one(value)
+
+		if element is None:
+			raise NoSuchElementException(f'{value} not found')
+
+		return element
+
+	def quit(self):
+		self.closed = True
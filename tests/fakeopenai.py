@@ -0,0 +1,272 @@
+import os
+import time
+import itertools
+import threading
+from types import SimpleNamespace
+
+# A stand-in for the parts of the OpenAI client this repo uses, for tests and benchmarks.
+# Runs take run_delay seconds, other calls take call_delay seconds.
+# replies is {assistant_id: function(last message text) -> reply text}
+
+_ids = itertools.count()
+
+def _new_id(prefix:str) -> str:
+	return f'{prefix}_{next(_ids)}'
+
+class Page(list):
+
+	def __init__(self, items:list):
+		super().__init__(items)
+		self.data = list(items)
+
+	def auto_paging_iter(self):
+		return iter(self.data)
+
+def new_message(thread_id:str, role:str, text:str, assistant_id:str=None, run_id:str=None, attachments:list=None):
+
+	return SimpleNamespace(
+		id=_new_id('msg'),
+		assistant_id=assistant_id,
+		created_at=int(time.time()),
+		attachments=attachments or [],
+		role=role,
+		run_id=run_id,
+		thread_id=thread_id,
+		content=[SimpleNamespace(type='text', text=SimpleNamespace(value=text))]
+	)
+
+class FakeOpenAI():
+
+	def __init__(self, run_delay:float=0, call_delay:float=0, replies:dict=None, run_steps:int=0):
+
+		self.run_delay = run_delay
+		self.call_delay = call_delay
+		self.replies = replies or {}
+		self.run_steps = run_steps
+
+		self.threads = {}
+		self.files = FakeFiles(client=self)
+		self.calls = {}
+		self._lock = threading.Lock()
+
+		self.beta = SimpleNamespace(
+			threads=SimpleNamespace(
+				create=self._create_thread,
+				delete=self._delete_thread,
+				messages=SimpleNamespace(list=self._list_messages, create=self._create_message),
+				runs=SimpleNamespace(create=self._create_run, retrieve=self._retrieve_run)
+			),
+			assistants=SimpleNamespace(create=self._create_assistant, update=self._update_assistant)
+		)
+
+		# kwargs of every assistants.update call
+		self.assistant_updates = []
+
+	def _call(self, name:str, delay:float=None):
+
+		with self._lock:
+			self.calls[name] = self.calls.get(name, 0) + 1
+
+		time.sleep(self.call_delay if delay is None else delay)
+
+	def _create_assistant(self, name:str, **kwargs):
+
+		self._call('assistants.create')
+
+		return SimpleNamespace(id=_new_id('asst'), name=name, **kwargs)
+
+	def _update_assistant(self, assistant_id:str, **kwargs):
+
+		self._call('assistants.update')
+		self.assistant_updates.append({'assistant_id': assistant_id, **kwargs})
+
+		return SimpleNamespace(id=assistant_id, **kwargs)
+
+	def _create_thread(self, messages:list):
+
+		self._call('threads.create')
+
+		thread_id = _new_id('thread')
+		self.threads[thread_id] = {'messages': [new_message(thread_id, 'user', messages[0]['content'])], 'runs': {}}
+
+		return SimpleNamespace(id=thread_id)
+
+	def _delete_thread(self, thread_id:str):
+
+		self._call('threads.delete')
+		self.threads.pop(thread_id)
+
+	def _list_messages(self, thread_id:str, order:str='desc', after:str=None, limit:int=20, **kwargs):
+
+		self._call('messages.list')
+
+		messages = list(self.threads[thread_id]['messages'])
+
+		if order == 'desc':
+			messages = messages[::-1]
+
+		if after is not None:
+			message_ids = [message.id for message in messages]
+			messages = messages[message_ids.index(after)+1:]
+
+		return Page(messages[:limit])
+
+	def _create_message(self, thread_id:str, role:str, content:str, attachments:list=None):
+
+		self._call('messages.create')
+
+		message = new_message(thread_id, role, content, attachments=attachments)
+		self.threads[thread_id]['messages'].append(message)
+
+		return message
+
+	def _run(self, thread_id:str, assistant_id:str, model:str=None):
+
+		run_id = _new_id('run')
+		last_message = self.threads[thread_id]['messages'][-1].content[0].text.value
+		reply = self.replies.get(assistant_id, lambda text: f'{assistant_id} reply to: {text[:30]}')(last_message)
+
+		message = new_message(thread_id, 'assistant', reply, assistant_id=assistant_id, run_id=run_id)
+
+		run = SimpleNamespace(
+			id=run_id,
+			status='completed',
+			last_error=None,
+			model=model or 'gpt-4o',
+			assistant_id=assistant_id,
+			usage=SimpleNamespace(prompt_tokens=100, completion_tokens=50, total_tokens=150)
+		)
+
+		return run, message
+
+	def _create_run(self, thread_id:str, assistant_id:str, stream:bool=False, model:str=None, **kwargs):
+
+		self._call('runs.create', delay=0)
+
+		run, message = self._run(thread_id=thread_id, assistant_id=assistant_id, model=model)
+
+		if not stream:
+			# Polled runs finish after run_delay, see _retrieve_run()
+			self.threads[thread_id]['runs'][run.id] = (time.monotonic() + self.run_delay, run, message)
+			return SimpleNamespace(id=run.id, status='queued')
+
+		def events():
+
+			yield SimpleNamespace(event='thread.run.created', data=run)
+
+			for _ in range(self.run_steps):
+				yield SimpleNamespace(event='thread.run.step.completed', data=SimpleNamespace(step_details=SimpleNamespace(type='tool_calls', tool_calls=[None])))
+
+			time.sleep(self.run_delay)
+
+			self.threads[thread_id]['messages'].append(message)
+
+			yield SimpleNamespace(event='thread.message.completed', data=message)
+			yield SimpleNamespace(event='thread.run.completed', data=run)
+
+		return events()
+
+	def _retrieve_run(self, thread_id:str, run_id:str):
+
+		self._call('runs.retrieve')
+
+		done_at, run, message = self.threads[thread_id]['runs'][run_id]
+
+		if time.monotonic() < done_at:
+			return SimpleNamespace(id=run_id, status='in_progress')
+
+		if message not in self.threads[thread_id]['messages']:
+			self.threads[thread_id]['messages'].append(message)
+
+		return run
+
+class FakeFiles():
+
+	def __init__(self, client:FakeOpenAI):
+
+		self._client = client
+
+		# {file_id: file}
+		self.files = {}
+		self.deleted = []
+
+	def add(self, created_at:float=None, filename:str='df_stocks.csv') -> str:
+
+		# A file that is already in the account, i.e. uploaded by an earlier process
+		file_id = _new_id('file')
+		self.files[file_id] = SimpleNamespace(id=file_id, created_at=int(created_at or time.time()), bytes=0, filename=filename)
+
+		return file_id
+
+	def create(self, file, purpose:str):
+
+		self._client._call('files.create')
+
+		file_id = _new_id('file')
+		self.files[file_id] = SimpleNamespace(id=file_id, created_at=int(time.time()), bytes=len(file.read()), filename=os.path.basename(file.name))
+
+		return self.files[file_id]
+
+	def delete(self, file_id:str):
+
+		self._client._call('files.delete')
+
+		self.files.pop(file_id)
+		self.deleted.append(file_id)
+
+	def list(self, purpose:str=None):
+
+		self._client._call('files.list')
+
+		return Page(list(self.files.values()))
+
+class AsyncPage(Page):
+
+	# Iterating the page follows the cursor, like the AsyncOpenAI paginator
+	def __aiter__(self):
+		return self._iterate()
+
+	async def _iterate(self):
+		for item in self.data:
+			yield item
+
+def _to_async(func):
+
+	async def call(*args, **kwargs):
+		return func(*args, **kwargs)
+
+	return call
+
+async def _to_async_stream(events):
+	for event in events:
+		yield event
+
+class FakeAsyncOpenAI(FakeOpenAI):
+
+	"""
+	The same fake on the AsyncOpenAI interface: every call is a coroutine, streams and pages are async iterators.
+	The delays still block the event loop, keep them at 0.
+	"""
+
+	def __init__(self, **kwargs):
+
+		super().__init__(**kwargs)
+
+		async def list_messages(**kwargs):
+			return AsyncPage(self._list_messages(**kwargs).data)
+
+		async def create_run(stream:bool=False, **kwargs):
+
+			run = self._create_run(stream=stream, **kwargs)
+
+			return _to_async_stream(run) if stream else run
+
+		self.beta.threads.create = _to_async(self.beta.threads.create)
+		self.beta.threads.delete = _to_async(self.beta.threads.delete)
+		self.beta.threads.messages.list = list_messages
+		self.beta.threads.messages.create = _to_async(self.beta.threads.messages.create)
+		self.beta.threads.runs.create = create_run
+		self.beta.threads.runs.retrieve = _to_async(self.beta.threads.runs.retrieve)
+		self.beta.assistants.create = _to_async(self.beta.assistants.create)
+		self.beta.assistants.update = _to_async(self.beta.assistants.update)
+		self.files.create = _to_async(self.files.create)
@@ -0,0 +1,92 @@
+import os
+import time
+import threading
+import pandas as pd
+from types import SimpleNamespace
+
+# A stand-in for yf.Tickers that serves the recorded frames in tests/fixtures/yfinance, so no test goes to the network.
+# {TICKER}_history.csv is Ticker.history(), {TICKER}_{attribute}.csv a statement (i.e. quarterly_cashflow),
+# in the shape yfinance returns them: history by date, statements with one column per fiscal period.
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'yfinance')
+
+def load_fixture(stock:str, attribute:str) -> pd.DataFrame:
+
+	file_path = os.path.join(FIXTURE_DIR, f'{stock}_{attribute}.csv')
+
+	if not os.path.exists(file_path):
+		raise ValueError(f'{stock}: no {attribute} data')
+
+	df = pd.read_csv(file_path, index_col=0)
+
+	if attribute == 'history':
+		df.index = pd.DatetimeIndex(pd.to_datetime(df.index, utc=True).tz_convert('America/New_York'), name='Date')
+	else:
+		df.columns = pd.to_datetime(df.columns)
+
+	return df
+
+class FakeTicker():
+
+	def __init__(self, yf_fake:'FakeYFinance', stock:str):
+		self._yf_fake = yf_fake
+		self._stock = stock
+
+	def history(self, period:str=None, start:str=None, **kwargs) -> pd.DataFrame:
+
+		# period isn't applied, the fixtures are shorter than any period
+		df = self._yf_fake.get(self._stock, 'history', period=period, start=start)
+
+		if start is not None:
+			df = df.loc[df.index >= pd.Timestamp(start, tz=df.index.tz), :]
+
+		return df
+
+	def __getattr__(self, attribute:str):
+
+		# Statements are properties in yfinance
+		if attribute.startswith('_'):
+			raise AttributeError(attribute)
+
+		return self._yf_fake.get(self._stock, attribute)
+
+class FakeYFinance():
+
+	def __init__(self, frames:dict=None, failures:dict=None, delay:float=0):
+
+		"""
+		frames {(stock, attribute): DataFrame} are served instead of the fixtures.
+		failures {(stock, attribute): n} makes the first n requests of the data fail.
+		Every request takes delay seconds.
+		"""
+
+		self.delay = delay
+
+		self.frames = frames or {}
+		self.failures = dict(failures or {})
+
+		# (stock, attribute, kwargs) of every request
+		self.calls = []
+		self._lock = threading.Lock()
+
+	def get(self, stock:str, attribute:str, **kwargs) -> pd.DataFrame:
+
+		with self._lock:
+			self.calls.append((stock, attribute, kwargs))
+
+			if self.failures.get((stock, attribute), 0) > 0:
+				self.failures[(stock, attribute)] -= 1
+				raise ConnectionError(f'{stock}: {attribute} request failed')
+
+		time.sleep(self.delay)
+
+		if (stock, attribute) in self.frames:
+			return self.frames[(stock, attribute)].copy()
+
+		return load_fixture(stock, attribute)
+
+	def count(self, stock:str=None, attribute:str=None) -> int:
+		return len([call for call in self.calls if stock in (None, call[0]) and attribute in (None, call[1])])
+
+	def Tickers(self, stock_list:list):
+		return SimpleNamespace(tickers={stock: FakeTicker(yf_fake=self, stock=stock) for stock in stock_list})
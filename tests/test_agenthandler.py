@@ -0,0 +1,109 @@
+import io
+import asyncio
+import contextlib
+import pytest
+from fakeopenai import FakeOpenAI, FakeAsyncOpenAI
+from agenthandler import AgentHandler, AsyncAgentHandler, get_agent_fingerprint, sync_all
+from eventhandler import ThreadManager
+
+def new_dic_agents() -> dict:
+	return {name: {'id': f'asst_{name}', 'instructions': name, 'model': 'gpt-4o', 'tools': []} for name in ['ceo', 'cfo']}
+
+@pytest.fixture
+def quiet():
+	with contextlib.redirect_stdout(io.StringIO()):
+		yield
+
+def test_unchanged_config_is_not_pushed(tmp_cwd, quiet):
+
+	client = FakeOpenAI()
+	dic_agents = new_dic_agents()
+
+	# Loading an agent doesn't call OpenAI
+	agent = AgentHandler(client=client, new=False, dic_file=dic_agents, assistant_name='ceo')
+	assert client.calls == {}
+
+	# No fingerprint yet, the first run pushes the config, the next ones don't
+	thread = ThreadManager(client=client, prompt='MSFT')
+	thread.run_thread(assistant=agent, prompt='How is MSFT doing?')
+	thread.run_thread(assistant=agent, prompt='And AAPL?')
+
+	assert client.calls['assistants.update'] == 1
+	assert dic_agents['ceo']['fingerprint'] == get_agent_fingerprint(instructions='ceo', model='gpt-4o', tools=[], tool_resources={})
+
+	# The same values again
+	agent.update_agent(instructions='ceo', model='gpt-4o', tools=[])
+
+	assert not agent.needs_sync
+	assert not agent.sync()
+	assert client.calls['assistants.update'] == 1
+
+@pytest.mark.parametrize('changes, pushed', [
+	({'model': 'gpt-4o-mini'}, {'model': 'gpt-4o-mini'}),
+	({'tools': [{'type': 'code_interpreter'}]}, {'tools': [{'type': 'code_interpreter'}]}),
+	({'agent_files': ['file_1']}, {'tool_resources': {'code_interpreter': {'file_ids': ['file_1']}}})
+])
+def test_changed_config_is_pushed(tmp_cwd, quiet, changes, pushed):
+
+	client = FakeOpenAI()
+	dic_agents = new_dic_agents()
+
+	agent = AgentHandler(client=client, new=False, dic_file=dic_agents, assistant_name='ceo')
+	agent.sync()
+
+	agent.update_agent(**changes)
+
+	assert agent.needs_sync
+	assert agent.sync()
+	assert client.calls['assistants.update'] == 2
+
+	update = client.assistant_updates[-1]
+	assert update['assistant_id'] == 'asst_ceo'
+	assert {key: update[key] for key in pushed} == pushed
+
+	# Pushed once, the same change again is skipped
+	agent.update_agent(**changes)
+
+	assert not agent.sync()
+	assert client.calls['assistants.update'] == 2
+
+def test_fingerprint_is_kept_across_loads(tmp_cwd, quiet):
+
+	client = FakeOpenAI()
+	dic_agents = new_dic_agents()
+
+	agent = AgentHandler(client=client, new=False, dic_file=dic_agents, assistant_name='ceo')
+	agent.update_agent(model='gpt-4o-mini', agent_files=['file_1'])
+	agent.sync()
+
+	# Another process loads the agent and gives it the same files, nothing to push
+	agent = AgentHandler(client=client, new=False, dic_file=dic_agents, assistant_name='ceo')
+	agent.update_agent(agent_files=['file_1'])
+
+	assert not agent.needs_sync
+	assert client.calls['assistants.update'] == 1
+
+	# Only the agents that changed are synced
+	agents = [agent, AgentHandler(client=client, new=False, dic_file=dic_agents, assistant_name='cfo')]
+
+	assert sync_all(agents=agents) == 1
+	assert [update['assistant_id'] for update in client.assistant_updates] == ['asst_ceo', 'asst_cfo']
+
+def test_async_agent_skips_unchanged_config(tmp_cwd, quiet):
+
+	client = FakeAsyncOpenAI()
+	dic_agents = new_dic_agents()
+
+	async def main() -> list:
+
+		agent = await AsyncAgentHandler.create(client=client, new=False, dic_file=dic_agents, assistant_name='ceo')
+
+		synced = [await agent.sync(), await agent.sync()]
+
+		await agent.update_agent(model='gpt-4o-mini')
+		synced.append(await agent.sync())
+
+		return synced
+
+	assert asyncio.run(main()) == [True, False, True]
+	assert client.calls['assistants.update'] == 2
@@ -0,0 +1,47 @@
+import io
+import json
+import contextlib
+import pytest
+from configstore import ConfigStore, get_config_store
+from filehandler import save_file_manifest
+
+def test_manifest_is_written_before_save_returns(tmp_cwd):
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		save_file_manifest(dic_file={'df_stocks.csv': {'id': 'file_1', 'sha256': 'abc'}}, manifest_path='openai_files.json')
+
+	assert json.loads((tmp_cwd / 'openai_files.json').read_text()) == {'df_stocks.csv': {'id': 'file_1', 'sha256': 'abc'}}
+
+def test_manifest_write_error_reaches_the_caller(tmp_cwd):
+
+	with pytest.raises(OSError):
+		save_file_manifest(dic_file={'df_stocks.csv': {'id': 'file_1', 'sha256': 'abc'}}, manifest_path='missing_dir/openai_files.json')
+
+	# The entry is still waiting to be written, it's written once the directory exists
+	(tmp_cwd / 'missing_dir').mkdir()
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		get_config_store(path='missing_dir/openai_files.json').flush()
+
+	assert json.loads((tmp_cwd / 'missing_dir' / 'openai_files.json').read_text()) == {'df_stocks.csv': {'id': 'file_1', 'sha256': 'abc'}}
+
+def test_failed_timer_write_keeps_the_keys(tmp_cwd):
+
+	store = ConfigStore(path=str(tmp_cwd / 'missing_dir' / 'config.json'), debounce=60)
+	store['key'] = 'value'
+	timer = store._timer
+
+	with contextlib.redirect_stdout(io.StringIO()) as output:
+		store._flush_from_timer()
+
+	assert 'could not be written' in output.getvalue()
+	assert store._dirty_keys == {'key'}
+
+	timer.join()
+
+	(tmp_cwd / 'missing_dir').mkdir()
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		store.flush()
+
+	assert json.loads((tmp_cwd / 'missing_dir' / 'config.json').read_text()) == {'key': 'value'}
@@ -0,0 +1,94 @@
+import io
+import time
+import threading
+import contextlib
+import pytest
+from datapipeline import DataPipeline
+
+def test_failed_items_are_collected_and_the_others_go_through():
+
+	list_doubled = []
+
+	def fetch(item:int) -> int:
+		if item == 2:
+			raise ValueError('no data for 2')
+		return item
+
+	def double(value:int) -> int:
+		list_doubled.append(value)
+		return value * 2
+
+	pipeline = DataPipeline(stages=[('fetch', fetch, 2), ('double', double, 1)])
+
+	with contextlib.redirect_stdout(io.StringIO()) as stdout:
+		dic_outputs = pipeline.run(items={'c': 3, 'b': 2, 'a': 1})
+
+	# In the order of the items, without the failed one
+	assert dic_outputs == {'c': 6, 'a': 2}
+	assert list(pipeline.errors) == ['b']
+	assert str(pipeline.errors['b']) == 'no data for 2'
+	assert 'Pipeline stage fetch failed for b: no data for 2' in stdout.getvalue()
+
+	# The failed item skips the later stages
+	assert sorted(list_doubled) == [1, 3]
+	assert pipeline.metrics['fetch']['items'] == 3
+	assert pipeline.metrics['double']['items'] == 2
+
+def test_bounded_queues_hold_back_a_fast_stage():
+
+	lock = threading.Lock()
+	dic_counts = {'fetched': 0, 'uploaded': 0, 'max_ahead': 0}
+
+	def fetch(item:int) -> int:
+		with lock:
+			dic_counts['fetched'] += 1
+			dic_counts['max_ahead'] = max(dic_counts['max_ahead'], dic_counts['fetched'] - dic_counts['uploaded'])
+		return item
+
+	def upload(item:int) -> int:
+		with lock:
+			dic_counts['uploaded'] += 1
+		time.sleep(0.02)
+		return item
+
+	pipeline = DataPipeline(stages=[('fetch', fetch, 1), ('upload', upload, 1)], queue_size=1)
+	dic_outputs = pipeline.run(items={i: i for i in range(10)})
+
+	assert list(dic_outputs) == list(range(10))
+
+	# Fetched but not uploaded yet: at most one item taken by the upload worker, one in the queue and one in the fetch worker
+	# Without the bound the fetch stage would run through all 10 items
+	assert dic_counts['max_ahead'] <= 3
+	assert pipeline.metrics['upload']['max_queue_depth'] <= 1
+
+def test_metrics_of_a_run():
+
+	def fetch(item:int) -> int:
+		time.sleep(0.05)
+		return item
+
+	def serialize(item:int) -> str:
+		return str(item)
+
+	# 4 items on 2 fetch workers take about 2 * 0.05 seconds, one after another 0.2 seconds
+	pipeline = DataPipeline(stages=[('fetch', fetch, 2), ('serialize', serialize, 1)], queue_size=2)
+	dic_outputs = pipeline.run(items={i: i for i in range(4)})
+
+	assert dic_outputs == {0: '0', 1: '1', 2: '2', 3: '3'}
+	assert 0.1 <= pipeline.total_time < 0.19
+
+	assert list(pipeline.metrics) == ['fetch', 'serialize']
+
+	for stage_metrics in pipeline.metrics.values():
+		assert list(stage_metrics) == ['items', 'busy_time', 'wait_time', 'max_queue_depth', 'avg_queue_depth']
+		assert stage_metrics['items'] == 4
+
+	assert pipeline.metrics['fetch']['busy_time'] >= 0.2
+	assert pipeline.metrics['serialize']['wait_time'] > 0
+	assert 1 <= pipeline.metrics['fetch']['max_queue_depth'] <= 2
+	assert 0 < pipeline.metrics['fetch']['avg_queue_depth'] <= pipeline.metrics['fetch']['max_queue_depth']
+
+def test_pipeline_needs_a_stage():
+
+	with pytest.raises(ValueError):
+		DataPipeline(stages=[])
@@ -0,0 +1,24 @@
+import io
+import time
+import contextlib
+from fakeopenai import FakeOpenAI
+from agenthandler import AgentHandler
+from eventhandler import ThreadManager
+
+def test_turn_ends_with_the_stream(tmp_cwd):
+
+	client = FakeOpenAI(run_delay=0.2, replies={'asst_analyst': lambda text: 'MSFT looks fine'})
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		dic_agents = {'analyst': {'id': 'asst_analyst', 'instructions': 'analyst', 'model': 'gpt-4o', 'tools': []}}
+		agent = AgentHandler(client=client, new=False, dic_file=dic_agents, assistant_name='analyst')
+		thread = ThreadManager(client=client, prompt='MSFT')
+
+		start = time.perf_counter()
+		last_message = thread.run_thread(assistant=agent, prompt='How is MSFT doing?')
+		turn_time = time.perf_counter() - start
+
+	# No sleeping and no listing after the run, the reply comes from the stream
+	assert last_message == 'MSFT looks fine'
+	assert turn_time < 0.2 + 0.5
+	assert client.calls['messages.list'] == 1
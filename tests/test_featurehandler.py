@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+import pytest
+from featurehandler import FeatureHandler
+
+def new_prices() -> pd.DataFrame:
+
+	# AAA rises by 1 a day from 100 for 260 days, BBB rises to 60 and then falls by 0.5 a day for 30 days
+	close_aaa = [100.0 + i for i in range(260)]
+	close_bbb = [50.0 + i for i in range(10)] + [60.0 - 0.5 * i for i in range(20)]
+
+	frames = []
+
+	for ticker, close in [('BBB', close_bbb), ('AAA', close_aaa)]:
+		frames.append(pd.DataFrame({
+			'Date': pd.bdate_range('2024-01-01', periods=len(close)),
+			'Ticker': ticker,
+			'Close': close,
+			'High': [value + 1 for value in close],
+			'Low': [value - 1 for value in close]
+		}))
+
+	return pd.concat(frames, ignore_index=True)
+
+def new_statements() -> tuple:
+
+	# Five quarters of AAA, the latest last after sorting
+	dates = pd.to_datetime(['2024-12-31', '2023-12-31', '2024-03-31', '2024-06-30', '2024-09-30'])
+	revenue = [120.0, 80.0, 90.0, 100.0, 110.0]
+
+	df_income = pd.DataFrame({
+		'Date': dates,
+		'Ticker': 'AAA',
+		'Total Revenue': revenue,
+		'Gross Profit': [value * 0.5 for value in revenue],
+		'Operating Income': [value * 0.3 for value in revenue],
+		'Net Income': [16.0, 8.0, 9.0, 10.0, 11.0],
+		'Diluted EPS': [2.0, 1.0, 1.0, 1.0, 1.0]
+	})
+
+	df_balance_sheet = pd.DataFrame({
+		'Date': dates[0:2],
+		'Ticker': 'AAA',
+		'Total Debt': [50.0, 80.0],
+		'Stockholders Equity': [200.0, 160.0],
+		'Current Assets': [150.0, 120.0],
+		'Current Liabilities': [100.0, 100.0],
+		'Ordinary Shares Number': [10.0, 10.0]
+	})
+
+	df_cashflow = pd.DataFrame({
+		'Date': dates,
+		'Ticker': 'AAA',
+		'Free Cash Flow': [20.0, 5.0, 10.0, 10.0, 10.0]
+	})
+
+	return df_income, df_balance_sheet, df_cashflow
+
+def test_price_features():
+
+	df_features = FeatureHandler().compute_price_features(df_stocks=new_prices())
+
+	assert df_features.index.tolist() == ['AAA', 'BBB']
+
+	aaa = df_features.loc['AAA', :]
+
+	assert aaa['close'] == 359
+	assert aaa['price_date'] == pd.bdate_range('2024-01-01', periods=260)[-1]
+	assert aaa['return_1m'] == pytest.approx(359 / 338 - 1)
+	assert aaa['return_3m'] == pytest.approx(359 / 296 - 1)
+	assert aaa['return_6m'] == pytest.approx(359 / 233 - 1)
+	assert aaa['return_1y'] == pytest.approx(359 / 107 - 1)
+
+	# Means of 310..359 and 160..359
+	assert aaa['ma_50'] == pytest.approx(334.5)
+	assert aaa['ma_200'] == pytest.approx(259.5)
+	assert aaa['close_to_ma_200'] == pytest.approx(359 / 259.5 - 1)
+
+	# The high is 1 above and the low 1 below the close, so every true range is 2
+	assert aaa['atr_14'] == pytest.approx(2)
+
+	# Sample std of the last 63 daily returns, annualized
+	daily_returns = [(100.0 + i) / (99.0 + i) - 1 for i in range(197, 260)]
+	assert aaa['volatility_3m'] == pytest.approx(np.std(daily_returns, ddof=1) * np.sqrt(252))
+
+	assert aaa['drawdown'] == 0
+	assert aaa['max_drawdown'] == 0
+
+	bbb = df_features.loc['BBB', :]
+
+	# 30 days: only the 1 month return, and the close is down from the high of 60
+	assert bbb['close'] == 50.5
+	assert bbb['return_1m'] == pytest.approx(50.5 / 58 - 1)
+	assert bbb[['return_3m', 'return_1y', 'ma_50', 'ma_200', 'volatility_3m']].isna().all()
+	assert bbb['drawdown'] == pytest.approx(50.5 / 60 - 1)
+	assert bbb['max_drawdown'] == pytest.approx(50.5 / 60 - 1)
+
+def test_statement_features():
+
+	df_income, df_balance_sheet, df_cashflow = new_statements()
+
+	df_features = FeatureHandler(periods_per_year=4).compute_statement_features(df_income=df_income, df_balance_sheet=df_balance_sheet, df_cashflow=df_cashflow)
+
+	aaa = df_features.loc['AAA', :]
+
+	assert aaa['statement_date'] == pd.Timestamp('2024-12-31')
+	assert aaa['gross_margin'] == pytest.approx(0.5)
+	assert aaa['operating_margin'] == pytest.approx(0.3)
+	assert aaa['net_margin'] == pytest.approx(16 / 120)
+	assert aaa['revenue_growth_qoq'] == pytest.approx(120 / 110 - 1)
+	assert aaa['revenue_growth_yoy'] == pytest.approx(0.5)
+	assert aaa['net_income_growth_yoy'] == pytest.approx(1)
+
+	# Sums of the last 4 quarters
+	assert aaa['revenue_ttm'] == 420
+	assert aaa['eps_ttm'] == 5
+	assert aaa['free_cash_flow_ttm'] == 50
+
+	# The latest balance sheet
+	assert aaa['debt_to_equity'] == pytest.approx(0.25)
+	assert aaa['current_ratio'] == pytest.approx(1.5)
+	assert aaa['book_value'] == 200
+	assert aaa['shares'] == 10
+
+	assert FeatureHandler().compute_statement_features().empty
+
+def test_metrics_table_valuation_ratios():
+
+	df_income, df_balance_sheet, df_cashflow = new_statements()
+
+	# BBB has a market cap in its info, AAA's comes from its close and share count
+	stock_info = {'AAA': {'sector': 'Energy'}, 'BBB': {'sector': 'Technology', 'marketCap': 1000}}
+
+	df_metrics = FeatureHandler(stock_info=stock_info).build_metrics_table(
+		df_stocks=new_prices(),
+		df_income=df_income,
+		df_balance_sheet=df_balance_sheet,
+		df_cashflow=df_cashflow
+	)
+
+	assert df_metrics.columns[0] == 'Ticker'
+	assert 'marketCap' not in df_metrics.columns
+
+	df_metrics = df_metrics.set_index('Ticker')
+	aaa = df_metrics.loc['AAA', :]
+
+	assert aaa['sector'] == 'Energy'
+	assert aaa['market_cap'] == 3590
+	assert aaa['pe_ratio'] == pytest.approx(359 / 5)
+	assert aaa['ps_ratio'] == pytest.approx(3590 / 420)
+	assert aaa['pb_ratio'] == pytest.approx(3590 / 200)
+	assert aaa['fcf_yield'] == pytest.approx(50 / 3590)
+
+	# No statements for BBB, only the market cap is known
+	bbb = df_metrics.loc['BBB', :]
+
+	assert bbb['sector'] == 'Technology'
+	assert bbb['market_cap'] == 1000
+	assert bbb[['pe_ratio', 'ps_ratio', 'pb_ratio', 'fcf_yield', 'revenue_ttm']].isna().all()
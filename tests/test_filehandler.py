@@ -0,0 +1,160 @@
+import io
+import json
+import asyncio
+import contextlib
+import pandas as pd
+import filehandler
+from filehandler import FileHandler, save_file_manifest
+from fileregistry import get_file_registry
+from fakeopenai import FakeOpenAI, FakeAsyncOpenAI
+
+def new_df(tickers:list, rows:int=200) -> pd.DataFrame:
+	return pd.DataFrame({
+		'Ticker': [ticker for ticker in tickers for _ in range(rows)],
+		'Close': [float(i) for _ in tickers for i in range(rows)]
+	})
+
+def new_file_handler(client, dic_file:dict, df:pd.DataFrame, max_file_size:int=None) -> FileHandler:
+	return FileHandler(
+		df=df,
+		dic_file=dic_file,
+		dic_file_name='openai_files.json',
+		file_name='df_stocks.csv',
+		client=client,
+		file_path='',
+		max_file_size=max_file_size
+	)
+
+def test_split_files_are_written_once(tmp_cwd, monkeypatch):
+
+	list_written = []
+	write_csv = filehandler.FILE_WRITERS['.csv']
+
+	def record_write(df, file_path):
+		list_written.append(file_path)
+		write_csv(df, file_path)
+
+	monkeypatch.setitem(filehandler.FILE_WRITERS, '.csv', record_write)
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		file_handler = new_file_handler(client=FakeOpenAI(), dic_file={}, df=new_df(['MSFT', 'AAPL', 'NVDA']), max_file_size=1000)
+
+	assert file_handler.file_names == ['df_stocks_MSFT.csv', 'df_stocks_AAPL.csv', 'df_stocks_NVDA.csv']
+	assert 'df_stocks.csv' not in list_written
+	assert [path for path in list_written if not path.startswith('.sample_')] == file_handler.file_names
+
+def test_split_replaces_the_whole_file_in_the_manifest(tmp_cwd):
+
+	client = FakeOpenAI()
+	dic_file = {}
+
+	with contextlib.redirect_stdout(io.StringIO()):
+
+		file_handler = new_file_handler(client=client, dic_file=dic_file, df=new_df(['MSFT', 'AAPL']))
+		file_handler.update_openai_file(save_manifest=False)
+		save_file_manifest(dic_file=dic_file, manifest_path='openai_files.json')
+
+		whole_file_id = file_handler.file_id
+
+		# More data, now split by ticker
+		file_handler = new_file_handler(client=client, dic_file=dic_file, df=new_df(['MSFT', 'AAPL'], rows=2000), max_file_size=20000)
+		file_handler.update_openai_file(save_manifest=False)
+		save_file_manifest(dic_file=dic_file, manifest_path='openai_files.json')
+
+	assert len(file_handler.file_ids) == 2
+	assert list(dic_file) == ['df_stocks_MSFT.csv', 'df_stocks_AAPL.csv']
+	assert get_file_registry().get_files(ref='manifest:df_stocks.csv') == []
+	assert whole_file_id in get_file_registry().get_unreferenced(grace_period=0)
+
+def test_unchanged_file_is_not_uploaded_again(tmp_cwd):
+
+	client = FakeOpenAI()
+
+	# An entry of an older manifest has no hash, so the file is uploaded once more
+	dic_file = {'df_stocks.csv': 'file_old'}
+
+	with contextlib.redirect_stdout(io.StringIO()):
+
+		file_handler = new_file_handler(client=client, dic_file=dic_file, df=new_df(['MSFT']))
+		assert file_handler.update_openai_file()
+
+		file_id = file_handler.file_id
+		assert dic_file['df_stocks.csv'] == {'id': file_id, 'sha256': file_handler.file_hash}
+
+		# The same data written again has the same hash
+		file_handler = new_file_handler(client=client, dic_file=dic_file, df=new_df(['MSFT']))
+		assert not file_handler.update_openai_file()
+		assert file_handler.file_id == file_id
+		assert not file_handler.manifest_changed
+
+		# Unless the upload is forced
+		assert file_handler.update_openai_file(force=True)
+		assert file_handler.file_id != file_id
+
+		# Changed data
+		file_handler = new_file_handler(client=client, dic_file=dic_file, df=new_df(['MSFT', 'AAPL']))
+		assert file_handler.update_openai_file()
+
+	assert client.calls['files.create'] == 3
+
+def test_dropped_partition_is_saved_without_an_upload(tmp_cwd):
+
+	client = FakeOpenAI()
+
+	# Another dataset whose name starts like the partitions
+	dic_file = {'df_stocks_info.csv': {'id': 'file-info', 'sha256': 'info'}}
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		file_handler = new_file_handler(client=client, dic_file=dic_file, df=new_df(['MSFT', 'AAPL', 'NVDA'], rows=2000), max_file_size=20000)
+		file_handler.update_openai_file()
+
+	assert dic_file['df_stocks_NVDA.csv']['part_of'] == 'df_stocks.csv'
+
+	# NVDA is gone, the other partitions are unchanged
+	with contextlib.redirect_stdout(io.StringIO()):
+		file_handler = new_file_handler(client=client, dic_file=dic_file, df=new_df(['MSFT', 'AAPL'], rows=2000), max_file_size=20000)
+		uploaded = file_handler.update_openai_file()
+
+	assert not uploaded
+	assert file_handler.manifest_changed
+
+	with open('openai_files.json', 'r') as f:
+		assert sorted(json.load(f)) == ['df_stocks_AAPL.csv', 'df_stocks_MSFT.csv', 'df_stocks_info.csv']
+
+	assert get_file_registry().get_files(ref='manifest:df_stocks_NVDA.csv') == []
+	assert get_file_registry().get_files(ref='manifest:df_stocks_info.csv') == ['file-info']
+
+def test_partitions_saved_without_part_of_are_matched_by_value(tmp_cwd):
+
+	# Entries of an older manifest, only the file ids
+	dic_file = {'df_stocks_MSFT.csv': 'file-msft', 'df_stocks_info.csv': 'file-info'}
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		file_handler = new_file_handler(client=FakeOpenAI(), dic_file=dic_file, df=new_df(['MSFT', 'AAPL']))
+		file_handler.update_openai_file(save_manifest=False)
+
+	# The data fits in one file again
+	assert list(dic_file) == ['df_stocks_info.csv', 'df_stocks.csv']
+
+def test_async_upload_of_split_files(tmp_cwd):
+
+	client = FakeAsyncOpenAI()
+	dic_file = {}
+
+	async def upload(df:pd.DataFrame) -> tuple:
+		file_handler = new_file_handler(client=client, dic_file=dic_file, df=df, max_file_size=20000)
+		return file_handler, await file_handler.aupdate_openai_file()
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		file_handler, uploaded = asyncio.run(upload(df=new_df(['MSFT', 'AAPL'], rows=2000)))
+
+	assert uploaded
+	assert sorted(client.files.files) == sorted(file_handler.file_ids)
+	assert sorted(get_file_registry().get_refs(prefix='manifest:')) == ['manifest:df_stocks_AAPL.csv', 'manifest:df_stocks_MSFT.csv']
+
+	# Unchanged data isn't uploaded again
+	with contextlib.redirect_stdout(io.StringIO()):
+		file_handler, uploaded = asyncio.run(upload(df=new_df(['MSFT', 'AAPL'], rows=2000)))
+
+	assert not uploaded
+	assert len(client.files.files) == 2
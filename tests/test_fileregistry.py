@@ -0,0 +1,117 @@
+import io
+import json
+import time
+import contextlib
+import pytest
+import configstore
+import fileregistry
+from fileregistry import FileRegistry
+from agenthandler import AgentHandler
+from fakeopenai import FakeOpenAI
+
+@pytest.fixture
+def registry(tmp_cwd):
+	return FileRegistry(path='config/file_registry.json', manifest_path=None)
+
+def test_sweep_deletes_untracked_files_of_the_manifest_only(tmp_cwd):
+
+	client = FakeOpenAI()
+
+	manifest_path = tmp_cwd / 'openai_files.json'
+	manifest_path.write_text(json.dumps({
+		'df_stocks_MSFT.csv': {'id': 'file_msft', 'sha256': 'abc', 'part_of': 'df_stocks.csv'}
+	}))
+
+	registry = FileRegistry(path='config/file_registry.json', manifest_path=str(manifest_path))
+
+	# Uploads of a run that crashed before they were registered
+	orphaned = client.files.add(created_at=time.time() - 7200, filename='df_stocks_MSFT.csv')
+	orphaned_whole = client.files.add(created_at=time.time() - 7200, filename='df_stocks.csv')
+	recent = client.files.add(filename='df_stocks_MSFT.csv')
+
+	# Files of another project in the same account
+	other = client.files.add(created_at=time.time() - 7200, filename='report.pdf')
+
+	tracked = client.files.add(created_at=time.time() - 7200, filename='df_stocks_MSFT.csv')
+	registry.add_ref(file_id=tracked, ref='assistant:asst_1')
+
+	deleted = registry.sweep(client=client, grace_period=3600, include_untracked=True)
+
+	assert sorted(deleted) == sorted([orphaned, orphaned_whole])
+	assert set(client.files.files) == {recent, other, tracked}
+
+def test_sweep_deletes_released_files(registry):
+
+	client = FakeOpenAI()
+	file_id = client.files.add()
+
+	registry.add_ref(file_id=file_id, ref='manifest:df_stocks.csv')
+	registry.add_ref(file_id=file_id, ref='thread:thread_1')
+
+	registry.set_refs(ref='manifest:df_stocks.csv', file_ids=[])
+	assert registry.sweep(client=client, grace_period=0) == []
+
+	registry.release(ref='thread:thread_1')
+	assert registry.sweep(client=client, grace_period=0) == [file_id]
+
+def test_thread_refs_expire(registry, monkeypatch):
+
+	client = FakeOpenAI()
+	file_id = client.files.add()
+	legacy_file_id = client.files.add()
+
+	registry.add_ref(file_id=file_id, ref='thread:thread_1', ttl=60)
+
+	# A thread ref saved without a ttl, i.e. by a process that crashed before refs had one
+	registry.add_ref(file_id=legacy_file_id, ref='thread:thread_2')
+
+	assert registry.sweep(client=client, grace_period=0) == []
+
+	now = time.time()
+	monkeypatch.setattr(fileregistry.time, 'time', lambda: now + fileregistry.THREAD_REF_TTL + 1)
+
+	assert sorted(registry.sweep(client=client, grace_period=0)) == sorted([file_id, legacy_file_id])
+
+def test_manifest_files_are_registered(tmp_cwd):
+
+	client = FakeOpenAI()
+	old_file_id = client.files.add()
+
+	manifest_path = tmp_cwd / 'openai_files.json'
+	manifest_path.write_text(json.dumps({'df_stocks.csv': {'id': old_file_id, 'sha256': 'abc'}}))
+
+	registry = FileRegistry(path='config/file_registry.json', manifest_path=str(manifest_path))
+
+	assert registry.get_files(ref='manifest:df_stocks.csv') == [old_file_id]
+
+	# The manifest moves on to a new upload, the file from before the registry can be collected
+	registry.set_refs(ref='manifest:df_stocks.csv', file_ids=['file_new'])
+
+	assert registry.sweep(client=client, grace_period=0) == [old_file_id]
+
+def test_assistant_files_are_registered_when_the_agent_is_loaded(tmp_cwd):
+
+	client = FakeOpenAI()
+	file_id = client.files.add(created_at=time.time() - 7200)
+
+	dic_agents = {'ceo': {'id': 'asst_ceo', 'instructions': 'ceo', 'model': 'gpt-4o', 'tools': []}}
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		agent = AgentHandler(client=client, new=False, dic_file=dic_agents, assistant_name='ceo')
+		agent.update_agent(agent_files=[file_id])
+		agent.sync()
+
+	# The pushed files are kept in assistants.json
+	assert dic_agents['ceo']['tool_resources'] == {'code_interpreter': {'file_ids': [file_id]}}
+
+	# A new process: the registry only knows the assistant's files from assistants.json
+	configstore.flush_all()
+	configstore._config_stores.clear()
+	fileregistry._file_registry = None
+	(tmp_cwd / 'config' / 'file_registry.json').unlink()
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		AgentHandler(client=client, new=False, dic_file=dic_agents, assistant_name='ceo')
+
+	assert fileregistry.get_file_registry().get_files(ref='assistant:asst_ceo') == [file_id]
+	assert fileregistry.get_file_registry().sweep(client=client, grace_period=0, include_untracked=True) == []
@@ -0,0 +1,137 @@
+import io
+import time
+import asyncio
+import threading
+import contextlib
+import httpx
+import openai
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from ratelimiter import RateLimiter
+from clienthandler import get_client, get_async_client
+
+def test_async_acquire_keeps_priority_order_without_threads():
+
+	# 10 requests a second and an empty bucket, so every caller has to wait in the queue
+	limiter = RateLimiter(requests_per_minute=600)
+	limiter._requests = 0
+
+	list_order = []
+
+	async def acquire(priority:int):
+		await limiter.async_acquire(priority=priority)
+		list_order.append(priority)
+
+	async def main():
+
+		# With one worker thread, waiting in threads would serve the callers in the order the thread picks them up
+		asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=1))
+
+		await asyncio.gather(*[acquire(priority=priority) for priority in [3, 1, 2, 0, 1, 3]])
+
+	# Threads of earlier tests may still be ending, only new threads count
+	threads_before = set(threading.enumerate())
+
+	asyncio.run(main())
+
+	assert list_order == [0, 1, 1, 2, 3, 3]
+	assert set(threading.enumerate()) - threads_before == set()
+	assert limiter.metrics['requests'] == 6
+
+def test_sync_and_async_callers_share_the_queue():
+
+	limiter = RateLimiter(requests_per_minute=600)
+	limiter._requests = 0
+
+	list_order = []
+
+	def acquire_sync(priority:int):
+		limiter.acquire(priority=priority)
+		list_order.append(priority)
+
+	async def main():
+
+		thread = threading.Thread(target=acquire_sync, args=(0,))
+		thread.start()
+
+		async def acquire(priority:int):
+			await limiter.async_acquire(priority=priority)
+			list_order.append(priority)
+
+		await asyncio.gather(*[acquire(priority=priority) for priority in [2, 1]])
+		thread.join()
+
+	asyncio.run(main())
+
+	assert sorted(list_order) == [0, 1, 2]
+	assert list_order.index(1) < list_order.index(2)
+
+def test_clients_leave_retries_to_the_limiter():
+
+	assert get_client(api_key='test').max_retries == 0
+
+	async def main():
+		return get_async_client(api_key='test')
+
+	assert asyncio.run(main()).max_retries == 0
+
+def new_error(kind:str) -> Exception:
+
+	request = httpx.Request('POST', 'https://api.openai.com/v1/threads')
+
+	if kind == 'connection':
+		return openai.APIConnectionError(request=request)
+	elif kind == 'timeout':
+		return openai.APITimeoutError(request=request)
+
+	return openai.APIStatusError(kind, response=httpx.Response(int(kind), request=request), body=None)
+
+def failing_once(error:Exception):
+
+	list_calls = []
+
+	def func():
+		list_calls.append(error)
+		if len(list_calls) == 1:
+			raise error
+		return 'ok'
+
+	return func, list_calls
+
+@pytest.mark.parametrize('kind, metric', [('connection', 'connection_errors'), ('timeout', 'connection_errors'), ('408', 'server_errors'), ('409', 'server_errors'), ('503', 'server_errors')])
+def test_errors_the_sdk_would_retry_are_retried_without_pausing(kind, metric):
+
+	limiter = RateLimiter(base_wait=0.01)
+	func, list_calls = failing_once(new_error(kind))
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		assert limiter.call(func) == 'ok'
+
+	assert len(list_calls) == 2
+	assert limiter.metrics[metric] == 1
+	assert limiter._paused_until <= time.monotonic()
+
+	# Same on the async path
+	limiter = RateLimiter(base_wait=0.01)
+	func, list_calls = failing_once(new_error(kind))
+
+	async def afunc():
+		return func()
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		assert asyncio.run(limiter.acall(afunc)) == 'ok'
+
+	assert len(list_calls) == 2
+	assert limiter.metrics[metric] == 1
+	assert limiter._paused_until <= time.monotonic()
+
+def test_client_errors_are_not_retried():
+
+	limiter = RateLimiter(base_wait=0.01)
+	func, list_calls = failing_once(new_error('400'))
+
+	with pytest.raises(openai.APIStatusError):
+		limiter.call(func)
+
+	assert len(list_calls) == 1
+	assert limiter.metrics['retries'] == 0
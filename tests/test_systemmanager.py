@@ -0,0 +1,145 @@
+import io
+import asyncio
+import contextlib
+import pytest
+from bench_nodes import REPLIES, build
+from fakeopenai import FakeOpenAI, FakeAsyncOpenAI
+from agenthandler import AgentHandler, AsyncAgentHandler
+from systemmanager import SystemNode, AsyncSystemNode, AgentThreadManager, MultiNodeManager
+
+@pytest.fixture(autouse=True)
+def config_dir(tmp_cwd):
+	pass
+
+def run(max_concurrency:int, parallel_sub_agents:bool) -> tuple:
+
+	client = FakeOpenAI(replies=REPLIES)
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		nodes_manager = build(client=client, max_concurrency=max_concurrency, parallel_sub_agents=parallel_sub_agents)
+		output = nodes_manager.run(prompt='This is a message from Client: MSFT')
+
+	# Only the agents' messages, the prompts to the sub agents are on branch threads with parallel_sub_agents
+	dic_node_messages = {
+		node.name: node.thread.df_messages.query("role == 'assistant'")['message_text'].tolist()
+		for node in nodes_manager.schema
+	}
+
+	return output, dic_node_messages, client
+
+@pytest.mark.parametrize('max_concurrency, parallel_sub_agents', [(4, False), (4, True)])
+def test_concurrent_run_matches_serial_run(max_concurrency, parallel_sub_agents):
+
+	output_serial, dic_messages_serial, _ = run(max_concurrency=1, parallel_sub_agents=False)
+	output, dic_messages, client = run(max_concurrency=max_concurrency, parallel_sub_agents=parallel_sub_agents)
+
+	assert output == output_serial == 'final report'
+	assert dic_messages.keys() == dic_messages_serial.keys()
+
+	# Child nodes report in the order of the schema's sets, which can differ between two builds
+	for node_name, messages in dic_messages_serial.items():
+		assert sorted(dic_messages[node_name]) == sorted(messages)
+
+	# Branch threads are deleted after their outputs are merged
+	assert len(client.threads) == 4
+
+NODE_REPLIES = {
+	'asst_ceo': lambda text: 'Start work: analyze MSFT' if 'Client' in text else 'final report',
+	'asst_cfo': lambda text: 'cfo summary',
+	'asst_cto': lambda text: 'cto summary'
+}
+
+def run_node(parallel_sub_agents:bool) -> tuple:
+
+	client = FakeOpenAI(replies=NODE_REPLIES)
+	agent_thread_manager = AgentThreadManager()
+	dic_agents = {name: {'id': f'asst_{name}', 'instructions': name, 'model': 'gpt-4o', 'tools': []} for name in ['ceo', 'cfo', 'cto']}
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		agents = {name: AgentHandler(client=client, new=False, dic_file=dic_agents, assistant_name=name) for name in dic_agents}
+		node = SystemNode(client=client, name='main_node', main_agent=agents['ceo'], sub_agents=[agents['cfo'], agents['cto']], agent_thread_manager=agent_thread_manager, parallel_sub_agents=parallel_sub_agents)
+
+		output = node.run_node(prompt='This is a message from Client: MSFT')
+		report = node._report_to_main_agent(node_run_id=1)
+
+	return output, report, node.thread.df_messages['message_text'].tolist(), client
+
+async def run_async_node(parallel_sub_agents:bool) -> tuple:
+
+	client = FakeAsyncOpenAI(replies=NODE_REPLIES)
+	agent_thread_manager = AgentThreadManager()
+	dic_agents = {name: {'id': f'asst_{name}', 'instructions': name, 'model': 'gpt-4o', 'tools': []} for name in ['ceo', 'cfo', 'cto']}
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		agents = {name: await AsyncAgentHandler.create(client=client, new=False, dic_file=dic_agents, assistant_name=name) for name in dic_agents}
+		node = await AsyncSystemNode.create(client=client, name='main_node', main_agent=agents['ceo'], sub_agents=[agents['cfo'], agents['cto']], agent_thread_manager=agent_thread_manager, parallel_sub_agents=parallel_sub_agents)
+
+		output = await node.run_node(prompt='This is a message from Client: MSFT')
+		report = await node._report_to_main_agent(node_run_id=1)
+
+	return output, report, node.thread.df_messages['message_text'].tolist(), client
+
+@pytest.mark.parametrize('parallel_sub_agents', [False, True])
+def test_async_node_matches_sync_node(parallel_sub_agents):
+
+	output, report, messages, client = run_node(parallel_sub_agents=parallel_sub_agents)
+	output_async, report_async, messages_async, client_async = asyncio.run(run_async_node(parallel_sub_agents=parallel_sub_agents))
+
+	assert report == report_async == 'final report'
+	assert {agent.assistant_name: message for agent, message in output['message_no_instructions'].items()} == {'cfo': 'cfo summary', 'cto': 'cto summary'}
+	assert {agent.assistant_name: message for agent, message in output_async['message_no_instructions'].items()} == {'cfo': 'cfo summary', 'cto': 'cto summary'}
+	assert messages == messages_async
+
+	# Only the node's thread is left, the branch threads are deleted
+	assert len(client.threads) == len(client_async.threads) == 1
+
+def test_failed_sub_agent_leaves_no_branch_thread():
+
+	def fail(text):
+		raise ValueError('cto run failed')
+
+	replies = {**NODE_REPLIES, 'asst_cto': fail}
+
+	for client in [FakeOpenAI(replies=replies), FakeAsyncOpenAI(replies=replies)]:
+
+		dic_agents = {name: {'id': f'asst_{name}', 'instructions': name, 'model': 'gpt-4o', 'tools': []} for name in ['ceo', 'cfo', 'cto']}
+
+		async def run_async():
+			agents = {name: await AsyncAgentHandler.create(client=client, new=False, dic_file=dic_agents, assistant_name=name) for name in dic_agents}
+			node = await AsyncSystemNode.create(client=client, name='main_node', main_agent=agents['ceo'], sub_agents=[agents['cfo'], agents['cto']], agent_thread_manager=AgentThreadManager(), parallel_sub_agents=True)
+			await node.run_node(prompt='This is a message from Client: MSFT')
+
+		with contextlib.redirect_stdout(io.StringIO()), pytest.raises(ValueError, match='cto run failed'):
+
+			if isinstance(client, FakeAsyncOpenAI):
+				asyncio.run(run_async())
+			else:
+				agents = {name: AgentHandler(client=client, new=False, dic_file=dic_agents, assistant_name=name) for name in dic_agents}
+				node = SystemNode(client=client, name='main_node', main_agent=agents['ceo'], sub_agents=[agents['cfo'], agents['cto']], agent_thread_manager=AgentThreadManager(), parallel_sub_agents=True)
+				node.run_node(prompt='This is a message from Client: MSFT')
+
+		assert len(client.threads) == 1
+
+def test_multi_node_manager_rejects_async_nodes():
+
+	async def new_nodes():
+
+		client = FakeAsyncOpenAI(replies=NODE_REPLIES)
+		dic_agents = {name: {'id': f'asst_{name}', 'instructions': name, 'model': 'gpt-4o', 'tools': []} for name in ['ceo', 'cfo']}
+		agents = {name: await AsyncAgentHandler.create(client=client, new=False, dic_file=dic_agents, assistant_name=name) for name in dic_agents}
+
+		return [await AsyncSystemNode.create(client=client, name=f'{name}_node', main_agent=agents[name], sub_agents=[], agent_thread_manager=AgentThreadManager()) for name in agents]
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		ceo_node, cfo_node = asyncio.run(new_nodes())
+
+	# The manager runs its nodes with plain calls, an async node would only give back a coroutine
+	with pytest.raises(TypeError, match='ceo_node is an AsyncSystemNode'):
+		MultiNodeManager(schema={ceo_node: {cfo_node}, cfo_node: set()})
+
+	nodes_manager = MultiNodeManager()
+
+	with pytest.raises(TypeError, match='ceo_node is an AsyncSystemNode'):
+		nodes_manager.add_node(node=ceo_node, child_node=[cfo_node])
+
+	assert nodes_manager.schema == {}
@@ -0,0 +1,167 @@
+import asyncio
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from tracing import Tracer, Span, propagate
+
+def test_children_in_threads_and_tasks_link_to_their_parent():
+
+	tracer = Tracer()
+
+	def node(i:int) -> str:
+		with tracer.span('node', i=i):
+			with tracer.span('call'):
+				return threading.current_thread().name
+
+	async def task(i:int):
+		with tracer.span('task', i=i):
+			# The tasks are inside their spans at the same time
+			await asyncio.sleep(0.01)
+			with tracer.span('call'):
+				await asyncio.sleep(0)
+
+	async def main():
+		await asyncio.gather(*[asyncio.create_task(task(i)) for i in range(2)])
+
+	with tracer.span('run') as root:
+
+		with ThreadPoolExecutor(max_workers=2) as executor:
+			thread_names = list(executor.map(propagate(node), range(2)))
+
+			# Without propagate() the worker's span starts its own trace
+			executor.submit(node, 2).result()
+
+		asyncio.run(main())
+
+	assert threading.current_thread().name not in thread_names
+
+	spans = tracer.get_spans()
+	dic_spans = {span.span_id: span for span in spans}
+
+	nodes = [span for span in spans if span.name == 'node']
+	tasks = [span for span in spans if span.name == 'task']
+
+	for span in [node for node in nodes if node.attributes['i'] < 2] + tasks:
+		assert span.parent_id == root.span_id
+		assert span.trace_id == root.trace_id
+
+	lone_node = [node for node in nodes if node.attributes['i'] == 2][0]
+
+	assert lone_node.parent_id is None
+	assert lone_node.trace_id != root.trace_id
+
+	# Every call is the child of its own node or task, not of one running next to it
+	for call in [span for span in spans if span.name == 'call']:
+		parent = dic_spans[call.parent_id]
+		assert parent.name in ('node', 'task')
+		assert parent.thread == call.thread
+		assert parent.start_time <= call.start_time and call.end_time <= parent.end_time
+
+	assert len([span for span in spans if span.name == 'call' and dic_spans[span.parent_id].name == 'task']) == 2
+	assert tracer.get_trace_ids() == [root.trace_id, lone_node.trace_id]
+
+def test_record_and_errors():
+
+	tracer = Tracer()
+
+	with pytest.raises(ValueError):
+		with tracer.span('turn') as turn:
+			tracer.record('rate_limit_wait', duration=0.25, reason='retry')
+			raise ValueError('run failed')
+
+	wait = tracer.get_spans()[0]
+
+	# A recorded span ends when it's recorded and started duration before
+	assert wait.name == 'rate_limit_wait'
+	assert wait.parent_id == turn.span_id
+	assert wait.end_time - wait.start_time == 250000000
+	assert wait.duration == pytest.approx(0.25)
+	assert wait.end_time <= turn.end_time
+	assert wait.attributes == {'reason': 'retry'}
+
+	assert turn.status == 'error'
+	assert turn.error == "ValueError('run failed')"
+
+	# Nothing is kept when tracing is off
+	tracer = Tracer(enabled=False)
+
+	with tracer.span('turn') as turn:
+		turn.set(total_tokens=10)
+		tracer.record('rate_limit_wait', duration=1)
+
+	assert tracer.get_spans() == []
+
+def new_span(name:str, start:float, end:float, parent:Span=None) -> Span:
+
+	# Seconds from an arbitrary start, in nanoseconds
+	span = Span(name=name, trace_id='t' * 32, parent_id=parent.span_id if parent is not None else None)
+	span.start_time, span.end_time = int(start * 1e9), int(end * 1e9)
+
+	return span
+
+def test_critical_path_of_overlapping_children():
+
+	root = new_span('run', 0, 10)
+
+	# Sub agents run in parallel, b overlaps a and c
+	a = new_span('a', 0, 4, parent=root)
+	a1 = new_span('a1', 0, 3, parent=a)
+	b = new_span('b', 1, 6, parent=root)
+	c = new_span('c', 5, 9, parent=root)
+	d = new_span('d', 2, 3, parent=root)
+
+	tracer = Tracer()
+	tracer._spans.extend([a1, a, d, b, c, root])
+
+	critical_path = tracer.get_critical_path()
+
+	# c ended last, a is the last one that ended before c started, nothing ended before a started
+	assert [(span.name, depth) for span, depth, _ in critical_path] == [('run', 0), ('a', 1), ('a1', 2), ('c', 1)]
+	assert [exclusive_time for _, _, exclusive_time in critical_path] == pytest.approx([2, 1, 3, 4])
+
+	report = tracer.critical_path_report()
+
+	assert report.startswith(f'Critical path of run (trace {root.trace_id}): 10.00s')
+	assert '  c: 4.00s (40%)' in report
+
+	assert Tracer().critical_path_report() == 'No finished trace'
+
+def test_otlp_payload():
+
+	tracer = Tracer()
+
+	with tracer.span('run', node='main_node') as root:
+		with pytest.raises(ValueError):
+			with tracer.span('upload', bytes=120, latency=0.5, cached=False):
+				raise ValueError('upload failed')
+
+	# Another trace
+	with tracer.span('sweep'):
+		pass
+
+	payload = tracer.to_otlp(trace_id=root.trace_id, service_name='test_service')
+
+	assert payload['resourceSpans'][0]['resource'] == {'attributes': [{'key': 'service.name', 'value': {'stringValue': 'test_service'}}]}
+
+	scope_spans = payload['resourceSpans'][0]['scopeSpans'][0]
+	assert scope_spans['scope'] == {'name': 'stock_rag.tracing'}
+
+	upload, run = scope_spans['spans']
+
+	assert run['traceId'] == upload['traceId'] == root.trace_id
+	assert len(run['traceId']) == 32 and len(run['spanId']) == 16
+	assert run['parentSpanId'] == ''
+	assert upload['parentSpanId'] == run['spanId']
+	assert run['kind'] == 1
+	assert int(run['startTimeUnixNano']) <= int(upload['startTimeUnixNano']) <= int(upload['endTimeUnixNano']) <= int(run['endTimeUnixNano'])
+
+	assert upload['attributes'] == [
+		{'key': 'bytes', 'value': {'intValue': '120'}},
+		{'key': 'latency', 'value': {'doubleValue': 0.5}},
+		{'key': 'cached', 'value': {'boolValue': False}},
+		{'key': 'thread.name', 'value': {'stringValue': threading.current_thread().name}}
+	]
+	assert upload['status'] == {'code': 2, 'message': "ValueError('upload failed')"}
+	assert run['status'] == {}
+
+	assert len(tracer.to_otlp()['resourceSpans'][0]['scopeSpans'][0]['spans']) == 3
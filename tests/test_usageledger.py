@@ -0,0 +1,116 @@
+import io
+import contextlib
+import pytest
+from fakeopenai import FakeOpenAI
+from agenthandler import AgentHandler
+from eventhandler import ThreadManager
+from usageledger import RunBudget, BudgetExceededError, to_runs_dataframe, summarize_runs
+
+def new_thread(client:FakeOpenAI, budget:RunBudget) -> tuple:
+
+	dic_agents = {'analyst': {'id': 'asst_analyst', 'instructions': 'analyst', 'model': 'gpt-4o', 'tools': []}}
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		agent = AgentHandler(client=client, new=False, dic_file=dic_agents, assistant_name='analyst')
+		thread = ThreadManager(client=client, prompt='MSFT')
+
+	thread.budget = budget
+
+	return agent, thread
+
+def test_budget_downgrades_then_stops_before_the_prompt_is_posted(tmp_cwd):
+
+	# Every fake run uses 150 tokens
+	client = FakeOpenAI()
+	budget = RunBudget(max_tokens=400, downgrade_model='gpt-4o-mini', downgrade_at=0.5)
+	agent, thread = new_thread(client=client, budget=budget)
+
+	with contextlib.redirect_stdout(io.StringIO()):
+
+		# 0 and 150 tokens used, then 300 (75%) is past downgrade_at
+		for _ in range(3):
+			thread.run_thread(assistant=agent, prompt='How is MSFT doing?')
+
+		n_messages = len(client.threads[thread.thread_id]['messages'])
+
+		# 450 tokens, past the ceiling
+		with pytest.raises(BudgetExceededError):
+			thread.run_thread(assistant=agent, prompt='And AAPL?')
+
+	assert thread.df_runs['model'].tolist() == ['gpt-4o', 'gpt-4o', 'gpt-4o-mini']
+	assert (budget.tokens, budget.runs, budget.downgraded_runs) == (450, 3, 1)
+
+	# The stopped turn didn't post its prompt
+	assert len(client.threads[thread.thread_id]['messages']) == n_messages
+	assert client.calls['messages.create'] == 3
+	assert client.calls['runs.create'] == 3
+
+def test_budget_keeps_going_on_the_downgrade_model(tmp_cwd):
+
+	client = FakeOpenAI()
+	budget = RunBudget(max_tokens=200, downgrade_model='gpt-4o-mini', on_exceed='downgrade')
+	agent, thread = new_thread(client=client, budget=budget)
+
+	# 150 tokens (75%) is below downgrade_at, 300 and 450 are past the ceiling
+	with contextlib.redirect_stdout(io.StringIO()):
+		for _ in range(4):
+			thread.run_thread(assistant=agent, prompt='How is MSFT doing?')
+
+	assert thread.df_runs['model'].tolist() == ['gpt-4o', 'gpt-4o', 'gpt-4o-mini', 'gpt-4o-mini']
+
+def test_budget_stops_on_time():
+
+	budget = RunBudget(max_seconds=10)
+	assert budget.get_model() is None
+
+	# 11 seconds after the start
+	budget._start -= 11
+
+	with pytest.raises(BudgetExceededError):
+		budget.get_model()
+
+	# A new run counts from its own start
+	budget.start()
+	assert budget.get_model() is None
+
+def test_runs_dataframe_and_summary():
+
+	records = [
+		{'node': 'main_node', 'run_id': 'run_1', 'assistant_id': 'asst_ceo', 'agent': 'ceo', 'node_run_id': 1, 'model': 'gpt-4o', 'status': 'completed',
+			'prompt_tokens': 100, 'completion_tokens': 50, 'total_tokens': 150, 'latency': 1.5, 'tool_calls': 0, 'created_at': 1.0},
+		{'node': 'main_node', 'run_id': 'run_2', 'assistant_id': 'asst_cfo', 'agent': 'cfo', 'node_run_id': 1, 'model': 'gpt-4o', 'status': 'completed',
+			'prompt_tokens': 200, 'completion_tokens': 20, 'total_tokens': 220, 'latency': 2.0, 'tool_calls': 2, 'created_at': 2.0},
+		{'node': 'main_node', 'run_id': 'run_3', 'assistant_id': 'asst_ceo', 'agent': 'ceo', 'node_run_id': None, 'model': 'gpt-4o-mini', 'status': 'completed',
+			'prompt_tokens': 300, 'completion_tokens': 30, 'total_tokens': 330, 'latency': 0.5, 'tool_calls': 1, 'created_at': 3.0}
+	]
+
+	df_runs = to_runs_dataframe(records=records, extra_columns={'node': 'str'})
+
+	assert df_runs.columns.tolist()[0:3] == ['node', 'run_id', 'assistant_id']
+	assert df_runs['node_run_id'].dtype == 'Int64'
+	assert df_runs['node_run_id'].isna().tolist() == [False, False, True]
+	assert df_runs['total_tokens'].dtype == 'int64'
+
+	df_summary = summarize_runs(df_runs=df_runs, by=['node', 'agent'])
+
+	assert df_summary.to_dict(orient='records') == [
+		{'node': 'main_node', 'agent': 'ceo', 'runs': 2, 'prompt_tokens': 400, 'completion_tokens': 80, 'total_tokens': 480,
+			'tool_calls': 1, 'latency': 2.0, 'max_latency': 1.5, 'models': 'gpt-4o, gpt-4o-mini'},
+		{'node': 'main_node', 'agent': 'cfo', 'runs': 1, 'prompt_tokens': 200, 'completion_tokens': 20, 'total_tokens': 220,
+			'tool_calls': 2, 'latency': 2.0, 'max_latency': 2.0, 'models': 'gpt-4o'}
+	]
+
+	# No runs yet, the same columns
+	df_empty = summarize_runs(df_runs=to_runs_dataframe(records=[]))
+
+	assert df_empty.empty
+	assert df_empty.columns.tolist() == ['agent', 'runs', 'prompt_tokens', 'completion_tokens', 'total_tokens', 'tool_calls', 'latency', 'max_latency', 'models']
+	assert to_runs_dataframe(records=[]).dtypes.to_dict() == to_runs_dataframe(records=records).dtypes.to_dict()
+
+def test_budget_options_are_checked():
+
+	with pytest.raises(ValueError):
+		RunBudget(on_exceed='wait')
+
+	with pytest.raises(ValueError):
+		RunBudget(max_tokens=100, on_exceed='downgrade')
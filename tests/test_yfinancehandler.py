@@ -0,0 +1,361 @@
+import io
+import os
+import json
+import time
+import contextlib
+import pytest
+import pandas as pd
+import yfinancehandler
+from yfinancehandler import YFHandler, DriverPool
+from cachehandler import get_text_hash
+from fakeyfinance import FakeYFinance, load_fixture
+from fakebrowser import NewsServer, FakeDriver
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_cached_articles_are_not_fetched_and_stories_are_listed_once(tmp_cwd, monkeypatch):
+
+	yf_handler = YFHandler(stock_list=['MSFT', 'AAPL'], schemas={}, cache_dir=str(tmp_cwd / 'cache'))
+	yf_handler._cache.put_articles(dic_articles={'https://news.com/market': ('market story', get_text_hash('market story'))})
+
+	list_fetched = []
+
+	def fetch_articles_http(links, max_connections):
+		list_fetched.extend(links)
+		return {link: 'msft story' for link in links}
+
+	yf_handler._fetch_articles_http = fetch_articles_http
+	yf_handler._parse_article = lambda html: html
+
+	list_hashed = []
+
+	def text_hash(text):
+		list_hashed.append(text)
+		return get_text_hash(text)
+
+	monkeypatch.setattr(yfinancehandler, 'get_text_hash', text_hash)
+
+	dic_links = {
+		'MSFT': ['https://news.com/market?utm=msft', 'https://news.com/msft', 'https://other.com/msft-copy'],
+		'AAPL': ['https://news.com/market?utm=aapl']
+	}
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		dic_articles = yf_handler._get_articles(dic_links=dic_links)
+
+	assert sorted(list_fetched) == ['https://news.com/msft', 'https://other.com/msft-copy']
+
+	# Only the new articles are hashed, once each (for the cache and the dedup)
+	assert list_hashed == ['msft story', 'msft story']
+
+	# The same story under two urls is only listed once
+	assert dic_articles == {'MSFT': ['market story', 'msft story'], 'AAPL': ['market story']}
+
+def test_failed_tickers_are_kept_across_imports(tmp_cwd):
+
+	yf_handler = YFHandler(stock_list=['MSFT', 'AAPL'], schemas={}, max_retries=0, use_cache=False, cache_dir=str(tmp_cwd / 'cache'))
+
+	set_failing = {('AAPL', 'history'), ('MSFT', 'cashflow')}
+
+	def fetch_ticker(stock, attribute, **kwargs):
+		if (stock, attribute) in set_failing:
+			raise ValueError(f'no {attribute}')
+		return attribute
+
+	yf_handler._fetch_ticker_with_retry = fetch_ticker
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		yf_handler._fetch_all('history', period='5y')
+		yf_handler._fetch_all('cashflow')
+
+	assert yf_handler.failed_tickers == {'AAPL': {'history': 'no history'}, 'MSFT': {'cashflow': 'no cashflow'}}
+
+	# A ticker is cleared once the data that failed is fetched
+	set_failing.clear()
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		yf_handler._fetch_all('history', period='5y')
+
+	assert yf_handler.failed_tickers == {'MSFT': {'cashflow': 'no cashflow'}}
+
+def new_handler(monkeypatch, stock_list:list, yf_fake:FakeYFinance, **kwargs) -> YFHandler:
+
+	monkeypatch.setattr(yfinancehandler.yf, 'Tickers', yf_fake.Tickers)
+
+	with open(os.path.join(REPO_DIR, 'config', 'dataframe_schemas.json'), 'r') as f:
+		schemas = json.load(f)
+
+	return YFHandler(stock_list=stock_list, schemas=schemas, retry_wait=0, **{'use_cache': False, **kwargs})
+
+def test_import_stocks_from_fixtures_isolates_failed_tickers(tmp_cwd, monkeypatch):
+
+	yf_fake = FakeYFinance()
+	yf_handler = new_handler(monkeypatch, stock_list=['MSFT', 'DELISTED', 'AAPL'], yf_fake=yf_fake, max_retries=1)
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		df_stocks = yf_handler.import_stocks(period='5y')
+
+	# The ticker without data is retried, then left out without failing the others
+	assert yf_fake.count(stock='DELISTED') == 2
+	assert yf_handler.failed_tickers == {'DELISTED': {'history': 'DELISTED: no history data'}}
+
+	assert list(df_stocks.columns) == ['Date', 'Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits', 'Ticker']
+	assert df_stocks['Ticker'].tolist() == ['MSFT'] * 30 + ['AAPL'] * 30
+	assert df_stocks['Ticker'].dtype == 'category'
+	assert df_stocks['Close'].dtype == 'float64'
+	assert df_stocks['Volume'].dtype == 'Int64'
+
+	df_msft = df_stocks.loc[df_stocks['Ticker'] == 'MSFT', :]
+
+	assert df_msft['Close'].iloc[[0, -1]].tolist() == [370.0, 384.5]
+	assert df_msft['Dividends'].sum() == 0.75
+	assert df_stocks.loc[df_stocks['Ticker'] == 'AAPL', 'Close'].iloc[0] == 185.0
+
+def test_import_statements_retries_each_ticker(tmp_cwd, monkeypatch):
+
+	# AAPL's first request fails, the retry gets it
+	yf_fake = FakeYFinance(failures={('AAPL', 'quarterly_cashflow'): 1})
+	yf_handler = new_handler(monkeypatch, stock_list=['MSFT', 'AAPL'], yf_fake=yf_fake, max_retries=1)
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		df_cashflow = yf_handler.import_cashflow(period='quarter')
+
+	assert yf_fake.count(stock='AAPL', attribute='quarterly_cashflow') == 2
+	assert yf_fake.count(stock='MSFT', attribute='quarterly_cashflow') == 1
+	assert yf_handler.failed_tickers == {}
+
+	# One row per ticker and fiscal period, line items as columns
+	assert len(df_cashflow) == 10
+	assert df_cashflow['Date'].dtype.kind == 'M'
+
+	df_latest = df_cashflow.loc[df_cashflow['Date'] == '2024-12-31', :].set_index('Ticker')
+
+	assert df_latest.loc['MSFT', 'Free Cash Flow'] == 17.4e9
+	assert df_latest.loc['AAPL', 'Free Cash Flow'] == 17.4e9 * 1.5
+
+def test_import_statements_isolates_a_ticker_that_keeps_failing(tmp_cwd, monkeypatch):
+
+	yf_fake = FakeYFinance(failures={('MSFT', 'quarterly_income_stmt'): 5})
+	yf_handler = new_handler(monkeypatch, stock_list=['MSFT', 'AAPL'], yf_fake=yf_fake, max_retries=2)
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		df_income = yf_handler.import_income_stmt(period='quarter')
+
+	assert yf_fake.count(stock='MSFT') == 3
+	assert yf_handler.failed_tickers == {'MSFT': {'quarterly_income_stmt': 'MSFT: quarterly_income_stmt request failed'}}
+	assert df_income['Ticker'].unique().tolist() == ['AAPL']
+	assert len(df_income) == 5
+
+def test_statements_of_the_tickers_are_fetched_concurrently(tmp_cwd, monkeypatch):
+
+	yf_fake = FakeYFinance(delay=0.2)
+	yf_handler = new_handler(monkeypatch, stock_list=['MSFT', 'AAPL'], yf_fake=yf_fake)
+
+	start = time.perf_counter()
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		df_balance_sheet = yf_handler.import_balance_sheet(period='quarter')
+
+	# One after another would take 0.4 seconds
+	assert time.perf_counter() - start < 0.35
+	assert len(df_balance_sheet) == 10
+
+def test_history_is_refreshed_from_the_last_cached_bar(tmp_cwd, monkeypatch):
+
+	df_history = load_fixture('MSFT', 'history')
+
+	# The first import has 25 days, the next one 5 days more
+	yf_fake = FakeYFinance(frames={('MSFT', 'history'): df_history.iloc[0:25]})
+	yf_handler = new_handler(monkeypatch, stock_list=['MSFT'], yf_fake=yf_fake, use_cache=True, cache_dir=str(tmp_cwd / 'cache'))
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		yf_handler._fetch_all('history', period='5y')
+
+		yf_fake.frames[('MSFT', 'history')] = df_history
+		dic_history = yf_handler._fetch_all('history', period='5y')
+
+	# Only the bars from the last cached one are fetched, the last cached bar is replaced
+	assert [kwargs for _, _, kwargs in yf_fake.calls] == [
+		{'period': '5y', 'start': None},
+		{'period': None, 'start': df_history.index[24].strftime('%Y-%m-%d')}
+	]
+	pd.testing.assert_frame_equal(dic_history['MSFT'], df_history)
+
+	# A failed update uses the cached history
+	yf_fake.failures[('MSFT', 'history')] = 5
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		dic_history = yf_handler._fetch_all('history', period='5y')
+
+	pd.testing.assert_frame_equal(dic_history['MSFT'], df_history)
+	assert yf_handler.failed_tickers == {}
+
+def test_new_dividend_refetches_the_whole_history(tmp_cwd, monkeypatch):
+
+	df_history = load_fixture('MSFT', 'history')
+
+	# A dividend after the last cached bar adjusts every price before it
+	df_adjusted = df_history.copy()
+	df_adjusted.iloc[27, df_adjusted.columns.get_loc('Dividends')] = 0.83
+	df_adjusted['Close'] = df_adjusted['Close'] - 1
+
+	yf_fake = FakeYFinance(frames={('MSFT', 'history'): df_history.iloc[0:25]})
+	yf_handler = new_handler(monkeypatch, stock_list=['MSFT'], yf_fake=yf_fake, use_cache=True, cache_dir=str(tmp_cwd / 'cache'))
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		yf_handler._fetch_all('history', period='5y')
+
+		yf_fake.frames[('MSFT', 'history')] = df_adjusted
+		dic_history = yf_handler._fetch_all('history', period='5y')
+
+	assert [kwargs['period'] for _, _, kwargs in yf_fake.calls] == ['5y', None, '5y']
+	pd.testing.assert_frame_equal(dic_history['MSFT'], df_adjusted)
+
+	# The refetched history is cached
+	df_cached, _ = yf_handler._cache.get('history_5y', 'MSFT')
+	pd.testing.assert_frame_equal(df_cached, df_adjusted)
+
+def test_statements_are_only_refetched_when_a_new_period_can_exist(tmp_cwd, monkeypatch):
+
+	# The latest quarter of the MSFT fixture ended on 2024-12-31, so the next one can be out already
+	df_recent = load_fixture('AAPL', 'quarterly_cashflow')
+	df_recent.columns = [pd.Timestamp.now().normalize() - pd.DateOffset(months=1 + 3 * i) for i in range(len(df_recent.columns))]
+
+	yf_fake = FakeYFinance(frames={('AAPL', 'quarterly_cashflow'): df_recent})
+	yf_handler = new_handler(monkeypatch, stock_list=['MSFT', 'AAPL'], yf_fake=yf_fake, use_cache=True, cache_dir=str(tmp_cwd / 'cache'))
+
+	with contextlib.redirect_stdout(io.StringIO()):
+
+		yf_handler._fetch_all('quarterly_cashflow')
+
+		# Checked less than statement_recheck seconds ago
+		yf_handler._fetch_all('quarterly_cashflow')
+
+		assert yf_fake.count(stock='MSFT') == 1
+
+		yf_handler.statement_recheck = 0
+		dic_cashflow = yf_handler._fetch_all('quarterly_cashflow')
+
+	assert yf_fake.count(stock='MSFT') == 2
+
+	# The next quarter of AAPL hasn't ended yet, it's never refetched
+	assert yf_fake.count(stock='AAPL') == 1
+	pd.testing.assert_frame_equal(dic_cashflow['AAPL'], df_recent)
+
+@pytest.fixture
+def news_server():
+	news_server = NewsServer()
+	yield news_server
+	news_server.close()
+
+FED_RATES_TEXT = 'The Federal Reserve left rates unchanged on Wednesday.\nMarkets rose after the decision.'
+MSFT_EARNINGS_TEXT = 'Microsoft reported revenue of $69.6 billion.\nCloud revenue grew 21%.'
+MSFT_CLOUD_TEXT = 'Azure grew 31% in the quarter, below estimates.'
+MSFT_AI_TEXT = 'Microsoft will spend $80 billion on data centers this year.'
+MSFT_DIVIDEND_TEXT = 'The quarterly dividend rises to $0.83 per share.'
+AAPL_IPHONE_TEXT = 'Apple sold more iPhones in China than a year ago.'
+
+def test_articles_are_fetched_and_parsed_over_http(tmp_cwd, news_server):
+
+	yf_handler = YFHandler(stock_list=['MSFT'], schemas={}, use_cache=False)
+	base_url = news_server.base_url
+
+	links = [f'{base_url}/articles/fed-rates.html?.tsrc=fin-srch', f'{base_url}/articles/msft-ai.html', f'{base_url}/articles/removed.html']
+
+	with contextlib.redirect_stdout(io.StringIO()) as stdout:
+		dic_html = yf_handler._fetch_articles_http(links=links, max_connections=2)
+
+	# The 404 is left out
+	assert sorted(dic_html) == sorted(links[0:2])
+	assert f'{base_url}/articles/removed.html could not be fetched over HTTP' in stdout.getvalue()
+
+	# Only the paragraphs of the article body, not the rest of the page
+	assert yf_handler._parse_article(dic_html[links[0]]) == FED_RATES_TEXT
+
+	# The body of this one is put in the page with JavaScript
+	assert yf_handler._parse_article(dic_html[links[1]]) is None
+
+def new_driver_pool(size:int=2):
+
+	list_drivers = []
+
+	def driver_factory():
+		driver = FakeDriver(page_size=3)
+		list_drivers.append(driver)
+		return driver
+
+	return DriverPool(size=size, driver_factory=driver_factory), list_drivers
+
+def test_news_links_are_extracted_while_scrolling(tmp_cwd, news_server):
+
+	yf_handler = YFHandler(stock_list=['MSFT', 'AAPL'], schemas={}, use_cache=False)
+	base_url = news_server.base_url
+	dic_urls = {stock: f'{base_url}/quote/{stock}/news.html' for stock in ['MSFT', 'AAPL']}
+
+	driver_pool, list_drivers = new_driver_pool()
+
+	start = time.perf_counter()
+	dic_links = yf_handler._get_news_links(dic_urls=dic_urls, driver_pool=driver_pool, max_links=10, wait_timeout=0.3)
+
+	# Links of news titles in the order of the page, the thumbnail link and the repeated story are skipped
+	assert dic_links == {
+		'MSFT': [
+			f'{base_url}/articles/fed-rates.html?.tsrc=fin-srch',
+			f'{base_url}/articles/msft-earnings.html',
+			f'{base_url}/articles/msft-cloud.html',
+			f'{base_url}/articles/removed.html',
+			f'{base_url}/articles/msft-ai.html',
+			f'{base_url}/articles/msft-dividend.html'
+		],
+		'AAPL': [f'{base_url}/articles/fed-rates.html?.tsrc=aapl', f'{base_url}/articles/aapl-iphone.html']
+	}
+
+	# The pages ran out of news before max_links, each one waited once for items that never came
+	assert time.perf_counter() - start < 1.5
+	assert len(list_drivers) == 2
+	assert sorted(driver.scrolls for driver in list_drivers) == [2, 3]
+
+	# The drivers are kept for the next call and closed with the pool
+	dic_links_max = yf_handler._get_news_links(dic_urls={'MSFT': dic_urls['MSFT']}, driver_pool=driver_pool, max_links=5, wait_timeout=0.3)
+
+	assert dic_links_max == {'MSFT': dic_links['MSFT'][0:5]}
+	assert len(list_drivers) == 2
+
+	driver_pool.close()
+
+	assert all(driver.closed for driver in list_drivers)
+
+def test_articles_are_fetched_once_and_javascript_pages_use_the_driver(tmp_cwd, news_server):
+
+	yf_handler = YFHandler(stock_list=['MSFT', 'AAPL'], schemas={}, cache_dir=str(tmp_cwd / 'cache'))
+	base_url = news_server.base_url
+	dic_urls = {stock: f'{base_url}/quote/{stock}/news.html' for stock in ['MSFT', 'AAPL']}
+
+	driver_pool, list_drivers = new_driver_pool()
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		dic_links = yf_handler._get_news_links(dic_urls=dic_urls, driver_pool=driver_pool, wait_timeout=0.3)
+		dic_articles = yf_handler._get_articles(dic_links=dic_links, driver_pool=driver_pool, wait_timeout=1)
+
+	# The removed story has no text, the story of both stocks is fetched once
+	assert dic_articles == {
+		'MSFT': [FED_RATES_TEXT, MSFT_EARNINGS_TEXT, MSFT_CLOUD_TEXT, MSFT_AI_TEXT, MSFT_DIVIDEND_TEXT],
+		'AAPL': [FED_RATES_TEXT, AAPL_IPHONE_TEXT]
+	}
+
+	assert news_server.count('/articles/fed-rates.html') == 1
+	assert news_server.count('/articles/removed.html') == 2
+
+	# Over HTTP first, then with a driver that runs the JavaScript
+	assert news_server.count('/articles/msft-ai.html') == 2
+	assert sum(driver.urls.count(f'{base_url}/articles/msft-ai.html') for driver in list_drivers) == 1
+
+	# The next time the articles come from the cache, only the removed story is tried again
+	n_requests = len(news_server.requests)
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		assert yf_handler._get_articles(dic_links=dic_links, driver_pool=driver_pool, wait_timeout=0.2) == dic_articles
+
+	assert news_server.requests[n_requests:] == ['/articles/removed.html', '/articles/removed.html']
+
+	driver_pool.close()
@@ -0,0 +1,353 @@
+import os
+import json
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+import httpx
+
+# The span that is running in the current thread / asyncio task, new spans become its children
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+class Span():
+
+	"""
+	One timed operation, i.e. a node run, an agent turn or an upload.
+	attributes hold what it was about (node, agent, node_run_id, tokens, bytes, ...).
+	Times are in nanoseconds since the epoch, like OpenTelemetry.
+	"""
+
+	def __init__(self, name:str, trace_id:str, parent_id:str=None, attributes:dict=None):
+
+		self.name = name
+		self.trace_id = trace_id
+		self.span_id = os.urandom(8).hex()
+		self.parent_id = parent_id
+		self.attributes = attributes or {}
+		self.status = 'ok'
+		self.error = None
+		self.thread = threading.current_thread().name
+		self.start_time = time.time_ns()
+		self.end_time = None
+
+		self._start = time.perf_counter()
+
+	@property
+	def duration(self) -> float:
+
+		# Seconds, None while the span is running
+		if self.end_time is None:
+			return None
+
+		return (self.end_time - self.start_time) / 1e9
+
+	def set(self, **attributes):
+		self.attributes.update(attributes)
+
+	def add(self, key:str, value:float):
+
+		# For counters, i.e. span.add('total_tokens', 120) on every run of an agent turn
+		self.attributes[key] = self.attributes.get(key, 0) + value
+
+	def _finish(self):
+		self.end_time = self.start_time + int((time.perf_counter() - self._start) * 1e9)
+
+	def to_dict(self) -> dict:
+
+		return {
+			'name': self.name,
+			'trace_id': self.trace_id,
+			'span_id': self.span_id,
+			'parent_id': self.parent_id,
+			'start_time': self.start_time,
+			'end_time': self.end_time,
+			'duration': self.duration,
+			'status': self.status,
+			'error': self.error,
+			'thread': self.thread,
+			'attributes': self.attributes
+		}
+
+class _NoopSpan():
+
+	# Given out when tracing is disabled
+	def set(self, **attributes):
+		pass
+
+	def add(self, key:str, value:float):
+		pass
+
+_NOOP_SPAN = _NoopSpan()
+
+def _to_otlp_value(value) -> dict:
+
+	if isinstance(value, bool):
+		return {'boolValue': value}
+	elif isinstance(value, int):
+		return {'intValue': str(value)}
+	elif isinstance(value, float):
+		return {'doubleValue': value}
+
+	return {'stringValue': str(value)}
+
+class Tracer():
+
+	"""
+	Collects the spans of the process (the last max_spans of them).
+	A span started inside another span is its child, spans without a parent start a new trace
+	(i.e. one trace per MultiNodeManager.run()).
+	"""
+
+	def __init__(self, max_spans:int=100000, enabled:bool=True):
+
+		self.enabled = enabled
+		self._spans = deque(maxlen=max_spans)
+		self._lock = threading.Lock()
+
+	@contextmanager
+	def span(self, name:str, **attributes):
+
+		if not self.enabled:
+			yield _NOOP_SPAN
+			return
+
+		parent = _current_span.get()
+
+		span = Span(
+			name=name,
+			trace_id=parent.trace_id if parent is not None else os.urandom(16).hex(),
+			parent_id=parent.span_id if parent is not None else None,
+			attributes=attributes
+		)
+
+		token = _current_span.set(span)
+
+		try:
+			yield span
+		except BaseException as e:
+			span.status = 'error'
+			span.error = repr(e)
+			raise
+		finally:
+			_current_span.reset(token)
+			span._finish()
+
+			with self._lock:
+				self._spans.append(span)
+
+	def record(self, name:str, duration:float, **attributes):
+
+		"""
+		Adds a span that just ended and took duration seconds, for waits that are only known after the fact.
+		"""
+
+		if not self.enabled:
+			return
+
+		parent = _current_span.get()
+
+		span = Span(
+			name=name,
+			trace_id=parent.trace_id if parent is not None else os.urandom(16).hex(),
+			parent_id=parent.span_id if parent is not None else None,
+			attributes=attributes
+		)
+
+		span.end_time = span.start_time
+		span.start_time -= int(duration * 1e9)
+
+		with self._lock:
+			self._spans.append(span)
+
+	def get_spans(self, trace_id:str=None) -> list[Span]:
+
+		with self._lock:
+			spans = list(self._spans)
+
+		if trace_id is not None:
+			spans = [span for span in spans if span.trace_id == trace_id]
+
+		return spans
+
+	def get_trace_ids(self) -> list:
+
+		# Oldest first, by the start of the trace's root span
+		roots = sorted((span for span in self.get_spans() if span.parent_id is None), key=lambda span: span.start_time)
+
+		return list(dict.fromkeys(span.trace_id for span in roots))
+
+	def clear(self):
+
+		with self._lock:
+			self._spans.clear()
+
+	def export_jsonl(self, path:str, trace_id:str=None):
+
+		"""
+		Appends the spans (default: all of them) to path, one JSON object per line.
+		"""
+
+		with open(path, 'a') as f:
+			for span in self.get_spans(trace_id=trace_id):
+				f.write(json.dumps(span.to_dict(), default=str) + '\n')
+
+	def to_otlp(self, trace_id:str=None, service_name:str='stock_rag') -> dict:
+
+		# OTLP/HTTP JSON (ExportTraceServiceRequest)
+		spans = [
+			{
+				'traceId': span.trace_id,
+				'spanId': span.span_id,
+				'parentSpanId': span.parent_id or '',
+				'name': span.name,
+				'kind': 1,
+				'startTimeUnixNano': str(span.start_time),
+				'endTimeUnixNano': str(span.end_time),
+				'attributes': [{'key': key, 'value': _to_otlp_value(value)} for key, value in {**span.attributes, 'thread.name': span.thread}.items()],
+				'status': {'code': 2, 'message': span.error} if span.status == 'error' else {}
+			} for span in self.get_spans(trace_id=trace_id) if span.end_time is not None
+		]
+
+		return {
+			'resourceSpans': [{
+				'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': service_name}}]},
+				'scopeSpans': [{'scope': {'name': 'stock_rag.tracing'}, 'spans': spans}]
+			}]
+		}
+
+	def export_otlp(self, endpoint:str='http://localhost:4318/v1/traces', trace_id:str=None, service_name:str='stock_rag', timeout:float=10):
+
+		"""
+		Sends the spans to an OpenTelemetry collector (OTLP over HTTP, JSON), i.e. a local collector or Jaeger.
+		"""
+
+		response = httpx.post(endpoint, json=self.to_otlp(trace_id=trace_id, service_name=service_name), timeout=timeout)
+		response.raise_for_status()
+
+	def _get_critical_path(self, span:Span, dic_children:dict, depth:int=0) -> list:
+
+		# Going back from the end of the span, the child that ended last is what the span was waiting for,
+		# before that child started, the child that ended last before it, and so on
+		children = dic_children.get(span.span_id, [])
+		cursor = span.end_time
+		chain = []
+
+		while True:
+
+			candidates = [child for child in children if child.end_time <= cursor]
+
+			if len(candidates) == 0:
+				break
+
+			child = max(candidates, key=lambda child: child.end_time)
+			chain.append(child)
+
+			cursor = child.start_time
+			children = [other for other in candidates if other is not child]
+
+		# Time of the span that isn't spent in the children on the path
+		exclusive_time = span.duration - sum(child.duration for child in chain)
+
+		path = [(span, depth, exclusive_time)]
+
+		for child in reversed(chain):
+			path += self._get_critical_path(span=child, dic_children=dic_children, depth=depth+1)
+
+		return path
+
+	def get_critical_path(self, trace_id:str=None) -> list:
+
+		"""
+		Returns the spans on the critical path of a trace (default: the latest one) as [(span, depth, exclusive seconds)].
+		Making a span on the critical path faster makes the whole run faster, making any other span faster doesn't.
+		"""
+
+		if trace_id is None:
+			trace_ids = self.get_trace_ids()
+
+			if len(trace_ids) == 0:
+				return []
+
+			trace_id = trace_ids[-1]
+
+		spans = [span for span in self.get_spans(trace_id=trace_id) if span.end_time is not None]
+
+		dic_children = {}
+
+		for span in spans:
+			dic_children.setdefault(span.parent_id, []).append(span)
+
+		roots = dic_children.get(None, [])
+
+		if len(roots) == 0:
+			return []
+
+		return self._get_critical_path(span=max(roots, key=lambda span: span.duration), dic_children=dic_children)
+
+	def critical_path_report(self, trace_id:str=None) -> str:
+
+		"""
+		Summary of where the time of a run went: the critical path, and its exclusive time per span name.
+		"""
+
+		critical_path = self.get_critical_path(trace_id=trace_id)
+
+		if len(critical_path) == 0:
+			return 'No finished trace'
+
+		root = critical_path[0][0]
+
+		lines = [f'Critical path of {root.name} (trace {root.trace_id}): {root.duration:.2f}s']
+
+		for span, depth, exclusive_time in critical_path:
+
+			attributes = ', '.join(f'{key}={value}' for key, value in span.attributes.items())
+
+			lines.append(f"{'  ' * depth}{span.name} {span.duration:.2f}s (own {exclusive_time:.2f}s){' ' + attributes if attributes else ''}")
+
+		dic_time = {}
+
+		for span, _, exclusive_time in critical_path:
+			dic_time[span.name] = dic_time.get(span.name, 0) + exclusive_time
+
+		lines.append('Time on the critical path by span:')
+
+		for name, exclusive_time in sorted(dic_time.items(), key=lambda item: -item[1]):
+			lines.append(f'  {name}: {exclusive_time:.2f}s ({exclusive_time / root.duration:.0%})')
+
+		return '\n'.join(lines)
+
+# The tracer every module uses
+_tracer = Tracer()
+
+def get_tracer() -> Tracer:
+	return _tracer
+
+def span(name:str, **attributes):
+
+	"""
+	with span('agent_turn', agent=agent.assistant_name) as s:
+		...
+		s.set(total_tokens=120)
+	"""
+
+	return _tracer.span(name, **attributes)
+
+def current_span():
+	return _current_span.get() or _NOOP_SPAN
+
+def propagate(func):
+
+	"""
+	Wraps func so that it runs in the context of the caller, i.e. for functions given to a ThreadPoolExecutor or a Thread.
+	Without it the spans in the worker thread would start their own trace instead of being children of the caller's span.
+	"""
+
+	context = contextvars.copy_context()
+
+	# A context can't be entered by two threads at once, so every call gets its own copy
+	def run_in_context(*args, **kwargs):
+		return context.copy().run(func, *args, **kwargs)
+
+	return run_in_context
@@ -0,0 +1,140 @@
+import time
+import threading
+import pandas as pd
+
+# Columns of a thread's run records (ThreadManager.df_runs)
+RUN_COLUMNS = {
+	'run_id': 'str',
+	'assistant_id': 'str',
+	'agent': 'str',
+	'node_run_id': 'Int64',
+	'model': 'str',
+	'status': 'str',
+	'prompt_tokens': 'int',
+	'completion_tokens': 'int',
+	'total_tokens': 'int',
+	'latency': 'float',
+	'tool_calls': 'int',
+	'created_at': 'float'
+}
+
+def to_runs_dataframe(records:list[dict], extra_columns:dict={}) -> pd.DataFrame:
+
+	# records are dicts with the keys of RUN_COLUMNS (and extra_columns)
+	schema = {**extra_columns, **RUN_COLUMNS}
+
+	return pd.DataFrame(records, columns=list(schema.keys())).astype(schema)
+
+def summarize_runs(df_runs:pd.DataFrame, by:list=['agent']) -> pd.DataFrame:
+
+	"""
+	Sums the runs in df_runs per by (i.e. ['node', 'agent']):
+	number of runs, tokens, tool calls, total and max latency, and the models used.
+	"""
+
+	if df_runs.empty:
+		return pd.DataFrame(columns=by + ['runs', 'prompt_tokens', 'completion_tokens', 'total_tokens', 'tool_calls', 'latency', 'max_latency', 'models'])
+
+	return df_runs.groupby(by, sort=False).agg(
+		runs=('run_id', 'count'),
+		prompt_tokens=('prompt_tokens', 'sum'),
+		completion_tokens=('completion_tokens', 'sum'),
+		total_tokens=('total_tokens', 'sum'),
+		tool_calls=('tool_calls', 'sum'),
+		latency=('latency', 'sum'),
+		max_latency=('latency', 'max'),
+		models=('model', lambda models: ', '.join(dict.fromkeys(models)))
+	).reset_index()
+
+class BudgetExceededError(Exception):
+
+	# Raised before a run when the budget is used up and on_exceed is 'stop'
+	pass
+
+class RunBudget():
+
+	"""
+	Token and time ceiling of a run (i.e. one MultiNodeManager.run()), shared by every thread of the run.
+	Every thread checks it before starting an agent run:
+	- once downgrade_at (a fraction) of max_tokens or max_seconds is used, the runs use downgrade_model instead of the assistant's model
+	- once max_tokens or max_seconds is reached, BudgetExceededError is raised (on_exceed='stop')
+	  or the runs carry on with downgrade_model (on_exceed='downgrade')
+	A run that already started is not stopped, so the ceiling can be passed by the last runs.
+	"""
+
+	def __init__(
+			self,
+			max_tokens:int=None,
+			max_seconds:float=None,
+			downgrade_model:str=None,
+			downgrade_at:float=0.8,
+			on_exceed:str='stop'
+			):
+
+		if on_exceed not in ('stop', 'downgrade'):
+			raise ValueError(f'Unknown on_exceed: {on_exceed}')
+
+		if on_exceed == 'downgrade' and downgrade_model is None:
+			raise ValueError("downgrade_model is needed with on_exceed='downgrade'")
+
+		self.max_tokens = max_tokens
+		self.max_seconds = max_seconds
+		self.downgrade_model = downgrade_model
+		self.downgrade_at = downgrade_at
+		self.on_exceed = on_exceed
+
+		self._lock = threading.Lock()
+		self.start()
+
+	def start(self):
+
+		# Called by MultiNodeManager.run(), the budget counts from here
+		with self._lock:
+			self.tokens = 0
+			self.runs = 0
+			self.downgraded_runs = 0
+			self._start = time.monotonic()
+
+	@property
+	def elapsed(self) -> float:
+		return time.monotonic() - self._start
+
+	@property
+	def used(self) -> float:
+
+		# Fraction of the budget used, the larger of tokens and time
+		used_tokens = self.tokens / self.max_tokens if self.max_tokens else 0
+		used_time = self.elapsed / self.max_seconds if self.max_seconds else 0
+
+		return max(used_tokens, used_time)
+
+	def get_model(self) -> str:
+
+		"""
+		Checks the budget before a run.
+		Returns the model the run should use instead of the assistant's, None to keep the assistant's model.
+		"""
+
+		used = self.used
+
+		if used >= 1 and self.on_exceed == 'stop':
+			raise BudgetExceededError(
+				f'Run budget exceeded: {self.tokens} tokens (max {self.max_tokens}), {self.elapsed:.1f} seconds (max {self.max_seconds})'
+			)
+
+		if used >= self.downgrade_at and self.downgrade_model is not None:
+
+			with self._lock:
+				self.downgraded_runs += 1
+
+			print(f'Run budget {used:.0%} used, running with {self.downgrade_model}')
+
+			return self.downgrade_model
+
+		return None
+
+	def record(self, tokens:int):
+
+		with self._lock:
+			self.tokens += tokens
+			self.runs += 1
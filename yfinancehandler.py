@@ -1,270 +1,853 @@
+import os
+import json
+import importlib.util
 import time
+import threading
 import pandas as pd
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 import re
 import yfinance as yf
 from typing import Literal
-from bs4 import BeautifulSoup
+import asyncio
+import httpx
+from contextlib import contextmanager
+from bs4 import BeautifulSoup, SoupStrainer
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from selenium.webdriver.common.action_chains import ActionChains
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+from tracing import span, propagate
+from cachehandler import CacheHandler, normalize_url, get_text_hash
+
+# Length of each history period, used to trim cached price history to the period
+# None means the whole history is kept. Periods not in here ('1d', '5d', 'ytd') are not cached
+_HISTORY_PERIODS = {
+	'1mo': pd.DateOffset(months=1),
+	'3mo': pd.DateOffset(months=3),
+	'6mo': pd.DateOffset(months=6),
+	'1y': pd.DateOffset(years=1),
+	'2y': pd.DateOffset(years=2),
+	'5y': pd.DateOffset(years=5),
+	'10y': pd.DateOffset(years=10),
+	'max': None
+}
+
+# Months between fiscal periods of each statement
+_STATEMENT_PERIODS = {
+	'cashflow': 12,
+	'income_stmt': 12,
+	'balance_sheet': 12,
+	'quarterly_cashflow': 3,
+	'quarterly_income_stmt': 3,
+	'quarterly_balance_sheet': 3
+}
+
+# lxml is a lot faster than Python's html.parser, it's used if it's installed
+HTML_PARSER = 'lxml' if importlib.util.find_spec('lxml') is not None else 'html.parser'
+
+# News items on Yahoo news pages
+STREAM_ITEM_SELECTOR = 'ul[class^="stream-items"] > li'
+
+# Returns the outer HTML of the stream items after the first arguments[1] items
+_NEW_STREAM_ITEMS_JS = 'return Array.from(document.querySelectorAll(arguments[0])).slice(arguments[1]).map(e => e.outerHTML);'
+_COUNT_STREAM_ITEMS_JS = 'return document.querySelectorAll(arguments[0]).length;'
+
+# Compiled once instead of on every parse
+_NEWS_LINK_CLASS = re.compile(r'^subtle-link fin-size-small titles')
+_ARTICLE_BODY_WRAP_CLASS = re.compile(r'^body-wrap')
+_ARTICLE_BODY_CLASS = re.compile(r'^body')
+_NEWS_LINK_STRAINER = SoupStrainer('a', class_=_NEWS_LINK_CLASS)
+# The strainer sees the whole class attribute (i.e. "caas-body body-wrap"), so it looks for any class starting with body-wrap
+_ARTICLE_STRAINER = SoupStrainer('div', class_=re.compile(r'(^|\s)body-wrap'))
+
+# Yahoo doesn't serve pages to clients that don't look like a browser
+HTTP_HEADERS = {
+	'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36',
+	'Accept-Language': 'en-US,en;q=0.9'
+}
+
+def _run_async(coroutine):
+
+	# Jupyter already runs an event loop, then the coroutine is run in its own thread
+	try:
+		asyncio.get_running_loop()
+	except RuntimeError:
+		return asyncio.run(coroutine)
+
+	with ThreadPoolExecutor(max_workers=1) as executor:
+		return executor.submit(propagate(asyncio.run), coroutine).result()
+
+def _new_headless_chrome() -> webdriver.Chrome:
+
+	options = webdriver.ChromeOptions()
+	options.add_argument('--headless=new')
+	options.add_argument(f"--user-agent={HTTP_HEADERS['User-Agent']}")
+
+	return webdriver.Chrome(options=options)
+
+class DriverPool():
+
+	"""
+	A bounded pool of (headless Chrome) drivers, at most size drivers are open at the same time.
+	Drivers are only started when they're needed and are reused until close() is called.
+	"""
+
+	def __init__(self, size:int=2, driver_factory=_new_headless_chrome):
+
+		self.size = size
+		self._driver_factory = driver_factory
+		self._idle_drivers = []
+		self._all_drivers = []
+		self._semaphore = threading.BoundedSemaphore(size)
+		self._lock = threading.Lock()
+
+	@contextmanager
+	def driver(self):
+
+		"""Borrow a driver, waits if all drivers are in use."""
+
+		self._semaphore.acquire()
+
+		try:
+			with self._lock:
+				driver = self._idle_drivers.pop() if self._idle_drivers else None
+
+			if driver is None:
+				driver = self._driver_factory()
+
+				with self._lock:
+					self._all_drivers.append(driver)
+
+			try:
+				yield driver
+			finally:
+				with self._lock:
+					self._idle_drivers.append(driver)
+
+		finally:
+			self._semaphore.release()
+
+	def close(self):
+
+		with self._lock:
+			for driver in self._all_drivers:
+				try:
+					driver.quit()
+				except WebDriverException:
+					pass
+
+			self._idle_drivers = []
+			self._all_drivers = []
+
+class StockInfo(Mapping):
+
+	"""
+	Info of each ticker {stock: {'industry': ..., 'sector': ..., ...}}.
+	Nothing is fetched until the info is first accessed, then all tickers are fetched at once (concurrently).
+	The info is cached on disk in cache_file, cached info older than ttl seconds is fetched again.
+	"""
+
+	# Valuation fields are used by FeatureHandler
+	keys_to_keep = ['industry', 'sector', 'fulltime', 'shortName', 'longName', 'marketCap', 'sharesOutstanding', 'trailingPE', 'forwardPE', 'priceToBook']
+
+	def __init__(self, yf_handler:'YFHandler', cache_file:str, ttl:int=86400):
+
+		self._yf_handler = yf_handler
+		self._cache_file = cache_file
+		self._ttl = ttl
+		self._data = None
+		self._lock = threading.Lock()
+
+	def _read_cache(self) -> dict:
+
+		try:
+			with open(self._cache_file, 'r') as f:
+				return json.load(f)
+		except (FileNotFoundError, json.JSONDecodeError):
+			return {}
+
+	def _write_cache(self, dic_cache:dict):
+
+		os.makedirs(os.path.dirname(self._cache_file) or '.', exist_ok=True)
+
+		with open(self._cache_file, 'w') as f:
+			json.dump(dic_cache, f, indent='\t')
+
+	def prefetch(self, refresh:bool=False):
+
+		"""
+		Loads the info of all tickers, only tickers which aren't cached (or expired) are fetched.
+		If refresh is True, all tickers are fetched again.
+		"""
+
+		with self._lock:
+
+			dic_cache = self._read_cache()
+			now = time.time()
+
+			list_to_fetch = [
+				stock for stock in self._yf_handler.stock_list 
+				if refresh or stock not in dic_cache or now - dic_cache[stock]['fetched_at'] > self._ttl
+			]
+
+			if len(list_to_fetch) > 0:
+
+				print(f'Fetching info of {len(list_to_fetch)} tickers')
+
+				dic_info = self._yf_handler._fetch_all('info', stock_list=list_to_fetch)
+
+				for stock, dic_stock_info in dic_info.items():
+					dic_cache[stock] = {
+						'fetched_at': now,
+						'info': {key: dic_stock_info[key] for key in self.keys_to_keep if key in dic_stock_info}
+					}
+
+				self._write_cache(dic_cache)
+
+			# Tickers that failed have empty info
+			self._data = {stock: dic_cache[stock]['info'] if stock in dic_cache else {} for stock in self._yf_handler.stock_list}
+
+	def _load(self) -> dict:
+
+		if self._data is None:
+			self.prefetch()
+
+		return self._data
+
+	def __getitem__(self, stock:str) -> dict:
+		return self._load()[stock]
+
+	def __iter__(self):
+		return iter(self._load())
+
+	def __len__(self) -> int:
+		return len(self._load())
 
 class YFHandler():
-	def __init__(self, stock_list: list, schemas: dict):
+	def __init__(
+			self, 
+			stock_list: list, 
+			schemas: dict, 
+			max_workers:int=8, 
+			max_retries:int=2, 
+			retry_wait:float=1, 
+			float_dtype:Literal['float64', 'float32']='float64',
+			cache_dir:str='cache/',
+			info_ttl:int=86400,
+			use_cache:bool=True,
+			statement_recheck:int=86400
+			):
+
+		"""
+		stock_info is only fetched when it's first used (or with prefetch_info()) and is cached in cache_dir for info_ttl seconds.
+		If use_cache is True, price history and statements are also cached in cache_dir.
+		Price history is then only fetched after the last cached bar, and statements are only fetched
+		when a new fiscal period could exist (checked at most once every statement_recheck seconds).
+		float_dtype is the dtype of the 'float' columns in the schemas, float32 halves the memory of the data.
+		Data of multiple tickers is fetched concurrently with at most max_workers requests at a time.
+		A ticker that fails is retried max_retries times (waiting retry_wait, 2*retry_wait, ... seconds),
+		if it still fails it's left out of the result and recorded in self.failed_tickers, until a later fetch of the same data succeeds.
+		"""
 		
 		self.stocks = yf.Tickers(stock_list)
 		self.stock_list = stock_list
 		self.schemas = schemas
-		self.stock_info = {}
+		self.max_workers = max_workers
+		self.max_retries = max_retries
+		self.retry_wait = retry_wait
+		self.float_dtype = float_dtype
+		self.statement_recheck = statement_recheck
+
+		if use_cache:
+			self._cache = CacheHandler(db_path=os.path.join(cache_dir, 'yfinance.db'))
+		else:
+			self._cache = None
 
-		keys_to_keep = ['industry', 'sector', 'fulltime', 'shortName', 'longName']
+		# Tickers that failed in any import, with what failed {stock: {attribute: error message}}
+		self.failed_tickers = {}
 
-		for stock in stock_list:
-			
-			dic_stock_info = self.stocks.tickers[stock].info
-			
-			self.stock_info[stock] = {key: dic_stock_info[key] for key in keys_to_keep if key in dic_stock_info}
-	
-	def import_stocks(self, period:Literal['1d', '5d', '1mo', '3mo', '6mo', '1y', '2y', '5y', '10y', 'ytd', 'max']='5y'):
+		self.stock_info = StockInfo(yf_handler=self, cache_file=os.path.join(cache_dir, 'stock_info.json'), ttl=info_ttl)
 
-		df = pd.DataFrame(columns=dict(self.schemas['stocks']))
+	def prefetch_info(self, refresh:bool=False) -> StockInfo:
 
-		for stock in self.stock_list:
+		"""Fetches the info of all tickers now instead of when stock_info is first used."""
 
-			df_plc = self.stocks.tickers[stock].history(period=period).reset_index()
-			df_plc['Ticker'] = stock
+		self.stock_info.prefetch(refresh=refresh)
 
-			df = pd.concat([df, df_plc], ignore_index=True)
+		return self.stock_info
 
-		return df
+	def _fetch_ticker(self, stock:str, attribute:str, **kwargs):
 
-	def import_cashflow(self, period:Literal['year', 'quarter']='quarter'):
+		"""
+		Gets the data of one ticker from yfinance, i.e. _fetch_ticker('MSFT', 'history', period='5y').
+		This is the only place the import methods request data from yfinance,
+		so it can be replaced to import from recorded data instead.
+		"""
 
-		df = pd.DataFrame(columns=dict(self.schemas['cashflow']))
+		with span('yfinance_fetch', ticker=stock, attribute=attribute) as fetch_span:
 
-		if period=='year':
-			for stock in self.stock_list:
+			data = getattr(self.stocks.tickers[stock], attribute)
 
-				df_plc = self.stocks.tickers[stock].cashflow.T.reset_index()
-				df_plc.rename(columns={'index': 'Date'},inplace=True)
-				df_plc['Ticker'] = stock
+			# Properties (i.e. quarterly_cashflow) are already the data, methods (i.e. history) have to be called
+			if callable(data):
+				data = data(**kwargs)
 
-				df = pd.concat([df, df_plc], ignore_index=True)
-		elif period=='quarter':
-			for stock in self.stock_list:
+			if isinstance(data, (pd.DataFrame, pd.Series)):
+				fetch_span.set(rows=len(data))
+
+		return data
+
+	def _fetch_ticker_with_retry(self, stock:str, attribute:str, **kwargs):
+
+		for attempt in range(self.max_retries+1):
+			try:
+				return self._fetch_ticker(stock, attribute, **kwargs)
+
+			except Exception as e:
+				if attempt == self.max_retries:
+					raise
+
+				wait_time = self.retry_wait * 2**attempt
+				print(f'{stock}: {attribute} failed ({e}), retrying in {wait_time} seconds')
+
+				with span('sleep', reason='yfinance_retry', ticker=stock, attempt=attempt):
+					time.sleep(wait_time)
+
+	def _get_history_cached(self, stock:str, period:str='5y') -> pd.DataFrame:
+
+		dataset = f'history_{period}'
+
+		df_cached, _ = self._cache.get(dataset, stock)
+
+		if df_cached is None or df_cached.empty:
+			df = self._fetch_ticker_with_retry(stock, 'history', period=period)
+			self._cache.put(dataset, stock, df)
+			return df
+
+		last_date = df_cached.index.max()
 
-				df_plc = self.stocks.tickers[stock].quarterly_cashflow.T.reset_index()
-				df_plc.rename(columns={'index': 'Date'},inplace=True)
-				df_plc['Ticker'] = stock
+		try:
+			# Fetch again from the last cached bar, because it may have been fetched before the market closed
+			df_new = self._fetch_ticker_with_retry(stock, 'history', start=last_date.strftime('%Y-%m-%d'))
+		except Exception as e:
+			print(f'{stock}: history update failed, using cached data ({e})')
+			return df_cached
+
+		# Prices are adjusted for dividends and splits, a new one changes the whole history
+		df_actions = df_new.loc[df_new.index > last_date, :].reindex(columns=['Dividends', 'Stock Splits']).fillna(0)
+
+		if (df_actions != 0).any().any():
+			print(f'{stock}: new dividend or split, fetching the whole history')
+			df = self._fetch_ticker_with_retry(stock, 'history', period=period)
+
+		elif df_new.empty:
+			df = df_cached
 
-				df = pd.concat([df, df_plc], ignore_index=True)
 		else:
-			raise ValueError("period argument has to be either 'year' or 'quarter'")
-		
+			df = pd.concat([df_cached.loc[df_cached.index < df_new.index.min(), :], df_new])
+
+			if _HISTORY_PERIODS[period] is not None:
+				df = df.loc[df.index >= df.index.max() - _HISTORY_PERIODS[period], :]
+
+		self._cache.put(dataset, stock, df)
+
 		return df
-	
-	def import_income_stmt(self, period:Literal['year', 'quarter']='quarter'):
-		
-		df = pd.DataFrame(columns=dict(self.schemas['income_stmt']))
 
-		if period=='year':
-			for stock in self.stock_list:
-				
-				df_plc = self.stocks.tickers[stock].income_stmt.T.reset_index()
-				df_plc.rename(columns={'index': 'Date'},inplace=True)
-				df_plc['Ticker'] = stock
+	def _get_statement_cached(self, stock:str, attribute:str) -> pd.DataFrame:
 
-				df = pd.concat([df, df_plc], ignore_index=True)
+		df_cached, fetched_at = self._cache.get(attribute, stock)
 
-		elif period=='quarter':
-			for stock in self.stock_list:
-				
-				df_plc = self.stocks.tickers[stock].quarterly_income_stmt.T.reset_index()
-				df_plc.rename(columns={'index': 'Date'},inplace=True)
-				df_plc['Ticker'] = stock
+		if df_cached is not None:
 
-				df = pd.concat([df, df_plc], ignore_index=True)
-		else:
-			raise ValueError("period argument has to be either 'year' or 'quarter'")
+			# Statements have one column per fiscal period (end date)
+			if len(df_cached.columns) > 0:
+				next_period_end = pd.Timestamp(max(df_cached.columns)) + pd.DateOffset(months=_STATEMENT_PERIODS[attribute])
+			else:
+				next_period_end = pd.Timestamp.min
+
+			# A new fiscal period can't have been reported yet, or it was checked recently
+			if pd.Timestamp.now() < next_period_end or time.time() - fetched_at < self.statement_recheck:
+				return df_cached
+
+		try:
+			df = self._fetch_ticker_with_retry(stock, attribute)
+		except Exception as e:
+			if df_cached is None:
+				raise
+
+			print(f'{stock}: {attribute} update failed, using cached data ({e})')
+			return df_cached
+
+		self._cache.put(attribute, stock, df)
 
 		return df
-	
-	def import_balance_sheet(self, period:Literal['year', 'quarter']='quarter'):
-		
-		df = pd.DataFrame(columns=dict(self.schemas['balance_sheet']))
 
-		if period=='year':
-			for stock in self.stock_list:
-				
-				df_plc = self.stocks.tickers[stock].balance_sheet.T.reset_index()
-				df_plc.rename(columns={'index': 'Date'},inplace=True)
-				df_plc['Ticker'] = stock
+	def _get_ticker_data(self, stock:str, attribute:str, **kwargs):
 
-				df = pd.concat([df, df_plc], ignore_index=True)
+		# Use the cache for the data that can be cached
+		if self._cache is not None:
 
-		elif period=='quarter':
-			for stock in self.stock_list:
-				
-				df_plc = self.stocks.tickers[stock].quarterly_balance_sheet.T.reset_index()
-				df_plc.rename(columns={'index': 'Date'},inplace=True)
-				df_plc['Ticker'] = stock
+			if attribute == 'history' and kwargs.get('period', '1mo') in _HISTORY_PERIODS and set(kwargs) <= {'period'}:
+				return self._get_history_cached(stock, **kwargs)
+
+			elif attribute in _STATEMENT_PERIODS and len(kwargs) == 0:
+				return self._get_statement_cached(stock, attribute)
+
+		return self._fetch_ticker_with_retry(stock, attribute, **kwargs)
+
+	def _fetch_all(self, attribute:str, stock_list:list=None, **kwargs) -> dict:
+
+		"""
+		Gets the data of every stock in stock_list (default: self.stock_list) concurrently.
+		Returns {stock: data} in the order of stock_list, without the stocks that failed.
+		"""
+
+		if stock_list is None:
+			stock_list = self.stock_list
+
+		dic_data = {}
+
+		with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(stock_list)))) as executor:
+
+			dic_futures = {stock: executor.submit(propagate(self._get_ticker_data), stock, attribute, **kwargs) for stock in stock_list}
+
+			for stock, future in dic_futures.items():
+				try:
+					dic_data[stock] = future.result()
+
+				# One ticker failing shouldn't fail the whole import
+				except Exception as e:
+					print(f'{stock}: {attribute} failed, skipping ticker ({e})')
+					self.failed_tickers.setdefault(stock, {})[attribute] = str(e)
+					continue
+
+				# The other imports' failures are kept (i.e. prices failing isn't forgotten when cashflow is fetched)
+				if attribute in self.failed_tickers.get(stock, {}):
+					del self.failed_tickers[stock][attribute]
+
+					if len(self.failed_tickers[stock]) == 0:
+						del self.failed_tickers[stock]
+
+		return dic_data
+
+	def normalize(self, frames:list, schema_name:str) -> pd.DataFrame:
+
+		"""
+		Concatenates the frames of all tickers in one go and casts the columns to the dtypes in the schema.
+		Columns of the schema come first, columns that aren't in the schema are kept after them.
+		'float' columns become self.float_dtype, 'int' columns nullable Int64 and Ticker categorical.
+		"""
 
-				df = pd.concat([df, df_plc], ignore_index=True)
+		schema = dict(self.schemas[schema_name])
+
+		if len(frames) == 0:
+			return pd.DataFrame(columns=list(schema))
+
+		df = pd.concat(frames, ignore_index=True)
+
+		columns = list(schema) + [col for col in df.columns if col not in schema]
+		df = df.reindex(columns=columns)
+
+		for col, dtype in schema.items():
+
+			if col == 'Ticker':
+				df[col] = df[col].astype('category')
+
+			elif dtype == 'float':
+				df[col] = pd.to_numeric(df[col], errors='coerce').astype(self.float_dtype)
+
+			elif dtype == 'int':
+				df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
+
+			# Dates from yfinance are already datetime (and may have a timezone), only convert the ones that aren't
+			elif dtype.startswith('datetime64') and not pd.api.types.is_datetime64_any_dtype(df[col]):
+				df[col] = pd.to_datetime(df[col], errors='coerce')
+
+		return df
+
+	def _fetch_statement(self, attribute:str) -> list:
+
+		frames = []
+
+		for stock, data in self._fetch_all(attribute).items():
+
+			df_plc = data.T.reset_index()
+			df_plc.rename(columns={'index': 'Date'},inplace=True)
+			df_plc['Ticker'] = stock
+
+			frames.append(df_plc)
+
+		return frames
+
+	def _get_statement_attribute(self, statement:str, period:str) -> str:
+
+		if period=='year':
+			return statement
+		elif period=='quarter':
+			return f'quarterly_{statement}'
 		else:
 			raise ValueError("period argument has to be either 'year' or 'quarter'")
 
-		return df
+	# The fetch_* methods return the raw frame of each ticker, normalize() turns them into one frame
+	# import_* does both, they're separate so that fetching and normalizing can be done in different stages
+	def fetch_stocks(self, period:Literal['1d', '5d', '1mo', '3mo', '6mo', '1y', '2y', '5y', '10y', 'ytd', 'max']='5y') -> list:
+
+		frames = []
+
+		for stock, data in self._fetch_all('history', period=period).items():
+
+			df_plc = data.reset_index()
+			df_plc['Ticker'] = stock
+
+			frames.append(df_plc)
+
+		return frames
+
+	def fetch_cashflow(self, period:Literal['year', 'quarter']='quarter') -> list:
+		return self._fetch_statement(attribute=self._get_statement_attribute(statement='cashflow', period=period))
+
+	def fetch_income_stmt(self, period:Literal['year', 'quarter']='quarter') -> list:
+		return self._fetch_statement(attribute=self._get_statement_attribute(statement='income_stmt', period=period))
+
+	def fetch_balance_sheet(self, period:Literal['year', 'quarter']='quarter') -> list:
+		return self._fetch_statement(attribute=self._get_statement_attribute(statement='balance_sheet', period=period))
+	
+	def import_stocks(self, period:Literal['1d', '5d', '1mo', '3mo', '6mo', '1y', '2y', '5y', '10y', 'ytd', 'max']='5y'):
+		return self.normalize(frames=self.fetch_stocks(period=period), schema_name='stocks')
+
+	def import_cashflow(self, period:Literal['year', 'quarter']='quarter'):
+		return self.normalize(frames=self.fetch_cashflow(period=period), schema_name='cashflow')
+	
+	def import_income_stmt(self, period:Literal['year', 'quarter']='quarter'):
+		return self.normalize(frames=self.fetch_income_stmt(period=period), schema_name='income_stmt')
+	
+	def import_balance_sheet(self, period:Literal['year', 'quarter']='quarter'):
+		return self.normalize(frames=self.fetch_balance_sheet(period=period), schema_name='balance_sheet')
 	
 	def import_actions(self):
 
-		df = pd.DataFrame(columns=dict(self.schemas['actions']))
+		frames = []
 
-		for stock in self.stock_list:
+		for stock, data in self._fetch_all('actions').items():
 
-			df_plc = self.stocks.tickers[stock].actions.reset_index()
+			df_plc = data.reset_index()
 			df_plc['Ticker'] = stock
 
-			df = pd.concat([df, df_plc], ignore_index=True)
+			frames.append(df_plc)
 
-		return df
+		return self.normalize(frames=frames, schema_name='actions')
 	
 	def import_shares_count(self, start_date:str, end_date:str=None):
 
-		df = pd.DataFrame(columns=dict(self.schemas['shares_count']))
+		frames = []
 
-		for stock in self.stock_list:
+		for stock, data in self._fetch_all('get_shares_full', start=start_date, end=end_date).items():
 
-			df_plc = self.stocks.tickers[stock].get_shares_full(start=start_date, end=end_date).reset_index()
-			df_plc.rename(columns={'index': 'Date', '0': 'Shares Count'},inplace=True)
+			df_plc = data.reset_index()
+			# get_shares_full() returns an unnamed series, its values end up in column 0
+			df_plc.rename(columns={'index': 'Date', 0: 'Shares Count', '0': 'Shares Count'},inplace=True)
 			df_plc['Ticker'] = stock
 
-			df = pd.concat([df, df_plc], ignore_index=True)
+			frames.append(df_plc)
 
-		return df
+		return self.normalize(frames=frames, schema_name='shares_count')
 	
-	def _get_news_links(self, dic_urls:dict, driver=None, max_links:int=10, scroll_amount:int=1000, scroll_limit:int=10, pause_time:int=5):
+	def _extract_new_links(self, driver, n_items_parsed:int, news_links:list, max_links:int) -> int:
+
+		"""
+		Parses only the stream items added since the last call (items after n_items_parsed)
+		and adds their links to news_links, skipping links that are already in it.
+		Returns the number of stream items parsed so far.
+		"""
+
+		# One round trip to get the HTML of the new items, not the whole page
+		list_item_html = driver.execute_script(_NEW_STREAM_ITEMS_JS, STREAM_ITEM_SELECTOR, n_items_parsed)
+
+		if len(list_item_html) == 0:
+			return n_items_parsed
+
+		soup = BeautifulSoup(''.join(list_item_html), HTML_PARSER, parse_only=_NEWS_LINK_STRAINER)
+
+		for link in soup.find_all('a', class_=_NEWS_LINK_CLASS):
+
+			href = link.get('href')
+
+			if href is not None and href not in news_links:
+				news_links.append(href)
+
+				if len(news_links) >= max_links:
+					break
+
+		return n_items_parsed + len(list_item_html)
+
+	def _get_ticker_news_links(self, driver, url:str, max_links:int=10, scroll_amount:int=1000, scroll_limit:int=10, wait_timeout:float=5) -> list:
+
+		# Load the news webpage on the Chrome driver
+		driver.get(url)
+
+		# Links in the order they show up on the page, without duplicates
+		news_links = []
+
+		# Go to the bottom of the screen as a first action
+		# This is done to load more news. Yahoo news is infinite scrolling
+		ActionChains(driver).scroll_by_amount(0, 10000).perform()
+
+		n_items_parsed = self._extract_new_links(driver=driver, n_items_parsed=0, news_links=news_links, max_links=max_links)
+
+		# Scroll limit is the maximum number of scrolls we do
+		# This is a measure against Yahoo News' infinite scrolling
+		# Either we get the max number of links we need or we scroll the maximum number of times
+		for _ in range(scroll_limit):
+			
+			# If we have the max number of links, we exit the loop
+			if len(news_links) >= max_links:
+				break
+
+			# Scroll down in smaller steps
+			ActionChains(driver).scroll_by_amount(0, scroll_amount).perform()
+			
+			# Wait until new stream items are loaded instead of a fixed pause
+			# If nothing new shows up, the page has no more news to load
+			try:
+				WebDriverWait(driver, wait_timeout).until(
+					lambda d: d.execute_script(_COUNT_STREAM_ITEMS_JS, STREAM_ITEM_SELECTOR) > n_items_parsed
+				)
+			except TimeoutException:
+				break
+
+			n_items_parsed = self._extract_new_links(driver=driver, n_items_parsed=n_items_parsed, news_links=news_links, max_links=max_links)
+
+		return news_links[0:max_links]
+
+	def _get_news_links(self, dic_urls:dict, driver_pool:'DriverPool'=None, max_links:int=10, scroll_amount:int=1000, scroll_limit:int=10, wait_timeout:float=5):
 
 		"""
 		This method is to get links from Yahoo news page.
 		It's specifically designed only for Yahoo news page.
-		It uses selenium to load the webpage with a Chrome driver (other drivers possible too).
-		And then beautifulsoup to parse the HTML of the webpage.
+		It uses selenium to load the webpage with headless Chrome drivers (from driver_pool), one driver per stock at a time.
+		And then beautifulsoup to parse the HTML of the newly loaded news items after each scroll.
 		By default it returns 10 links.
 		This method is to be used in conjunction with _get_articles()
 		"""
 
-		# If driver isn't given, we define it here and then close it at the end of the method
-		if driver is None:
-			driver = webdriver.Chrome()
+		# If driver_pool isn't given, we define it here and then close it at the end of the method
+		close_pool = driver_pool is None
+
+		if close_pool:
+			driver_pool = DriverPool()
+
+		def get_links(url:str) -> list:
+			with driver_pool.driver() as driver:
+				return self._get_ticker_news_links(
+					driver=driver, 
+					url=url, 
+					max_links=max_links, 
+					scroll_amount=scroll_amount, 
+					scroll_limit=scroll_limit, 
+					wait_timeout=wait_timeout
+				)
+
+		try:
+			# Each stock has its own news webpage, they're loaded at the same time (up to the size of the pool)
+			with ThreadPoolExecutor(max_workers=max(1, min(driver_pool.size, len(dic_urls)))) as executor:
+				dic_futures = {stock: executor.submit(propagate(get_links), url) for stock, url in dic_urls.items()}
+				dic_links = {stock: future.result() for stock, future in dic_futures.items()}
+
+		finally:
+			if close_pool:
+				# Close drivers, we don't need them anymore
+				driver_pool.close()
 
-		# Set up empty dictionary to store links later
-		dic_links = {}
+		return dic_links
 
-		# Loop through each stock
-		# Each stock will have its own news webpage
-		for stock in dic_urls:
-			
-			# Load the news webpage on the Chrome driver
-			driver.get(dic_urls[stock])
-
-			# Set empty list to store the links later
-			news_links = []
-
-			# Go to the bottom of the screen as a first action
-			# This is done to load more news. Yahoo news is infinite scrolling
-			ActionChains(driver).scroll_by_amount(0, 10000).perform()
-
-			# Scroll limit is the maximum number of scrolls we do
-			# This is a measure against Yahoo News' infinite scrolling
-			# Either we get the max number of links we need or we scroll the maximum number of times
-			for _ in range(scroll_limit):
-				
-				# If we have the max number of links, we exit the loop
-				if len(news_links) >= max_links:
-					break
+	def _parse_article(self, html:str) -> str:
 
-				# Scroll down in smaller steps
-				ActionChains(driver).scroll_by_amount(0, scroll_amount).perform()
-				
-				# Wait for new content to load
-				time.sleep(pause_time)
+		"""Returns the text of an article page, None if the article body isn't in the HTML (i.e. it's loaded with JavaScript)."""
 
-				# Parse the page source with BeautifulSoup
-				soup = BeautifulSoup(driver.page_source, 'html.parser')
+		# Only the body-wrap <div> is parsed, the rest of the page is skipped
+		soup = BeautifulSoup(html, HTML_PARSER, parse_only=_ARTICLE_STRAINER)
 
-				# Example: Select elements with the class "stream-items"
-				stream_items = soup.select('ul[class^="stream-items"]')
+		# Find the <div> with class starting with "body-wrap%"
+		body_wrap = soup.find('div', class_=_ARTICLE_BODY_WRAP_CLASS)
 
-				# Iterate through each <ul> element found
-				for ul in stream_items:
-					# Find all <a> elements where class starts with "subtle-link fin-size-small titles"
-					links = ul.find_all('a', class_=re.compile(r'^subtle-link fin-size-small titles'))
+		if body_wrap is None:
+			return None
 
-					# Extract the href from each <a> element
-					for link in links:
+		# If the first body-wrap is found, look inside for <div class="body%">
+		body_content = body_wrap.find('div', class_=_ARTICLE_BODY_CLASS)
 
-						news_links.append(link.get('href'))
+		if body_content is None:
+			return None
 
-			dic_links[stock] = news_links[0:max_links]
+		# Extract all <p> tags inside it
+		paragraphs = body_content.find_all('p')
 
-		if driver is None:
-			# Close driver, we don't need it anymore
-			driver.quit()
+		# Collect the article text
+		return "\n".join([p.get_text() for p in paragraphs])
 
-		return dic_links
-	
-	def _get_articles(self, dic_links:dict, driver=None, pause_time:int=3):
-		
-		if driver is None:
-			driver = webdriver.Chrome()
+	def _fetch_articles_http(self, links:list, max_connections:int=10, timeout:float=10) -> dict:
 
-		dic_html = {}
-		
-		for stock_links in dic_links:
-			
-			dic_html[stock_links] = []
+		"""
+		Gets the HTML of all links concurrently with one pooled async HTTP client.
+		Returns {link: html}, links that failed are left out.
+		"""
 
-			for link in dic_links[stock_links]:
+		async def fetch_all() -> dict:
 
-				driver.get(link)
+			semaphore = asyncio.Semaphore(max_connections)
+			limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
 
-				time.sleep(pause_time)
-			
-				soup = BeautifulSoup(driver.page_source, 'html.parser')
+			async with httpx.AsyncClient(headers=HTTP_HEADERS, limits=limits, timeout=timeout, follow_redirects=True) as client:
+
+				async def fetch(link:str):
+					async with semaphore:
+						try:
+							with span('article_fetch', source='http') as fetch_span:
+								response = await client.get(link)
+								response.raise_for_status()
+								fetch_span.set(bytes=len(response.content))
+							return link, response.text
+						except httpx.HTTPError as e:
+							print(f'{link} could not be fetched over HTTP ({e})')
+							return link, None
+
+				results = await asyncio.gather(*[fetch(link) for link in links])
+
+			return {link: html for link, html in results if html is not None}
+
+		return _run_async(fetch_all())
+
+	def _fetch_article_with_driver(self, driver_pool:'DriverPool', link:str, wait_timeout:float=10) -> str:
+
+		with driver_pool.driver() as driver, span('article_fetch', source='driver') as fetch_span:
+
+			driver.get(link)
+
+			# Wait for the article body instead of a fixed pause
+			try:
+				WebDriverWait(driver, wait_timeout).until(
+					EC.presence_of_element_located((By.CSS_SELECTOR, 'div[class^="body-wrap"]'))
+				)
+			except TimeoutException:
+				print(f'{link}: article body not found')
 
-				# Find the <div> with class starting with "body-wrap%"
-				body_wrap = soup.find('div', class_=re.compile(r'^body-wrap'))
+			page_source = driver.page_source
+			fetch_span.set(bytes=len(page_source.encode('utf-8')))
 
-				# If the first body-wrap is found, look inside for <div class="body%">
-				if body_wrap:
-					body_content = body_wrap.find('div', class_=re.compile(r'^body'))
+			return page_source
 
-					# If body-content is found, extract all <p> tags inside it
-					# if body_content:
-					paragraphs = body_content.find_all('p')
+	def _get_articles(self, dic_links:dict, driver_pool:'DriverPool'=None, max_connections:int=10, wait_timeout:float=10):
 
-					# Collect the article text
-					article_text = "\n".join([p.get_text() for p in paragraphs])
+		"""
+		Links are deduplicated first (by normalized url), so a story listed under several stocks is only fetched once.
+		Articles already in the cache aren't fetched again.
+		The others are fetched over plain HTTP first (no browser needed for most of them),
+		articles whose body isn't in the HTML are loaded with the headless drivers of driver_pool.
+		Returns {stock: [article text, article text]}, the same article text is only listed once per stock.
+		"""
+
+		# One link for each story
+		dic_link_keys = {link: normalize_url(link) for links in dic_links.values() for link in links}
+		dic_key_links = {}
+
+		for link, url_key in dic_link_keys.items():
+			dic_key_links.setdefault(url_key, link)
+
+		if self._cache is not None:
+			dic_cached = self._cache.get_articles(urls=list(dic_key_links.values()))
+		else:
+			dic_cached = {}
+
+		dic_text = {normalize_url(link): article['text'] for link, article in dic_cached.items()}
+
+		# The cache has the hash of each article, only new articles are hashed
+		dic_hash = {normalize_url(link): article['content_hash'] for link, article in dic_cached.items()}
+
+		list_links = [link for url_key, link in dic_key_links.items() if url_key not in dic_text]
+
+		print(f'{len(dic_key_links)} unique articles, {len(dic_key_links) - len(list_links)} cached, fetching {len(list_links)}')
+
+		dic_html = self._fetch_articles_http(links=list_links, max_connections=max_connections) if len(list_links) > 0 else {}
+		dic_text_new = {link: self._parse_article(html) for link, html in dic_html.items()}
+
+		list_links_driver = [link for link in list_links if dic_text_new.get(link) is None]
+
+		if len(list_links_driver) > 0:
+
+			print(f'{len(list_links_driver)} articles need a browser')
+
+			close_pool = driver_pool is None
 
-					# Store the article text by the link in the dictionary
-					dic_html[stock_links].append(article_text)
+			if close_pool:
+				driver_pool = DriverPool()
 
-		if driver is None:
-			driver.quit()
+			try:
+				with ThreadPoolExecutor(max_workers=max(1, min(driver_pool.size, len(list_links_driver)))) as executor:
+					dic_futures = {link: executor.submit(propagate(self._fetch_article_with_driver), driver_pool, link, wait_timeout) for link in list_links_driver}
+					
+					for link, future in dic_futures.items():
+						try:
+							dic_text_new[link] = self._parse_article(future.result())
+						except WebDriverException as e:
+							print(f'{link} could not be loaded ({e})')
 
-		return dic_html
+			finally:
+				if close_pool:
+					driver_pool.close()
 
-	def get_stock_news(self, max_news:int=10):
+		# Articles without a body aren't cached, so they're tried again next time
+		# Each new article is hashed once, the hash is used for the cache and for the dedup below
+		dic_articles_new = {link: (text, get_text_hash(text)) for link, text in dic_text_new.items() if text is not None}
+
+		if self._cache is not None and len(dic_articles_new) > 0:
+			self._cache.put_articles(dic_articles=dic_articles_new)
+
+		dic_text.update({normalize_url(link): text for link, (text, _) in dic_articles_new.items()})
+		dic_hash.update({normalize_url(link): content_hash for link, (_, content_hash) in dic_articles_new.items()})
+
+		dic_articles = {}
+
+		for stock, links in dic_links.items():
+
+			dic_articles[stock] = []
+			set_hashes = set()
+
+			for link in links:
+				url_key = dic_link_keys[link]
+
+				# Articles without a body are left out
+				if url_key not in dic_text or dic_hash[url_key] in set_hashes:
+					continue
+
+				set_hashes.add(dic_hash[url_key])
+				dic_articles[stock].append(dic_text[url_key])
+
+		return dic_articles
+
+	def get_stock_news(self, max_news:int=10, news_url:str='https://finance.yahoo.com/quote/{stock}/news/', pool_size:int=2):
+
+		"""
+		news_url is the news page of each stock, {stock} is replaced by the ticker.
+		pool_size is the number of headless browsers used at the same time.
+		"""
 		
 		dic_urls = {}
-		driver = webdriver.Chrome()
 
 		for stock in self.stock_list:
 			
-			dic_urls[stock] = f'https://finance.yahoo.com/quote/{stock}/news/'
+			dic_urls[stock] = news_url.format(stock=stock)
+
+		driver_pool = DriverPool(size=pool_size)
 
-		dic_links = self._get_news_links(dic_urls=dic_urls, driver=driver, max_links=max_news)
+		try:
+			dic_links = self._get_news_links(dic_urls=dic_urls, driver_pool=driver_pool, max_links=max_news)
 
-		dic_articles = self._get_articles(dic_links=dic_links, driver=driver)
+			dic_articles = self._get_articles(dic_links=dic_links, driver_pool=driver_pool)
 
-		driver.quit()
+		finally:
+			driver_pool.close()
 
-		return dic_links, dic_articles
\ No newline at end of file
+		return dic_links, dic_articles